@@ -0,0 +1,34 @@
+import faker
+import markdown as md
+from django.core.management.base import BaseCommand
+
+from blog.rendering import EXTENSIONS, render_markdown
+from blog.templatetags.markdown_processing import RenderCache
+from core.bench import median_ms
+
+
+class Command(BaseCommand):
+    help = 'Time a markdown render per call: a new Markdown each time, a reused one, and the filter cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        fake = faker.Faker()
+        texts = {
+            'preview': fake.sentence(nb_words=12),
+            'comment': '\n\n'.join(fake.paragraph(nb_sentences=5) for _ in range(2)),
+            # the size of a PostFactory post
+            'post': ''.join('\n' + fake.paragraph(nb_sentences=30) + '\n' for _ in range(5)),
+        }
+        for name, text in texts.items():
+            cache = RenderCache()
+            cache.render(text)
+            timings = {
+                'markdown.markdown': lambda: md.markdown(text, extensions=EXTENSIONS),
+                'reused converter': lambda: render_markdown(text),
+                'filter, cached': lambda: cache.render(text),
+            }
+            for label, run in timings.items():
+                elapsed = median_ms(run, options['repeat']) * 1000
+                self.stdout.write(f'{name:<8} {len(text):>6} chars  {label:<18} {elapsed:10.1f} us')
@@ -0,0 +1,73 @@
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.search import DatabaseBackend, Fts5Backend, SearchPaginator
+from blog.views import listed
+from core.bench import median_ms, rolled_back
+from core.fulltext import parse_query
+
+WORDS = ['django', 'python', 'database', 'deployment', 'cache', 'query', 'index', 'template', 'model', 'view',
+         'docker', 'server', 'request', 'response', 'migration', 'testing', 'frontend', 'backend', 'async', 'api']
+# a vocabulary with zipfian word frequencies like real text, the words above are among the common ones
+VOCABULARY = [word for pair in zip(WORDS, [f'word{i}' for i in range(len(WORDS))]) for word in pair] + \
+             [f'word{i}' for i in range(len(WORDS), 20_000)]
+CUMULATIVE = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+
+def text(k):
+    return ' '.join(random.choices(VOCABULARY, cum_weights=CUMULATIVE, k=k))
+
+
+class Command(BaseCommand):
+    help = 'Compare the post search backends with the title__icontains filter they replaced'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        for rows in options['rows']:
+            with rolled_back():
+                self.populate(rows)
+                backends = {'database': DatabaseBackend()}
+                if Fts5Backend.available():
+                    backends['fts5'] = Fts5Backend()
+                    started = time.perf_counter()
+                    backends['fts5'].rebuild()
+                    self.stdout.write(f'fts5 index built in {time.perf_counter() - started:.2f} s')
+                # unique word, common word, less common word, prefix and phrase
+                for query in (f'unique{rows // 2}', 'docker', 'word150', 'migr*', '"cache query"'):
+                    self.report(rows, query, backends, options['repeat'])
+
+    def populate(self, rows):
+        self.stdout.write(f'Creating {rows} posts...')
+        batch = []
+        for i in range(rows):
+            title = text(6)
+            content = '\n\n'.join(text(60) for _ in range(5))
+            if i == rows // 2:
+                content += f' unique{i}'
+            # bulk_create skips save() and the signals: no html, the fts5 index is rebuilt afterwards
+            batch.append(Post(title=title, subtitle=text(4), slug=f'bench-{rows}-{i}',
+                              content=content, status='published'))
+            if len(batch) == 5000:
+                Post.objects.bulk_create(batch)
+                batch = []
+        Post.objects.bulk_create(batch)
+
+    def report(self, rows, query, backends, repeat):
+        terms = parse_query(query)
+        needle = ' '.join(words[0] if kind == 'prefix' else ' '.join(words) for kind, words in terms)
+        published = Post.objects.filter(status='published')
+        timings = {
+            'title icontains': lambda: list(published.filter(title__icontains=needle).defer('content')[:10]),
+        }
+        for name, backend in backends.items():
+            timings[f'{name}, first page'] = lambda backend=backend: backend.search(terms, None, 10)
+        timings['view page'] = lambda: SearchPaginator(listed(published, excerpt=True), 10, query=query).page()
+        for name, run in timings.items():
+            self.stdout.write(f'{rows:>9} rows  {query!r:<16} {name:<20} {median_ms(run, repeat):9.2f} ms')
@@ -0,0 +1,50 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.rendering import content_hash, render_many
+
+
+class Command(BaseCommand):
+    help = 'Render the markdown of the posts whose stored html is out of date, in a pool of processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='render every post, not only the out of date ones')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='rendering processes')
+        parser.add_argument('--batch-size', type=int, default=100, help='posts sent to a process at a time')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        workers, batch_size = max(1, options['workers']), options['batch_size']
+        pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        rendered = 0
+        group = []
+        try:
+            rows = Post.objects.order_by('id').values_list('id', 'content', 'content_hash').iterator(1000)
+            for pk, content, stored_hash in rows:
+                if options['all'] or stored_hash != content_hash(content):
+                    group.append((pk, content))
+                # a few batches per process at a time, the contents of every post never sit in memory together
+                if len(group) == batch_size * workers * 2:
+                    rendered += self.render(pool, group, batch_size)
+                    group = []
+            rendered += self.render(pool, group, batch_size)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered} posts in {time.perf_counter() - started:.2f} s.'))
+
+    def render(self, pool, group, batch_size):
+        batches = [group[start:start + batch_size] for start in range(0, len(group), batch_size)]
+        contents = [[content for pk, content in batch] for batch in batches]
+        results = pool.map(render_many, contents) if pool is not None else map(render_many, contents)
+        posts = [Post(id=pk, content_hash=hash_, content_html=html)
+                 for batch, rendered in zip(batches, results)
+                 for (pk, content), (hash_, html) in zip(batch, rendered)]
+        # bulk_update leaves updated_at alone, rendering doesn't change the post
+        Post.objects.bulk_update(posts, ['content_html', 'content_hash'], batch_size=500)
+        return len(posts)
@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE blog_post_fts "
+                           "USING fts5(title, subtitle, content, tags, tokenize='unicode61', prefix='2 3')")
+        except OperationalError:  # SQLite built without FTS5, search uses blog.search.DatabaseBackend
+            return
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    content_type = ContentType.objects.filter(app_label='blog', model='post').first()
+    if content_type is None:  # a new database, nothing was tagged yet
+        tags = "''"
+    else:
+        tags = ("COALESCE((SELECT group_concat(tag.name, ' ') FROM taggit_taggeditem item "
+                "JOIN taggit_tag tag ON tag.id = item.tag_id "
+                f"WHERE item.object_id = post.id AND item.content_type_id = {content_type.id}), '')")
+    schema_editor.execute("INSERT INTO blog_post_fts(rowid, title, subtitle, content, tags) "
+                          f"SELECT post.id, post.title, COALESCE(post.subtitle, ''), post.content, {tags} "
+                          "FROM blog_post post WHERE post.status = 'published'")
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS blog_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_post_published_index'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
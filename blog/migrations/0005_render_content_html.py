@@ -0,0 +1,40 @@
+from django.db import migrations
+
+from blog.rendering import content_hash, render_many
+
+BATCH_SIZE = 500
+
+
+def render_stored_posts(apps, schema_editor):
+    """
+    Fill content_html of the posts written before 0002, so none of them renders markdown on the
+    read path. One process: rerender_posts spreads the work over several for large tables.
+    """
+    Post = apps.get_model('blog', 'Post')
+    rows = Post.objects.order_by('id').values_list('id', 'content', 'content_hash').iterator(1000)
+    group = []
+    for pk, content, stored_hash in rows:
+        if stored_hash != content_hash(content):
+            group.append((pk, content))
+        if len(group) == BATCH_SIZE:
+            save_rendered(Post, group)
+            group = []
+    save_rendered(Post, group)
+
+
+def save_rendered(Post, group):
+    rendered = render_many([content for pk, content in group])
+    posts = [Post(id=pk, content_hash=hash_, content_html=html) for (pk, content), (hash_, html) in zip(group, rendered)]
+    Post.objects.bulk_update(posts, ['content_html', 'content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_post_fts'),
+    ]
+
+    operations = [
+        # the html is dropped with the columns when 0002 is reversed
+        migrations.RunPython(render_stored_posts, migrations.RunPython.noop),
+    ]
@@ -4,6 +4,8 @@ from django.template.defaultfilters import truncatechars
 from django.urls import reverse
 from taggit.managers import TaggableManager
 
+from blog.rendering import content_hash, render_markdown
+
 
 class Post(models.Model):
     options = (
@@ -20,6 +22,9 @@ class Post(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=10, choices=options, default='draft')
     count = models.IntegerField(null=True)
+    # content rendered to html when it's saved, valid while content_hash matches the content
+    content_html = models.TextField(blank=True, default='', editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
 
     tags = TaggableManager()
 
@@ -28,11 +33,34 @@ class Post(models.Model):
         return truncatechars(self.title, 80)
 
 
+    @property
+    def rendered_content(self):
+        """ The html of the content, rendered on the spot only when the stored one is out of date """
+        if self.content_hash == content_hash(self.content):
+            return self.content_html
+        return render_markdown(self.content)
+
+    def render_content(self):
+        self.content_html = render_markdown(self.content)
+        self.content_hash = content_hash(self.content)
+
+    def save(self, *args, **kwargs):
+        if self.content_hash != content_hash(self.content):
+            self.render_content()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'content_html', 'content_hash'}
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('post_single', args=[self.slug])
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            # the published posts newest first, the keyset of blog.pagination
+            models.Index(fields=['status', '-created_at', '-id'], name='post_published_idx'),
+        ]
 
     def __str__(self):
         return self.title
\ No newline at end of file
@@ -0,0 +1,68 @@
+from django.db.models import Q
+from django.http import Http404
+
+from core.cursors import decode_cursor, encode_cursor
+
+
+class CursorPage:
+    """ A page of a CursorPaginator, with the page_obj methods the templates use """
+
+    def __init__(self, object_list, cursor, next_cursor):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class CursorPaginator:
+    """
+    Pages of a queryset newest first, read with a keyset on (created_at, id) instead of an OFFSET,
+    so a deep page costs the same as the first one, and without the COUNT(*) of Paginator.
+    """
+    ordering = ('-created_at', '-id')
+
+    def __init__(self, object_list, per_page, **kwargs):
+        self.object_list = object_list
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        posts = self.object_list.order_by(*self.ordering)
+        if cursor:
+            created_at, last_id = decode_cursor(cursor)
+            # (created_at, id) < cursor, written so that sqlite seeks the index on created_at instead of
+            # filtering every post before the cursor
+            posts = posts.filter(Q(created_at__lte=created_at) & ~Q(created_at=created_at, id__gte=last_id))
+        posts = list(posts[:self.per_page + 1])
+        next_cursor = None
+        if len(posts) > self.per_page:
+            posts = posts[:self.per_page]
+            next_cursor = encode_cursor(posts[-1].created_at, posts[-1].id)
+        return CursorPage(posts, cursor or None, next_cursor)
+
+
+class CursorPaginationMixin:
+    """ ListView pagination by CursorPaginator, the cursor of the page is the ``after`` parameter """
+    paginator_class = CursorPaginator
+    cursor_kwarg = 'after'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_paginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except ValueError:
+            raise Http404('Invalid cursor')
+        return paginator, page, page.object_list, page.has_other_pages()
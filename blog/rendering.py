@@ -0,0 +1,36 @@
+import hashlib
+import threading
+
+import markdown as md
+
+# changing these (or upgrading Markdown) changes every content hash, run rerender_posts afterwards
+EXTENSIONS = ['markdown.extensions.fenced_code']
+SIGNATURE = f'{md.__version__}:{",".join(EXTENSIONS)}'
+
+
+_local = threading.local()
+
+
+def converter():
+    """
+    The Markdown instance of this thread. Building one loads the extensions and sets up every
+    processor, which costs more than converting a short text, so each thread keeps its own.
+    """
+    if not hasattr(_local, 'markdown'):
+        _local.markdown = md.Markdown(extensions=EXTENSIONS)
+    return _local.markdown
+
+
+def render_markdown(text):
+    # reset() clears what the previous conversion left behind (references, footnotes, ...)
+    return converter().reset().convert(text)
+
+
+def content_hash(text):
+    """ The hash of ``text`` rendered with the current extensions, what Post.content_hash is compared with """
+    return hashlib.sha256(f'{SIGNATURE}\0{text}'.encode()).hexdigest()
+
+
+def render_many(texts):
+    """ (hash, html) of each text, run in the worker processes of rerender_posts """
+    return [(content_hash(text), render_markdown(text)) for text in texts]
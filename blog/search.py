@@ -0,0 +1,164 @@
+from functools import reduce
+from operator import and_
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from taggit.models import Tag, TaggedItem
+
+from core import fulltext
+from core.fulltext import make_cursor, parse_query, split_cursor
+
+from .models import Post
+from .pagination import CursorPage
+
+FTS_TABLE = 'blog_post_fts'
+# bm25() weights of the title, subtitle, content and tags columns
+WEIGHTS = (10.0, 5.0, 1.0, 2.0)
+SNIPPET_WORDS = 24
+# snippet() marks the matches with these, they can't be in the text and survive escaping
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def searchable(posts):
+    """ (id, title, subtitle, content, tag names) of the published ``posts``, one query for the tags """
+    rows = []
+    for post in posts:
+        if post.status == 'published':
+            tags = ' '.join(tag.name for tag in post.tags.all())
+            rows.append((post.id, post.title, post.subtitle or '', post.content, tags))
+    return rows
+
+
+def highlight(snippet):
+    """ The escaped snippet with its matches in <mark> """
+    html = escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+    return mark_safe(html)
+
+
+class SearchBackend:
+    """
+    Where PostSearchView finds posts. search() returns ``limit + 1`` (score, post id, snippet)
+    rows after the (score, id) ``cursor`` in the order of the backend, lower scores first.
+    """
+    name = None
+
+    @staticmethod
+    def available():
+        return True
+
+    def index(self, posts):
+        """ Add or refresh ``posts``, the ones that aren't published leave the index """
+
+    def remove(self, post_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, terms, cursor, limit):
+        raise NotImplementedError
+
+
+class Fts5Backend(SearchBackend):
+    """ The blog_post_fts table of migration 0004, ranked by fts5's bm25() with the title first """
+    name = 'fts5'
+
+    @staticmethod
+    def available():
+        return fulltext.fts5_available(FTS_TABLE)
+
+    def index(self, posts):
+        posts = list(posts)
+        self.remove([post.id for post in posts])
+        self._insert(posts)
+
+    def _insert(self, posts):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {FTS_TABLE}(rowid, title, subtitle, content, tags) '
+                               f'VALUES (%s, %s, %s, %s, %s)', searchable(posts))
+
+    def remove(self, post_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(post_id,) for post_id in post_ids])
+
+    def rebuild(self):
+        """ Index every published post with one INSERT ... SELECT, the tag names gathered by group_concat """
+        content_type = ContentType.objects.get_for_model(Post)
+        tags = (f"SELECT group_concat(tag.name, ' ') FROM {TaggedItem._meta.db_table} item "
+                f"JOIN {Tag._meta.db_table} tag ON tag.id = item.tag_id "
+                f"WHERE item.object_id = post.id AND item.content_type_id = %s")
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(f"INSERT INTO {FTS_TABLE}(rowid, title, subtitle, content, tags) "
+                           f"SELECT post.id, post.title, COALESCE(post.subtitle, ''), post.content, "
+                           f"COALESCE(({tags}), '') FROM {Post._meta.db_table} post WHERE post.status = 'published'",
+                           [content_type.id])
+
+    def search(self, terms, cursor, limit):
+        snippet = f"snippet({FTS_TABLE}, 2, '{MARK_START}', '{MARK_END}', '…', {SNIPPET_WORDS})"
+        rows = fulltext.search(FTS_TABLE, terms, cursor, limit, weights=WEIGHTS, columns=[snippet])
+        return [(score, post_id, highlight(snippet)) for post_id, score, snippet in rows]
+
+
+class DatabaseBackend(SearchBackend):
+    """
+    Every word in the title, subtitle, content or tags with icontains, newest first and unranked:
+    a scan of the post table, for databases without FTS5.
+    """
+    name = 'database'
+
+    def search(self, terms, cursor, limit):
+        words = [' '.join(words) for kind, words in terms]
+        matches = [Q(title__icontains=word) | Q(subtitle__icontains=word) | Q(content__icontains=word) |
+                   Q(tags__name__icontains=word) for word in words]
+        post_ids = Post.objects.filter(status='published').filter(
+            id__in=Post.objects.filter(reduce(and_, matches)).values('id')).order_by('-id')
+        if cursor:
+            post_ids = post_ids.filter(id__lt=cursor[1])
+        return [(0.0, post_id, None) for post_id in post_ids.values_list('id', flat=True)[:limit + 1]]
+
+
+BACKENDS = {backend.name: backend for backend in (Fts5Backend, DatabaseBackend)}
+_backends = {}
+
+
+def get_backend():
+    """ fts5 when the table exists, the database scan otherwise; BLOG_SEARCH_BACKEND forces one """
+    name = getattr(settings, 'BLOG_SEARCH_BACKEND', None)
+    if name is None:
+        name = 'fts5' if Fts5Backend.available() else 'database'
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+class SearchPaginator:
+    """
+    Pages of the posts of ``object_list`` matching ``query``, best matches first, with their
+    snippets in ``post.snippet``. The cursor is the "<score>:<id>" of the last post of a page.
+    """
+
+    def __init__(self, object_list, per_page, query='', **kwargs):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.terms = parse_query(query)
+
+    def page(self, cursor=None):
+        if not self.terms:
+            return CursorPage([], cursor or None, None)
+        rows = get_backend().search(self.terms, split_cursor(cursor) if cursor else None, self.per_page)
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = make_cursor(*rows[-1][:2])
+        posts = self.object_list.in_bulk([post_id for score, post_id, snippet in rows])
+        page = []
+        for score, post_id, snippet in rows:
+            if post_id in posts:
+                posts[post_id].snippet = snippet
+                page.append(posts[post_id])
+        return CursorPage(page, cursor or None, next_cursor)
@@ -0,0 +1,68 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from taggit.models import Tag
+
+from .models import Post
+from .search import get_backend
+from .tag_cloud import invalidate_tag_cloud
+
+
+@receiver(post_save, sender=Post)
+def update_search_index_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_backend().index([instance])
+
+
+@receiver(post_delete, sender=Post)
+def update_search_index_on_delete(sender, instance, **kwargs):
+    get_backend().remove([instance.id])
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_search_index_on_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """ The tag names are indexed with the post """
+    if reverse and action == 'pre_clear':
+        # tag.<posts>.clear() has no pk_set, remember the posts losing the tag
+        instance._search_post_ids = list(Post.objects.filter(tags=instance).values_list('id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        get_backend().index([instance])
+    elif action == 'post_clear':
+        reindex(instance.__dict__.pop('_search_post_ids', []))
+    elif pk_set:  # tag.<posts>.add(...)
+        reindex(pk_set)
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_posts(sender, instance, **kwargs):
+    instance._search_post_ids = list(Post.objects.filter(tags=instance).values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Tag)
+def update_search_index_on_tag_change(sender, instance, created=False, raw=False, **kwargs):
+    """ A tag renamed or deleted changes the indexed tag names of its posts """
+    if created or raw:
+        return
+    if '_search_post_ids' in instance.__dict__:
+        reindex(instance.__dict__.pop('_search_post_ids'))
+    else:
+        get_backend().index(Post.objects.filter(tags=instance).prefetch_related('tags'))
+
+
+def reindex(post_ids):
+    get_backend().index(Post.objects.filter(pk__in=post_ids).prefetch_related('tags'))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_tag_cloud_on_post_change(sender, **kwargs):
+    # a post published, unpublished or deleted changes the counts of its tags
+    invalidate_tag_cloud()
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_tag_cloud_on_tags(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_tag_cloud()
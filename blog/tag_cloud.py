@@ -0,0 +1,49 @@
+import math
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Count
+from taggit.models import TaggedItem
+
+from .models import Post
+
+TAG_CLOUD_CACHE_KEY = 'blog:tag-cloud'
+TAG_CLOUD_CACHE_TIMEOUT = getattr(settings, 'BLOG_TAG_CLOUD_CACHE_TIMEOUT', 60 * 60)
+# tags kept in the cache, the ones on the most published posts
+TAG_CLOUD_SIZE = getattr(settings, 'BLOG_TAG_CLOUD_SIZE', 30)
+# font sizes in percent of the least and the most used tag of a cloud
+SMALLEST, LARGEST = 80, 160
+
+
+def published_tag_counts(limit=TAG_CLOUD_SIZE):
+    """ {slug, name, count} of the ``limit`` tags on the most published posts, from one aggregate query """
+    published = Post.objects.filter(status='published').values('id')
+    rows = TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Post), object_id__in=published) \
+        .values('tag__slug', 'tag__name').annotate(count=Count('id')).order_by('-count', 'tag__name')
+    return [{'slug': row['tag__slug'], 'name': row['tag__name'], 'count': row['count']} for row in rows[:limit]]
+
+
+def weigh(tags):
+    """ The tags by name with a font size between SMALLEST and LARGEST, by the log of their count """
+    if not tags:
+        return []
+    low, high = math.log(tags[-1]['count']), math.log(tags[0]['count'])
+    weighed = []
+    for tag in tags:
+        share = (math.log(tag['count']) - low) / (high - low) if high > low else 0
+        weighed.append({**tag, 'size': round(SMALLEST + share * (LARGEST - SMALLEST))})
+    return sorted(weighed, key=lambda tag: tag['name'].lower())
+
+
+def get_tag_cloud(limit=TAG_CLOUD_SIZE):
+    """ The ``limit`` (at most TAG_CLOUD_SIZE) most used tags, counted once until a post or its tags change """
+    counts = cache.get(TAG_CLOUD_CACHE_KEY)
+    if counts is None:
+        counts = published_tag_counts(TAG_CLOUD_SIZE)
+        cache.set(TAG_CLOUD_CACHE_KEY, counts, TAG_CLOUD_CACHE_TIMEOUT)
+    return weigh(counts[:limit])
+
+
+def invalidate_tag_cloud():
+    cache.delete(TAG_CLOUD_CACHE_KEY)
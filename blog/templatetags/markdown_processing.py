@@ -1,11 +1,66 @@
-import markdown as md
+import hashlib
+import threading
+from collections import OrderedDict
+
 from django import template
+from django.conf import settings
 from django.template.defaultfilters import stringfilter
 
+from blog.rendering import render_markdown
+
 register = template.Library()
 
+# characters of html kept, the least recently used renders go first
+CACHE_SIZE = getattr(settings, 'MARKDOWN_CACHE_SIZE', 4 * 1024 * 1024)
+
+
+class RenderCache:
+    """ Rendered html by the hash of its markdown, bounded by the total length of the html """
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def render(self, text):
+        key = hashlib.sha256(text.encode()).digest()
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        # rendered outside the lock, two threads may render the same text once each
+        html = render_markdown(text)
+        if len(html) <= self.max_size:
+            with self.lock:
+                if key not in self.entries:
+                    self.entries[key] = html
+                    self.size += len(html)
+                while self.size > self.max_size:
+                    self.size -= len(self.entries.popitem(last=False)[1])
+                    self.evictions += 1
+        return html
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'size': self.size}
+
+
+cache = RenderCache()
+
 
 @register.filter()
 @stringfilter
 def markdown(value):
-    return md.markdown(value, extensions=['markdown.extensions.fenced_code'])
\ No newline at end of file
+    return cache.render(value)
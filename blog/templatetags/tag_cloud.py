@@ -1,12 +1,10 @@
 from django import template
-from taggit.models import Tag
 
+from blog.tag_cloud import TAG_CLOUD_SIZE, get_tag_cloud
 
 register = template.Library()
 
 
 @register.inclusion_tag("components/tag-cloud.html")
-def sidebar_tag_cloud():
-    x = Tag.objects.all()
-
-    return {'tags': x}
\ No newline at end of file
+def sidebar_tag_cloud(limit=TAG_CLOUD_SIZE):
+    return {'tags': get_tag_cloud(limit)}
@@ -1,3 +1,294 @@
-from django.test import TestCase
+import threading
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import m2m_changed
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from taggit.models import Tag, TaggedItem
+
+from blog import rendering
+from core.fulltext import reset_tables
+from blog.search import Fts5Backend, get_backend
+from blog.tag_cloud import get_tag_cloud
+from blog.models import Post
+from blog.templatetags.markdown_processing import RenderCache, markdown
+
+CONTENT = 'Intro\n\n```\ncode = 1\n```\n'
+
+
+class PostRenderingTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user('writer', password='secret')
+        self.post = Post.objects.create(title='Hello', slug='hello', author=self.author, content=CONTENT,
+                                        status='published')
+
+    def test_saved_with_html(self):
+        self.assertEqual(self.post.content_html, '<p>Intro</p>\n<pre><code>code = 1\n</code></pre>')
+        self.assertEqual(self.post.content_hash, rendering.content_hash(CONTENT))
+        post = Post.objects.get(pk=self.post.pk)
+        with mock.patch('blog.models.render_markdown') as render:
+            self.assertEqual(post.rendered_content, self.post.content_html)
+        render.assert_not_called()
+
+    def test_changed_content_is_rendered_again(self):
+        self.post.content = '# Title'
+        self.post.save(update_fields=['content'])
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.content_html, '<h1>Title</h1>')
+        with mock.patch('blog.models.render_markdown') as render:
+            post.title = 'Renamed'
+            post.save()
+        render.assert_not_called()
+
+    def test_rerender_posts(self):
+        Post.objects.create(title='Other', slug='other', author=self.author, content='*other*')
+        # what a change of the extensions does to the stored hashes
+        with mock.patch.object(rendering, 'SIGNATURE', 'new extensions'):
+            post = Post.objects.get(pk=self.post.pk)
+            self.assertEqual(post.rendered_content, self.post.content_html)  # rendered on the spot meanwhile
+            out = StringIO()
+            call_command('rerender_posts', workers=2, batch_size=1, stdout=out)
+            self.assertIn('Rendered 2 posts', out.getvalue())
+            post.refresh_from_db()
+            self.assertEqual(post.content_hash, rendering.content_hash(CONTENT))
+            call_command('rerender_posts', workers=1, stdout=out)
+            self.assertIn('Rendered 0 posts', out.getvalue())
+            call_command('rerender_posts', '--all', workers=1, stdout=out)
+            self.assertIn('Rendered 2 posts', out.getvalue())
+        self.assertEqual(Post.objects.get(slug='other').content_html, '<p><em>other</em></p>')
+        self.assertEqual(Post.objects.get(pk=self.post.pk).updated_at, self.post.updated_at)
+
+    def test_single_post(self):
+        with mock.patch('blog.models.render_markdown') as render:
+            response = self.client.get(reverse('post_single', args=['hello']))
+        render.assert_not_called()
+        self.assertContains(response, '<pre><code>code = 1')
+
+
+class MarkdownFilterTest(TestCase):
+
+    def test_converter_is_reused_and_reset(self):
+        converter = rendering.converter()
+        self.assertIs(rendering.converter(), converter)
+        others = []
+        thread = threading.Thread(target=lambda: others.append(rendering.converter()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(others[0], converter)
+        # a reference defined by one text isn't there for the next one
+        self.assertEqual(rendering.render_markdown('[x][ref]\n\n[ref]: http://example.com'),
+                         '<p><a href="http://example.com">x</a></p>')
+        self.assertEqual(rendering.render_markdown('[x][ref]'), '<p>[x][ref]</p>')
+
+    def test_cache(self):
+        cache = RenderCache(max_size=40)
+        self.assertEqual(cache.render('*one*'), '<p><em>one</em></p>')
+        with mock.patch('blog.templatetags.markdown_processing.render_markdown') as render:
+            self.assertEqual(cache.render('*one*'), '<p><em>one</em></p>')
+        render.assert_not_called()
+        cache.render('*two*')
+        cache.render('*one*')
+        cache.render('*three*')  # 59 characters of html: "two" is the least recently used
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 3, 'evictions': 1, 'entries': 2, 'size': 40})
+        cache.render('a paragraph longer than the whole cache')
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_filter(self):
+        self.assertEqual(markdown('# Title'), '<h1>Title</h1>')
+
+
+class PostListPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user('writer', password='secret')
+        for i in range(25):
+            post = Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=author, status='published',
+                                       content=f'Body {i} ' + 'x' * 300)
+            post.tags.add('django' if i % 2 else 'python')
+        Post.objects.create(title='Post draft', slug='draft', author=author, content='draft')
+        # posts written in the same microsecond are told apart by their id
+        Post.objects.filter(slug__in=['post-10', 'post-11', 'post-12']).update(
+            created_at=Post.objects.get(slug='post-10').created_at)
+
+    def pages(self, url, params=None):
+        titles, params = [], dict(params or {})
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params, HTTP_HX_REQUEST='true')
+            self.assertEqual(len(queries), 1)
+            self.assertNotIn('COUNT', queries[0]['sql'])
+            titles.append([post.title for post in response.context['posts']])
+            page = response.context['page_obj']
+            if not page.has_next():
+                return titles, response
+            self.assertContains(response, f'after={page.next_cursor.replace(":", "%3A").replace("+", "%2B")}')
+            params['after'] = page.next_cursor
+
+    def test_home(self):
+        titles, response = self.pages(reverse('home_page'))
+        self.assertEqual([len(page) for page in titles], [10, 10, 5])
+        self.assertEqual(sum(titles, []), [f'Post {i}' for i in range(24, -1, -1)])
+        self.assertNotContains(response, 'hx-get')
+
+    def test_tag_shows_an_excerpt(self):
+        titles, response = self.pages(reverse('post_by_tag', args=['python']))
+        self.assertEqual([len(page) for page in titles], [10, 3])
+        self.assertContains(response, 'Body 0 ' + 'x' * 172 + '…')
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse('home_page'), {'after': 'nope'}).status_code, 404)
+
+    def test_full_page(self):
+        response = self.client.get(reverse('home_page'))
+        self.assertEqual(len(response.context['posts']), 10)
+        self.assertTrue(response.context['is_paginated'])
+
+
+class PostSearchTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user('writer', password='secret')
+        self.in_title = self.post('in-title', title='Caching with Redis', content='How to keep things around.')
+        self.in_content = self.post('in-content', title='Weekly notes', content='A few words on <b>redis</b> today.')
+        self.in_subtitle = self.post('in-subtitle', title='Queues', subtitle='Redis streams in practice')
+        self.tagged = self.post('tagged', title='Deploying', tags=['redis', 'ops'])
+        self.post('draft', title='Redis draft', status='draft')
+
+    def post(self, slug, title, content='', subtitle='Notes from the week', status='published', tags=('notes',)):
+        post = Post.objects.create(title=title, subtitle=subtitle, slug=slug, author=self.author, content=content,
+                                   status=status)
+        post.tags.add(*tags)
+        return post
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('post_search'), {'q': q, **params}, HTTP_HX_REQUEST='true')
+        return response, [post.slug for post in response.context['posts']]
+
+    def test_title_ranks_first(self):
+        self.assertTrue(Fts5Backend.available())
+        response, slugs = self.search('REDIS')
+        self.assertEqual(slugs[0], 'in-title')
+        self.assertEqual(set(slugs), {'in-title', 'in-content', 'in-subtitle', 'tagged'})
+        # the match is marked in a snippet of the content, the content itself is escaped
+        self.assertContains(response, 'A few words on &lt;b&gt;<mark>redis</mark>&lt;/b&gt; today.')
+        self.assertEqual(self.search('redi*')[1][0], 'in-title')
+        self.assertEqual(self.search('redis weekly')[1], ['in-content'])
+        self.assertEqual(self.search('"redis streams"')[1], ['in-subtitle'])
+        self.assertEqual(self.search('memcached')[1], [])
+
+    def test_index_follows_the_posts(self):
+        self.in_content.content = 'Nothing to see'
+        self.in_content.save()
+        self.tagged.tags.set(['docker'])
+        self.in_subtitle.status = 'draft'
+        self.in_subtitle.save()
+        self.in_title.delete()
+        self.assertEqual(self.search('redis')[1], [])
+        self.assertEqual(self.search('docker')[1], ['tagged'])
+        self.tagged.tags.clear()
+        self.assertEqual(self.search('docker')[1], [])
+        get_backend().rebuild()
+        self.assertEqual(self.search('deploying')[1], ['tagged'])
+        self.assertEqual(set(self.search('notes')[1]), {'in-content', 'tagged'})
+
+    def test_index_follows_the_tags(self):
+        tag = Tag.objects.get(name='redis')
+        tag.name = 'valkey'
+        tag.save()
+        self.assertEqual(self.search('valkey')[1], ['tagged'])
+        Tag.objects.get(name='ops').delete()
+        self.assertEqual(self.search('ops')[1], [])
+
+        # tag.<posts>.clear() sends no pk_set, the posts are remembered on pre_clear
+        kwargs = {'sender': Post.tags.through, 'instance': tag, 'reverse': True, 'model': Post, 'pk_set': None}
+        m2m_changed.send(action='pre_clear', **kwargs)
+        TaggedItem.objects.filter(tag=tag).delete()
+        m2m_changed.send(action='post_clear', **kwargs)
+        self.assertEqual(self.search('valkey')[1], [])
+
+    def test_pages(self):
+        for i in range(12):
+            self.post(f'more-{i}', title=f'More redis {i}')
+        slugs, params = [], {}
+        while True:
+            response, page = self.search('redis', **params)
+            slugs += page
+            if not response.context['page_obj'].has_next():
+                break
+            params['after'] = response.context['page_obj'].next_cursor
+        self.assertEqual(len(slugs), 16)
+        self.assertEqual(len(set(slugs)), 16)
+        response = self.client.get(reverse('post_search'), {'q': 'redis', 'after': 'nope'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_availability_is_looked_up_again(self):
+        with mock.patch.object(connection.introspection, 'table_names', return_value=[]):
+            reset_tables()
+            self.assertFalse(Fts5Backend.available())
+        self.assertFalse(Fts5Backend.available())
+        reset_tables()
+        self.assertTrue(Fts5Backend.available())
+
+    def test_empty_query(self):
+        self.assertEqual(self.search('  ; ')[1], [])
+        response = self.client.get(reverse('post_search'))
+        self.assertContains(response, 'Try again')
+
+
+@override_settings(BLOG_SEARCH_BACKEND='database')
+class DatabasePostSearchTest(PostSearchTest):
+
+    def test_title_ranks_first(self):
+        # unranked, newest first
+        self.assertEqual(self.search('redis')[1], ['tagged', 'in-subtitle', 'in-content', 'in-title'])
+        self.assertEqual(self.search('redis weekly')[1], ['in-content'])
+
+    def test_index_follows_the_posts(self):
+        self.tagged.tags.set(['docker'])
+        self.assertEqual(self.search('docker')[1], ['tagged'])
+
+
+class TagCloudTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('writer', password='secret')
+        for i, tags in enumerate([['django', 'python'], ['django', 'python'], ['django'], ['docker']]):
+            post = Post.objects.create(title=f'Post {i}', slug=f'post-{i}', author=self.author, status='published')
+            post.tags.add(*tags)
+        self.draft = Post.objects.create(title='Draft', slug='draft', author=self.author)
+        self.draft.tags.add('draft-only', 'docker')
+
+    def cloud(self, limit=30):
+        return [(tag['name'], tag['count'], tag['size']) for tag in get_tag_cloud(limit)]
+
+    def test_counts_published_posts(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cloud(), [('django', 3, 160), ('docker', 1, 80), ('python', 2, 130)])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cloud(2), [('django', 3, 160), ('python', 2, 80)])
+
+    def test_invalidation(self):
+        self.cloud()
+        self.draft.status = 'published'
+        self.draft.save()
+        self.assertIn(('draft-only', 1, 80), self.cloud())
+        self.draft.tags.add('python')
+        self.assertIn(('python', 3, 160), self.cloud())
+        self.draft.tags.clear()
+        self.assertNotIn('draft-only', [name for name, count, size in self.cloud()])
+        Post.objects.get(slug='post-3').delete()
+        self.assertEqual([name for name, count, size in self.cloud()], ['django', 'python'])
+
+    def test_sidebar(self):
+        response = self.client.get(reverse('post_single', args=['post-0']))
+        self.assertContains(response, 'style="font-size: 160%" title="3 posts"')
+        self.assertNotContains(response, 'draft-only')
@@ -1,11 +1,24 @@
+from django.db.models.functions import Substr
 from django.shortcuts import get_object_or_404, render
 from django.views.generic import ListView, CreateView
 
 from blog.forms import PostSearchForm
 from blog.models import Post
+from blog.pagination import CursorPaginationMixin
+from blog.search import SearchPaginator
 
+EXCERPT_LENGTH = 180
 
-class HomeView(ListView):
+
+def listed(posts, excerpt=False):
+    """ ``posts`` with what the post lists show: the author in the same query, no body but an excerpt """
+    posts = posts.select_related('author').defer('content', 'content_html')
+    if excerpt:
+        posts = posts.annotate(excerpt=Substr('content', 1, EXCERPT_LENGTH + 1))
+    return posts
+
+
+class HomeView(CursorPaginationMixin, ListView):
     model = Post
     # template_name = 'blog/index.html'  # this is a variable that we can set up
     context_object_name = "posts"
@@ -15,7 +28,7 @@ class HomeView(ListView):
 
     def get_queryset(self):
         x = Post.objects.filter(status='published')
-        return x
+        return listed(x)
 
     def get_template_names(self):
         if self.request.htmx:
@@ -25,11 +38,11 @@ class HomeView(ListView):
 
 def post_single(request, post):
     post = get_object_or_404(Post, slug=post, status='published')
-    related = Post.objects.filter(author=post.author)[:5]
+    related = Post.objects.filter(author=post.author).defer('content', 'content_html')[:5]
     return render(request, 'blog/single_post.html', {'post': post, 'related': related})
 
 
-class TagListView(ListView):
+class TagListView(CursorPaginationMixin, ListView):
     model = Post
     paginate_by = 10
     context_object_name = 'posts'
@@ -37,7 +50,7 @@ class TagListView(ListView):
     def get_queryset(self):
         # x = Post.objects.filter(tags__name=self.kwargs['tag'])
         x = Post.objects.filter(status__exact='published', tags__name__in=[self.kwargs['tag']])
-        return x
+        return listed(x, excerpt=True)
 
     def get_template_names(self):
         if self.request.htmx:
@@ -52,17 +65,22 @@ class TagListView(ListView):
         return context
 
 
-class PostSearchView(ListView):
+class PostSearchView(CursorPaginationMixin, ListView):
     model = Post
     paginate_by = 10
     context_object_name = 'posts'
     form_class = PostSearchForm
 
+    paginator_class = SearchPaginator
+
     def get_queryset(self):
+        # the posts a match is read from, SearchPaginator finds and orders them
+        return listed(Post.objects.filter(status__exact='published'), excerpt=True)
+
+    def get_paginator(self, queryset, per_page, **kwargs):
         form = self.form_class(self.request.GET)  # grab data from form
-        if form.is_valid():
-            return Post.objects.filter(status__exact='published', title__icontains=form.cleaned_data['q'])
-        return []
+        query = form.cleaned_data['q'] if form.is_valid() else ''
+        return self.paginator_class(queryset, per_page, query=query, **kwargs)
 
     def get_template_names(self):
         if self.request.htmx:
@@ -0,0 +1,23 @@
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+@contextmanager
+def rolled_back():
+    """ A transaction for the rows a benchmark creates, rolled back so the database is left as it was """
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def median_ms(run, repeat):
+    """ The median time of ``repeat`` calls of ``run``, in milliseconds """
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
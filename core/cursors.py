@@ -0,0 +1,15 @@
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(created_at, last_id):
+    """ The "<iso datetime>:<id>" keyset cursor of the last row of a page """
+    return f'{created_at.isoformat()}:{last_id}'
+
+
+def decode_cursor(cursor):
+    """ (datetime, id) of an encode_cursor() cursor, ValueError when it wasn't made there """
+    created_at, _, last_id = cursor.rpartition(':')
+    created_at = parse_datetime(created_at)
+    if created_at is None or not last_id.isdigit():
+        raise ValueError('Invalid cursor')
+    return created_at, int(last_id)
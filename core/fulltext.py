@@ -0,0 +1,95 @@
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+# "a quoted phrase", prefix* or a plain word
+QUERY_TOKEN = re.compile(r'"([^"]*)"|(\w+)(\*?)')
+
+# {(database alias, table): whether it exists}, emptied after migrations
+_tables = {}
+
+
+def tokenize(text):
+    """ Lowercase words without diacritics, the way fts5's unicode61 tokenizer splits them """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r'\w+', text)
+
+
+def parse_query(query):
+    """
+    Split a query into ("phrase"|"prefix"|"word", words) terms, every term has to match.
+    Punctuation is dropped, so nothing typed in the search box is fts5 syntax.
+    """
+    terms = []
+    for phrase, word, star in QUERY_TOKEN.findall(query):
+        if phrase:
+            words = tokenize(phrase)
+            if words:
+                terms.append(('phrase' if len(words) > 1 else 'word', words))
+        else:
+            parts = tokenize(word)
+            for i, part in enumerate(parts):
+                terms.append(('prefix' if star and i == len(parts) - 1 else 'word', [part]))
+    return terms
+
+
+def match_expression(terms):
+    """ The fts5 MATCH expression of parse_query() terms, each one quoted """
+    parts = []
+    for kind, words in terms:
+        phrase = '"%s"' % ' '.join(words)  # tokens have no quotes left
+        parts.append(phrase + '*' if kind == 'prefix' else phrase)
+    return ' AND '.join(parts)
+
+
+def split_cursor(cursor):
+    """ The "<score>:<id>" cursor of the last result of the previous page """
+    score, _, last_id = cursor.rpartition(':')
+    return float(score), int(last_id)
+
+
+def make_cursor(score, last_id):
+    return f'{score!r}:{last_id}'
+
+
+def table_exists(table):
+    """ Whether the database has ``table``, looked up once per database until the next migration """
+    key = (connection.alias, table)
+    if key not in _tables:
+        _tables[key] = table in connection.introspection.table_names()
+    return _tables[key]
+
+
+def fts5_available(table):
+    """ The fts5 ``table`` only exists on SQLite builds with FTS5 """
+    return connection.vendor == 'sqlite' and table_exists(table)
+
+
+@receiver(post_migrate)
+def reset_tables(**kwargs):
+    # a migration may have created or dropped a table
+    _tables.clear()
+
+
+def search(table, terms, cursor, limit, weights=(), columns=()):
+    """
+    ``limit + 1`` (rowid, score, *columns) rows of the fts5 ``table`` matching ``terms`` after
+    the (score, id) ``cursor``, best first: ranked by bm25() with the column ``weights``, lower
+    scores first, the rowid breaking ties.
+    """
+    rank = f'bm25({", ".join([table, *map(str, weights)])})'
+    sql = f'SELECT {", ".join(["rowid", f"{rank} AS score", *columns])} FROM {table} WHERE {table} MATCH %s'
+    params = [match_expression(terms)]
+    if cursor:
+        score, last_id = cursor
+        sql += f' AND ({rank} > %s OR ({rank} = %s AND rowid > %s))'
+        params += [score, score, last_id]
+    sql += ' ORDER BY score, rowid LIMIT %s'
+    params.append(limit + 1)
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        return db_cursor.fetchall()
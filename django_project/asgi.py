@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+
+Async views such as main.views.ai_chat_stream only free their worker while they wait when
+served from here, e.g. ``uvicorn django_project.asgi:application``; under WSGI they still
+work but hold a thread for the whole stream.
 """
 
 import os
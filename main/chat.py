@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from datetime import timedelta
+
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from core.cursors import decode_cursor, encode_cursor
+
+from . import response_cache
+from .models import Chat, ChatSession
+
+# completions running at once per process (sync views) and per event loop (the streaming view)
+CONCURRENCY = getattr(settings, 'AI_CHAT_CONCURRENCY', 4)
+# seconds a request waits for a free slot before giving up
+QUEUE_TIMEOUT = getattr(settings, 'AI_CHAT_QUEUE_TIMEOUT', 30)
+HISTORY_PAGE_SIZE = getattr(settings, 'AI_CHAT_HISTORY_PAGE_SIZE', 20)
+# the latest turns of the conversation sent with each prompt
+CONTEXT_TURNS = getattr(settings, 'AI_CHAT_CONTEXT_TURNS', 5)
+# silence after which the next message starts a new session
+SESSION_IDLE = timedelta(seconds=getattr(settings, 'AI_CHAT_SESSION_IDLE', 60 * 60))
+# turns a session keeps, compact() folds the older ones into its summary
+KEEP_TURNS = getattr(settings, 'AI_CHAT_KEEP_TURNS', 100)
+# turns a user keeps across all of their sessions, trim() deletes the older ones
+KEEP_USER_TURNS = getattr(settings, 'AI_CHAT_KEEP_USER_TURNS', 500)
+COMPACT_BATCH = 50
+SUMMARY_LENGTH = 2000
+DELETE_BATCH = 1000
+
+BUSY = 'The chatbot is busy, try again in a moment.'
+FAILED = 'The chatbot could not answer.'
+
+openai.api_key = os.environ.get('OPEN_API')
+
+logger = logging.getLogger(__name__)
+
+
+class Busy(Exception):
+    """ Every completion slot stayed taken for QUEUE_TIMEOUT seconds """
+
+
+class Abandoned(Exception):
+    """ The stream another request was waiting for stopped before the end of the answer """
+
+
+class OpenAIBackend:
+    """ The OpenAI completions API """
+    name = 'openai'
+    # the failures of the provider, anything else is a bug
+    errors = (openai.error.OpenAIError,)
+    options = {'model': 'text-davinci-002', 'max_tokens': 1000, 'n': 1, 'stop': None, 'temperature': 0.5}
+
+    def complete(self, prompt):
+        response = openai.Completion.create(prompt=prompt, **self.options)
+        return response['choices'][0]['text']
+
+    async def stream(self, prompt):
+        chunks = await openai.Completion.acreate(prompt=prompt, stream=True, **self.options)
+        async for chunk in chunks:
+            yield chunk['choices'][0]['text']
+
+
+class EchoBackend:
+    """ Answers locally without calling anyone, for tests and working offline """
+    name = 'echo'
+    errors = ()
+
+    def reply(self, prompt):
+        return f'You said: {prompt}'
+
+    def complete(self, prompt):
+        return self.reply(prompt)
+
+    async def stream(self, prompt):
+        for i, word in enumerate(self.reply(prompt).split(' ')):
+            await asyncio.sleep(0)
+            yield word if i == 0 else ' ' + word
+
+
+BACKENDS = {backend.name: backend for backend in (OpenAIBackend, EchoBackend)}
+_backends = {}
+
+
+def get_backend():
+    """ The completion backend named by AI_CHAT_BACKEND, openai by default """
+    name = getattr(settings, 'AI_CHAT_BACKEND', 'openai')
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+def make_prompt(user_input, session=None, turns=()):
+    """ ``user_input`` after the summary of ``session`` and its latest ``turns`` """
+    lines = [f'Summary of the conversation so far: {session.summary}'] if session and session.summary else []
+    for turn in turns:
+        lines += [f'User: {turn.user_input}', f'AI: {turn.ai_response}']
+    lines.append(f'User: {user_input}')
+    return '\n'.join(lines)
+
+
+def conversation(user):
+    """
+    The session going on with ``user`` and its last CONTEXT_TURNS turns, oldest first, from
+    one seek on the (user, timestamp) index. None and no turns when the user has been silent
+    for SESSION_IDLE: the next turn starts a new session.
+    """
+    turns = list(Chat.objects.filter(user=user).select_related('session')
+                 .order_by('-timestamp', '-id')[:CONTEXT_TURNS])
+    if not turns or turns[0].session is None or turns[0].timestamp <= timezone.now() - SESSION_IDLE:
+        return None, []
+    session = turns[0].session
+    return session, [turn for turn in reversed(turns) if turn.session_id == session.id]
+
+
+def save_turn(user, session, user_input, ai_response):
+    if session is None:
+        session = ChatSession.objects.create(user=user)
+    return Chat.objects.create(user=user, session=session, user_input=user_input, ai_response=ai_response)
+
+
+_slots = threading.BoundedSemaphore(CONCURRENCY)
+_loop_slots = weakref.WeakKeyDictionary()
+
+
+def complete(prompt):
+    """ The whole answer to ``prompt``, for the views that can't stream """
+    backend = get_backend()
+    key = response_cache.make_key(backend.name, prompt)
+    response = response_cache.get(key)
+    if response is None:
+        response = response_cache.flights.do(key, lambda: _ask(backend, key, prompt))
+    return response
+
+
+def _ask(backend, key, prompt):
+    response = _call(backend, prompt)
+    response_cache.put(key, prompt, response)
+    return response
+
+
+def _call(backend, prompt):
+    if not _slots.acquire(timeout=QUEUE_TIMEOUT):
+        raise Busy
+    try:
+        return backend.complete(prompt)
+    finally:
+        _slots.release()
+
+
+@asynccontextmanager
+async def _slot():
+    # asyncio primitives belong to one event loop, each loop gets its own semaphore
+    loop = asyncio.get_running_loop()
+    if loop not in _loop_slots:
+        _loop_slots[loop] = asyncio.Semaphore(CONCURRENCY)
+    semaphore = _loop_slots[loop]
+    try:
+        await asyncio.wait_for(semaphore.acquire(), QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise Busy
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def event(data, name=None):
+    """ A server-sent event carrying ``data`` as JSON """
+    lines = [f'event: {name}'] if name else []
+    lines.append('data: ' + json.dumps(data))
+    return '\n'.join(lines) + '\n\n'
+
+
+async def stream_reply(user, user_input):
+    """
+    Server-sent events of the answer to ``user_input``: a "message" event per chunk as the
+    backend produces it, then "done" with the id of the saved Chat, or "error".
+
+    Cached answers come in a single "message", and so do the ones another request of this
+    event loop is already streaming for the same prompt.
+    """
+    backend = get_backend()
+    session, turns = await sync_to_async(conversation)(user)
+    prompt = make_prompt(user_input, session, turns)
+    key = response_cache.make_key(backend.name, prompt)
+    response = await sync_to_async(response_cache.get)(key)
+    in_flight = response_cache.streams_in_flight()
+    if response is None and key in in_flight:
+        response_cache.count('coalesced')
+        try:
+            response = await asyncio.shield(in_flight[key])
+        except Busy:
+            yield event(BUSY, 'error')
+            return
+        except (Abandoned, *backend.errors):
+            logger.exception('The %s answer this request was waiting for failed', backend.name)
+            yield event(FAILED, 'error')
+            return
+
+    if response is not None:
+        yield event(response)
+    else:
+        future = in_flight[key] = asyncio.get_running_loop().create_future()
+        chunks = []
+        try:
+            async with _slot():
+                async for chunk in backend.stream(prompt):
+                    chunks.append(chunk)
+                    yield event(chunk)
+            response = ''.join(chunks)
+            await sync_to_async(response_cache.put)(key, prompt, response)
+            future.set_result(response)
+        except Busy as error:
+            future.set_exception(error)
+            yield event(BUSY, 'error')
+            return
+        except backend.errors as error:
+            logger.exception('The %s backend failed to stream an answer', backend.name)
+            future.set_exception(error)
+            yield event(FAILED, 'error')
+            return
+        finally:
+            del in_flight[key]
+            if not future.done():  # the client went away in the middle of the stream, or a bug raised
+                future.set_exception(Abandoned())
+            # asyncio logs the errors nobody retrieved, there may have been no other request waiting
+            future.exception()
+
+    chat = await sync_to_async(save_turn)(user, session, user_input, response)
+    yield event({'id': chat.id}, 'done')
+
+
+def history_page(user, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    The ``limit`` chats of ``user`` preceding the cursor ``before`` (the latest ones by default),
+    oldest first, and the cursor of the page before it, None on the first page.
+
+    Pages are keyset seeks on the (user, timestamp) index. A cursor that wasn't made here
+    raises ValueError.
+    """
+    chats = Chat.objects.filter(user=user).order_by('-timestamp', '-id')
+    if before:
+        timestamp, last_id = decode_cursor(before)
+        chats = chats.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=last_id))
+    chats = list(chats[:limit + 1])
+    earlier = None
+    if len(chats) > limit:
+        chats = chats[:limit]
+        earlier = encode_cursor(chats[-1].timestamp, chats[-1].id)
+    return chats[::-1], earlier
+
+
+def delete_in_batches(chats, batch_size=DELETE_BATCH):
+    """ Delete the ``chats`` queryset a batch at a time, so no single statement holds the table for long """
+    deleted = 0
+    while True:
+        ids = list(chats.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Chat.objects.filter(id__in=ids).delete()[0]
+
+
+def clear_history(user, batch_size=DELETE_BATCH):
+    """ Delete the chats and the sessions of ``user``, and nobody else's """
+    deleted = delete_in_batches(Chat.objects.filter(user=user), batch_size)
+    ChatSession.objects.filter(user=user).delete()
+    return deleted
+
+
+def compact(session, keep=KEEP_TURNS):
+    """
+    Fold the turns of ``session`` older than its latest ``keep`` into its summary, COMPACT_BATCH
+    turns per completion, and delete them. Returns the number of turns compacted.
+    """
+    old = session.turns.order_by('-timestamp', '-id')[keep:]
+    turns = list(old.values_list('id', 'user_input', 'ai_response'))[::-1]
+    backend = get_backend()
+    for start in range(0, len(turns), COMPACT_BATCH):
+        batch = turns[start:start + COMPACT_BATCH]
+        lines = ['Summarize this conversation between a user and an AI in a few sentences.']
+        if session.summary:
+            lines.append(f'What it was about before: {session.summary}')
+        for chat_id, user_input, ai_response in batch:
+            lines += [f'User: {user_input}', f'AI: {ai_response}']
+        session.summary = _call(backend, '\n'.join(lines)).strip()[:SUMMARY_LENGTH]
+        session.summarized_turns += len(batch)
+        session.save(update_fields=['summary', 'summarized_turns'])
+        Chat.objects.filter(id__in=[chat_id for chat_id, user_input, ai_response in batch]).delete()
+    return len(turns)
+
+
+def sessions_to_compact(keep=KEEP_TURNS):
+    return ChatSession.objects.annotate(turn_count=Count('turns')).filter(turn_count__gt=keep)
+
+
+def trim(user_id, keep=KEEP_USER_TURNS, batch_size=DELETE_BATCH):
+    """
+    Delete the turns of the user older than their latest ``keep`` across every session, then
+    the sessions left without a turn. compact() bounds a session, this bounds a user with many
+    short ones. Returns the number of turns deleted.
+    """
+    latest = Chat.objects.filter(user_id=user_id).order_by('-timestamp', '-id')
+    deleted = 0
+    # the newest turn that goes, everything from it down is older than the ones kept
+    for timestamp, last_id in latest.values_list('timestamp', 'id')[keep:keep + 1]:
+        old = Chat.objects.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lte=last_id), user_id=user_id)
+        deleted = delete_in_batches(old, batch_size)
+    ChatSession.objects.filter(user_id=user_id, turns__isnull=True).delete()
+    return deleted
+
+
+def users_to_trim(keep=KEEP_USER_TURNS):
+    return Chat.objects.values_list('user_id', flat=True).annotate(turn_count=Count('id')) \
+        .filter(turn_count__gt=keep).order_by('user_id')
@@ -0,0 +1,35 @@
+from .models import Profile
+
+PAGE_SIZE = 20
+# profile -> profiles lookup of each side of the follow graph
+DIRECTIONS = {
+    'followers': 'follows',  # the profiles whose follows contain the profile
+    'follows': 'followed_by',
+}
+
+
+def neighbours(profile, direction, cursor=None, limit=PAGE_SIZE):
+    """
+    A page of the followers or the follows of ``profile`` with their users, in id order.
+
+    The cursor is the id of the last profile of the previous page. Returns the profiles and
+    the cursor of the next page, None on the last page.
+    """
+    profiles = Profile.objects.filter(**{DIRECTIONS[direction]: profile})
+    if cursor:
+        profiles = profiles.filter(id__gt=int(cursor))
+    profiles = list(profiles.select_related('user').order_by('id')[:limit + 1])
+
+    next_cursor = None
+    if len(profiles) > limit:
+        profiles = profiles[:limit]
+        next_cursor = str(profiles[-1].id)
+    return profiles, next_cursor
+
+
+def followed_ids(profile, profiles):
+    """ Ids of ``profiles`` that ``profile`` follows, with a single query for the whole list """
+    if profile is None:
+        return set()
+    return set(Profile.follows.through.objects.filter(from_profile=profile, to_profile__in=[p.id for p in profiles])
+               .values_list('to_profile_id', flat=True))
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.models import TimelineEntry
+from main.timeline import BACKFILL_TWEETS, fill_timeline, follower_ids
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the "following" timelines from the follows and the tweets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-author', type=int, default=BACKFILL_TWEETS,
+                            help='latest tweets of every account copied into the timelines of its followers')
+        parser.add_argument('--keep', action='store_true', help="don't delete the existing entries first")
+
+    def handle(self, *args, **options):
+        if not options['keep']:
+            deleted, _ = TimelineEntry.objects.all().delete()
+            self.stdout.write(f'Deleted {deleted} timeline entries.')
+
+        created = 0
+        authors = User.objects.filter(tweets__isnull=False).distinct().values_list('id', flat=True)
+        for author_id in authors.iterator():
+            # one account per transaction, the timelines can be read meanwhile
+            with transaction.atomic():
+                created += fill_timeline(list(follower_ids(author_id)), [author_id], options['per_author'])
+        self.stdout.write(self.style.SUCCESS(f'Copied {created} tweets into the timelines.'))
@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from core.bench import median_ms, rolled_back
+from main.models import Profile, Tweet
+from main.timeline import ORDERING, PAGE_SIZE, fill_timeline, following_page
+
+
+class Command(BaseCommand):
+    help = 'Compare reading the materialized "following" timeline with joining the follows and the tweets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--follows', type=int, nargs='+', default=[100, 1000, 5000],
+                            help='numbers of followed accounts to measure')
+        parser.add_argument('--tweets', type=int, default=50, help='tweets per followed account')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        for follows in options['follows']:
+            with rolled_back():
+                reader = self.populate(follows, options['tweets'])
+                self.report(reader, follows, options['repeat'])
+
+    def populate(self, follows, tweets):
+        self.stdout.write(f'Creating {follows} accounts with {tweets} tweets each...')
+        # the signals would fan out every tweet while populating, bulk_create skips them
+        users = User.objects.bulk_create(User(username=f'bench-{follows}-{i}') for i in range(follows + 1))
+        profiles = Profile.objects.bulk_create(Profile(user=user) for user in users)
+        reader, authors = profiles[0], profiles[1:]
+        Profile.follows.through.objects.bulk_create(
+            Profile.follows.through(from_profile=reader, to_profile=author) for author in authors)
+
+        batch = []
+        for i in range(tweets):
+            for n, author in enumerate(authors):
+                batch.append(Tweet(user_id=author.user_id, body=f'Tweet {i} of {n}'))
+            if len(batch) >= 5000:
+                Tweet.objects.bulk_create(batch)
+                batch = []
+        Tweet.objects.bulk_create(batch)
+        fill_timeline([reader.user_id], [author.user_id for author in authors], tweets)
+        return reader.user
+
+    def report(self, reader, follows, repeat):
+        joined = Tweet.objects.filter(user__profile__followed_by__user=reader).select_related('user__profile')
+        timings = {
+            'join, first page': lambda: list(joined.order_by(*ORDERING)[:PAGE_SIZE]),
+            'materialized, first page': lambda: following_page(reader),
+        }
+        for name, run in timings.items():
+            self.stdout.write(f'{follows:>6} follows  {name:<26} {median_ms(run, repeat):9.2f} ms')
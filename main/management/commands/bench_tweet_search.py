@@ -0,0 +1,63 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from core.bench import median_ms, rolled_back
+from main.models import Tweet
+from main.search import PAGE_SIZE, Fts5Backend, PythonBackend, parse_query
+
+WORDS = ['django', 'python', 'coffee', 'weekend', 'release', 'bug', 'deploy', 'music', 'football', 'rain',
+         'morning', 'database', 'holiday', 'pizza', 'train', 'meeting', 'book', 'garden', 'running', 'cinema']
+
+
+class Command(BaseCommand):
+    help = 'Compare the tweet search backends with the body__contains scan they replaced'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        for rows in options['rows']:
+            with rolled_back():
+                self.populate(rows)
+                backends = {'python': PythonBackend()}
+                started = time.perf_counter()
+                backends['python'].rebuild()
+                self.stdout.write(f'python index built in {time.perf_counter() - started:.2f} s')
+                if Fts5Backend.available():
+                    backends['fts5'] = Fts5Backend()
+                    backends['fts5'].rebuild()
+                # rare word, common word, prefix and phrase
+                for query in (f'unique{rows // 2}', 'coffee', 'foot*', '"deploy morning"'):
+                    self.report(rows, query, backends, options['repeat'])
+
+    def populate(self, rows):
+        self.stdout.write(f'Creating {rows} tweets...')
+        user = User.objects.create(username=f'bench-search-{rows}')
+        batch = []
+        for i in range(rows):
+            body = ' '.join(random.choices(WORDS, k=12))
+            if i == rows // 2:
+                body += f' unique{i}'
+            # bulk_create skips the signals, both indexes are rebuilt afterwards
+            batch.append(Tweet(user=user, body=body))
+            if len(batch) == 5000:
+                Tweet.objects.bulk_create(batch)
+                batch = []
+        Tweet.objects.bulk_create(batch)
+
+    def report(self, rows, query, backends, repeat):
+        terms = parse_query(query)
+        # the closest the old view gets: a substring of the query without the syntax
+        needle = ' '.join(words[0] if kind == 'prefix' else ' '.join(words) for kind, words in terms)
+        timings = {
+            'contains, all rows': lambda: list(Tweet.objects.filter(body__contains=needle)),
+            'contains, first page': lambda: list(Tweet.objects.filter(body__contains=needle)[:PAGE_SIZE]),
+        }
+        for name, backend in backends.items():
+            timings[f'{name}, first page'] = lambda backend=backend: backend.search(terms, None, PAGE_SIZE)
+        for name, run in timings.items():
+            self.stdout.write(f'{rows:>9} rows  {query!r:<20} {name:<22} {median_ms(run, repeat):9.2f} ms')
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.chat import KEEP_TURNS, KEEP_USER_TURNS, compact, sessions_to_compact, trim, users_to_trim
+
+
+class Command(BaseCommand):
+    help = 'Fold the old turns of the long chat sessions into their summaries, and trim the users with too many turns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=KEEP_TURNS, help='latest turns kept per session')
+        parser.add_argument('--keep-per-user', type=int, default=KEEP_USER_TURNS,
+                            help='latest turns kept per user, across their sessions')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        sessions = compacted = 0
+        for session in sessions_to_compact(options['keep']).iterator():
+            compacted += compact(session, options['keep'])
+            sessions += 1
+        users = deleted = 0
+        for user_id in list(users_to_trim(options['keep_per_user'])):
+            deleted += trim(user_id, options['keep_per_user'])
+            users += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Compacted {compacted} turns of {sessions} sessions and deleted {deleted} turns of {users} users '
+            f'in {time.perf_counter() - started:.2f} s.'))
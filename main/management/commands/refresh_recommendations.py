@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.recommendations import TOP_K, refresh, refresh_stale
+
+
+class Command(BaseCommand):
+    help = 'Recompute the "who to follow" recommendations from the follow graph'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='refresh every profile instead of the ones marked stale by follow changes')
+        parser.add_argument('--top', type=int, default=TOP_K, help='recommendations kept per profile')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        refreshed = refresh(k=options['top']) if options['all'] else refresh_stale(options['top'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed the recommendations of {refreshed} profiles in {time.perf_counter() - started:.2f} s.'))
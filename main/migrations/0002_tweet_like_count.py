@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:22
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_likes(apps, schema_editor):
+    Tweet = apps.get_model('main', 'Tweet')
+    likes = Tweet.likes.through.objects.filter(tweet_id=OuterRef('pk')).values('tweet_id') \
+        .annotate(total=Count('id')).values('total')
+    Tweet.objects.update(like_count=Coalesce(Subquery(likes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
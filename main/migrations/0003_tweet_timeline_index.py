@@ -0,0 +1,19 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_tweet_like_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['-created_at', '-id'], name='tweet_timeline_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:26
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_follows(apps, schema_editor):
+    Profile = apps.get_model('main', 'Profile')
+    Follow = Profile.follows.through
+
+    def counts(field):
+        return Coalesce(Subquery(Follow.objects.filter(**{field: OuterRef('pk')}).values(field)
+                                 .annotate(total=Count('id')).values('total')), 0)
+
+    Profile.objects.update(follower_count=counts('to_profile'), following_count=counts('from_profile'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_timeline_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_follows, migrations.RunPython.noop),
+    ]
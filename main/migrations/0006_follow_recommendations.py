@@ -0,0 +1,37 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_profile_follow_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleRecommendations',
+            fields=[
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='main.profile')),
+            ],
+            options={
+                'verbose_name_plural': 'Stale recommendations',
+            },
+        ),
+        migrations.CreateModel(
+            name='FollowRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.profile')),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='main.profile')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='followrecommendation',
+            constraint=models.UniqueConstraint(fields=('profile', 'rank'), name='unique_recommendation_rank'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        try:
+            # prefix indexes of 2 and 3 characters keep short prefix* queries off a full term scan
+            cursor.execute("CREATE VIRTUAL TABLE main_tweet_fts "
+                           "USING fts5(body, tokenize='unicode61', prefix='2 3')")
+        except OperationalError:  # SQLite built without FTS5, search uses main.search.PythonBackend
+            return
+        cursor.execute("INSERT INTO main_tweet_fts(rowid, body) SELECT id, body FROM main_tweet")
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS main_tweet_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_follow_recommendations'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
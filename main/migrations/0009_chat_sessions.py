@@ -0,0 +1,45 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def open_sessions(apps, schema_editor):
+    """ The existing chats of each user become their first session """
+    Chat = apps.get_model('main', 'Chat')
+    ChatSession = apps.get_model('main', 'ChatSession')
+    for user_id in Chat.objects.exclude(user=None).values_list('user_id', flat=True).distinct():
+        session = ChatSession.objects.create(user_id=user_id)
+        Chat.objects.filter(user_id=user_id).update(session=session)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_cached_response'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.TextField(blank=True, default='')),
+                ('summarized_turns', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='session',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='turns', to='main.chatsession'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['user', 'timestamp'], name='chat_user_timestamp_idx'),
+        ),
+        migrations.RunPython(open_sessions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_chat_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cachedresponse',
+            name='created_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from PIL import Image
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
+from django.db.models import F
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.template.defaultfilters import slugify, truncatechars
@@ -18,10 +19,23 @@ class Profile(models.Model):
     homepage_link = models.CharField(null=True, blank=True, max_length=100)
     instagram_link = models.CharField(null=True, blank=True, max_length=100)
     linkedin_link = models.CharField(null=True, blank=True, max_length=100)
+    # len(followed_by) and len(follows), kept in step by main.signals.update_follow_counts
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+    COUNTERS = ('follower_count', 'following_count')
 
     def __str__(self) -> str:
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        # the counters are only written with F() updates, an instance loaded before a follow
+        # must not write its stale counts back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COUNTERS]
+        super(Profile, self).save(*args, **kwargs)
+
     # def save(self, *args, **kwargs):
     #     super(Profile, self).save(*args, **kwargs)
     #     img = Image.open(self.profile_image.path)
@@ -64,14 +78,43 @@ class Book(models.Model):
         return self.title
 
 
+class ChatSession(models.Model):
+    """ A conversation with the chatbot, its turns are the Chats pointing to it """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_sessions')
+    # what the turns compacted away were about, sent with the prompt in their place
+    summary = models.TextField(blank=True, default='')
+    summarized_turns = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.user} {self.created_at:%Y-%m-%d %H:%M}'
+
+
 class Chat(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, null=True, related_name='turns')
     user_input = models.TextField(verbose_name="User Input", null=True)  # This is the user query.
     ai_response = models.TextField(verbose_name="User Input", null=True)
     timestamp = models.DateTimeField(auto_now_add=True)  # This will store the time of each message input and response.
 
     class Meta:
         verbose_name = 'Chat'
+        indexes = [
+            # the latest turns of a user, for the chat page and the prompt context
+            models.Index(fields=['user', 'timestamp'], name='chat_user_timestamp_idx'),
+        ]
+
+
+class TweetManager(models.Manager):
+    """ Tweet manager """
+
+    def liked_ids(self, user, tweets):
+        """ Ids of the given tweets liked by ``user``, with a single query for the whole feed """
+        if not user.is_authenticated:
+            return set()
+        tweet_ids = [tweet.id for tweet in tweets]
+        return set(Tweet.likes.through.objects.filter(user_id=user.id, tweet_id__in=tweet_ids)
+                   .values_list('tweet_id', flat=True))
 
 
 # create tweets model
@@ -81,14 +124,42 @@ class Tweet(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     likes = models.ManyToManyField(User, related_name="tweet_like", blank=True)
+    # denormalized len(likes), kept in step by toggle_like
+    like_count = models.PositiveIntegerField(default=0)
+
+    objects = TweetManager()
 
     # keep track or count of likes
     def number_of_likes(self):
-        return self.likes.count()
+        return self.like_count
 
     # return amount of likes in admin
     def get_likes(self):
-        return len([like for like in self.likes.all()])
+        return self.like_count
+
+    def toggle_like(self, user):
+        """
+        Like the tweet, or unlike it if ``user`` already likes it. Returns True if it's liked now.
+
+        Whether the like row was really deleted or inserted decides the counter update, so two
+        concurrent requests of the same user can't count a like twice.
+        """
+        through = Tweet.likes.through
+        tweets = Tweet.objects.filter(id=self.id)
+        with transaction.atomic():
+            if through.objects.filter(tweet_id=self.id, user_id=user.id).delete()[0]:
+                tweets.update(like_count=F('like_count') - 1)
+                liked = False
+            else:
+                try:
+                    with transaction.atomic():
+                        through.objects.create(tweet_id=self.id, user_id=user.id)
+                except IntegrityError:  # liked by a concurrent request in the meantime
+                    return True
+                tweets.update(like_count=F('like_count') + 1)
+                liked = True
+        self.refresh_from_db(fields=['like_count'])
+        return liked
 
     # displays renamed get_likes method in admin
     get_likes.short_description = 'Likes'
@@ -111,5 +182,68 @@ class Tweet(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # keyset pages of the timeline, see main.timeline
+            models.Index(fields=['-created_at', '-id'], name='tweet_timeline_idx'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """ A tweet in the "following" timeline of ``owner``, written when the tweet is posted """
+    owner = models.ForeignKey(User, related_name='timeline_entries', on_delete=models.CASCADE)
+    tweet = models.ForeignKey(Tweet, related_name='timeline_entries', on_delete=models.CASCADE)
+    author = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    # copied from the tweet, so a page is read from the (owner, created_at, tweet) index alone
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = 'Timeline entries'
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'tweet'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-tweet'], name='timeline_entry_page_idx'),
+            # dropping the tweets of an unfollowed account
+            models.Index(fields=['owner', 'author'], name='timeline_entry_author_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.owner}: {self.tweet_id}'
+
+
+class FollowRecommendation(models.Model):
+    """ One of the top "who to follow" candidates of a profile, see main.recommendations """
+    profile = models.ForeignKey(Profile, related_name='recommendations', on_delete=models.CASCADE)
+    candidate = models.ForeignKey(Profile, related_name='+', on_delete=models.CASCADE)
+    # number of the profile's follows that follow the candidate
+    score = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.profile} -> {self.candidate}'
+
+
+class StaleRecommendations(models.Model):
+    """ A profile whose recommendations changed because an account it follows followed or unfollowed someone """
+    profile = models.OneToOneField(Profile, primary_key=True, on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name_plural = 'Stale recommendations'
+
 
+class CachedResponse(models.Model):
+    """ A chatbot answer kept for the prompts that normalize to the same key, see main.response_cache """
+    key = models.CharField(max_length=64, unique=True)
+    prompt = models.TextField()
+    response = models.TextField()
+    created_at = models.DateTimeField(db_index=True)  # when it was asked upstream, for the TTL
+    used_at = models.DateTimeField(db_index=True)  # the last hit, for the LRU eviction
+    hits = models.PositiveIntegerField(default=0)
 
+    def __str__(self):
+        return self.prompt[:50]
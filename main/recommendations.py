@@ -0,0 +1,112 @@
+import heapq
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import FollowRecommendation, Profile, StaleRecommendations
+
+TOP_K = getattr(settings, 'FOLLOW_RECOMMENDATIONS', 10)
+# followers of an account marked stale when its follows change, above that they wait for the next full refresh
+STALE_LIMIT = getattr(settings, 'FOLLOW_RECOMMENDATIONS_STALE_LIMIT', 1000)
+
+Follow = Profile.follows.through
+
+
+class FollowGraph:
+    """
+    The follows as compressed sparse rows: the profiles followed by the profile at position ``i``
+    are ``indices[indptr[i]:indptr[i + 1]]``. Positions index ``ids``, the sorted profile ids.
+
+    Loaded with two queries into flat arrays of machine integers, a few bytes per edge instead
+    of a model instance per row.
+    """
+
+    def __init__(self):
+        self.ids = array('q', Profile.objects.order_by('id').values_list('id', flat=True))
+        self.position = {pk: i for i, pk in enumerate(self.ids)}
+        self.indptr = array('q', bytes(8 * (len(self.ids) + 1)))
+        self.indices = array('q')
+
+        edges = Follow.objects.order_by('from_profile_id', 'to_profile_id').values_list('from_profile_id',
+                                                                                       'to_profile_id')
+        for from_id, to_id in edges.iterator(10000):
+            self.indices.append(self.position[to_id])
+            self.indptr[self.position[from_id] + 1] += 1
+        for i in range(len(self.ids)):
+            self.indptr[i + 1] += self.indptr[i]
+
+    def follows(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def candidates(self, i, k=TOP_K):
+        """ (score, profile id) of the top ``k`` friends of friends of the profile at position ``i`` """
+        follows = self.follows(i)
+        known = set(follows)
+        known.add(i)
+        scores = Counter()
+        for j in follows:
+            scores.update(c for c in self.follows(j) if c not in known)
+        # the highest score first, the oldest profile on ties
+        top = heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(score, self.ids[c]) for c, score in top]
+
+
+def candidates_of(profile_id, k=TOP_K):
+    """ candidates() of a single profile, counted by the database """
+    follows = Follow.objects.filter(from_profile_id=profile_id).values('to_profile_id')
+    rows = Follow.objects.filter(from_profile_id__in=follows).exclude(to_profile_id__in=follows) \
+        .exclude(to_profile_id=profile_id).values('to_profile_id').annotate(score=Count('id')) \
+        .order_by('-score', 'to_profile_id').values_list('score', 'to_profile_id')
+    return list(rows[:k])
+
+
+def store(candidates_by_profile):
+    """ Replace the stored recommendations of the profiles in ``{profile id: [(score, candidate id)]}`` """
+    with transaction.atomic():
+        FollowRecommendation.objects.filter(profile_id__in=candidates_by_profile).delete()
+        FollowRecommendation.objects.bulk_create(
+            FollowRecommendation(profile_id=profile_id, candidate_id=candidate_id, score=score, rank=rank)
+            for profile_id, candidates in candidates_by_profile.items()
+            for rank, (score, candidate_id) in enumerate(candidates))
+        StaleRecommendations.objects.filter(profile_id__in=candidates_by_profile).delete()
+
+
+def refresh(profile_ids=None, k=TOP_K, batch_size=500):
+    """ Recompute the recommendations of ``profile_ids`` (every profile by default) from one load of the graph """
+    graph = FollowGraph()
+    if profile_ids is None:
+        profile_ids = graph.ids
+    positions = [graph.position[pk] for pk in profile_ids if pk in graph.position]
+    for start in range(0, len(positions), batch_size):
+        store({graph.ids[i]: graph.candidates(i, k) for i in positions[start:start + batch_size]})
+    return len(positions)
+
+
+def refresh_stale(k=TOP_K):
+    return refresh(list(StaleRecommendations.objects.values_list('profile_id', flat=True)), k)
+
+
+def follows_changed(profile_ids):
+    """
+    The follows of ``profile_ids`` changed: they and their followers are marked stale, the
+    follow request doesn't wait for any recomputation, refresh_stale() does it later.
+    """
+    followers = Follow.objects.filter(to_profile_id__in=profile_ids, to_profile__follower_count__lte=STALE_LIMIT) \
+        .values_list('from_profile_id', flat=True).distinct()
+    stale = set(profile_ids).union(followers)
+    StaleRecommendations.objects.bulk_create((StaleRecommendations(profile_id=pk) for pk in stale),
+                                             ignore_conflicts=True)
+
+
+def recommendations(profile, limit=TOP_K):
+    """
+    The stored candidates of ``profile`` best first, read from the (profile, rank) index. The
+    accounts it followed since they were computed are left out, in the same query.
+    """
+    rows = FollowRecommendation.objects.filter(profile=profile) \
+        .exclude(candidate__in=Follow.objects.filter(from_profile=profile).values('to_profile_id')) \
+        .select_related('candidate__user').order_by('rank')
+    return [row.candidate for row in rows[:limit]]
@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import threading
+import unicodedata
+import weakref
+from collections import Counter
+from concurrent.futures import Future
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CachedResponse
+
+# answers kept, the least recently used go first
+MAX_ENTRIES = getattr(settings, 'AI_CHAT_CACHE_SIZE', 10000)
+TTL = timedelta(seconds=getattr(settings, 'AI_CHAT_CACHE_TTL', 24 * 60 * 60))
+# writes of a process between two evictions, the table may overshoot MAX_ENTRIES by that much
+EVICT_EVERY = getattr(settings, 'AI_CHAT_CACHE_EVICT_EVERY', 100)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+_puts = 0
+
+
+def count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def stats():
+    """ Hits, misses, coalesced calls and evictions of this process, plus what the table holds """
+    with _stats_lock:
+        counters = {name: _stats[name] for name in ('hits', 'misses', 'coalesced', 'evictions')}
+    lookups = counters['hits'] + counters['misses']
+    counters['hit_rate'] = counters['hits'] / lookups if lookups else 0.0
+    counters['entries'] = CachedResponse.objects.count()
+    return counters
+
+
+def normalize(prompt):
+    """ The prompt without the differences that don't change the answer: case, spacing, final punctuation """
+    prompt = unicodedata.normalize('NFKC', prompt).casefold()
+    return ' '.join(prompt.split()).rstrip(' .!?')
+
+
+def make_key(backend, prompt):
+    return hashlib.sha256(f'{backend}\0{normalize(prompt)}'.encode()).hexdigest()
+
+
+def get(key):
+    """ The cached answer of ``key``, None when there is none or it's older than TTL """
+    now = timezone.now()
+    entry = CachedResponse.objects.filter(key=key, created_at__gt=now - TTL).values_list('id', 'response').first()
+    if entry is None:
+        count('misses')
+        return None
+    CachedResponse.objects.filter(id=entry[0]).update(used_at=now, hits=F('hits') + 1)
+    count('hits')
+    return entry[1]
+
+
+def put(key, prompt, response):
+    """ Cache ``response``, and evict once every EVICT_EVERY writes rather than on each of them """
+    global _puts
+    now = timezone.now()
+    CachedResponse.objects.update_or_create(
+        key=key, defaults={'prompt': prompt, 'response': response, 'created_at': now, 'used_at': now, 'hits': 0})
+    with _stats_lock:
+        _puts = (_puts + 1) % EVICT_EVERY
+        due = _puts == 0
+    if due:
+        evict()
+
+
+def evict():
+    """
+    Drop the expired answers and the least recently used ones above MAX_ENTRIES: a range
+    delete on the created_at index and a seek to the oldest used_at, no scan past MAX_ENTRIES.
+    """
+    expired = CachedResponse.objects.filter(created_at__lte=timezone.now() - TTL).delete()[0]
+    evicted = 0
+    excess = CachedResponse.objects.count() - MAX_ENTRIES
+    if excess > 0:
+        stale = CachedResponse.objects.order_by('used_at', 'id').values_list('id', flat=True)[:excess]
+        evicted = CachedResponse.objects.filter(id__in=list(stale)).delete()[0]
+    if expired or evicted:
+        count('evictions', expired + evicted)
+
+
+class SingleFlight:
+    """
+    Concurrent calls for the same key share the first one's result: it runs ``function``, the
+    others wait for it instead of asking upstream too.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            count('coalesced')
+            return future.result()
+        try:
+            future.set_result(function())
+        except Exception as error:
+            future.set_exception(error)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return future.result()
+
+
+flights = SingleFlight()
+# the streams in flight of each event loop, {key: asyncio future of the full answer}
+_streams = weakref.WeakKeyDictionary()
+
+
+def streams_in_flight():
+    loop = asyncio.get_running_loop()
+    if loop not in _streams:
+        _streams[loop] = {}
+    return _streams[loop]
@@ -0,0 +1,190 @@
+import math
+import threading
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+from core import fulltext
+from core.fulltext import make_cursor, parse_query, split_cursor, tokenize
+
+from .models import Tweet
+
+FTS_TABLE = 'main_tweet_fts'
+PAGE_SIZE = 20
+# fts5's bm25() defaults
+K1 = 1.2
+B = 0.75
+
+
+class Fts5Backend:
+    """ The main_tweet_fts table of migration 0007, ranked by fts5's bm25() """
+    name = 'fts5'
+
+    @staticmethod
+    def available():
+        return fulltext.fts5_available(FTS_TABLE)
+
+    def index(self, tweets):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT OR REPLACE INTO {FTS_TABLE}(rowid, body) VALUES (%s, %s)',
+                               [(tweet.id, tweet.body) for tweet in tweets])
+
+    def remove(self, tweet_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(tweet_id,) for tweet_id in tweet_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(f'INSERT INTO {FTS_TABLE}(rowid, body) SELECT id, body FROM {Tweet._meta.db_table}')
+
+    def search(self, terms, cursor, limit):
+        return [(score, tweet_id) for tweet_id, score in fulltext.search(FTS_TABLE, terms, cursor, limit)]
+
+
+class PythonBackend:
+    """
+    An in-process positional inverted index, for databases without FTS5.
+
+    Built from the tweet table on first use and kept current by the same signals as the fts5
+    table, so it only sees the writes of its own process: use it for development and single
+    process deployments. Scores are negated Okapi BM25 like fts5's, so cursors work the same way.
+    """
+    name = 'python'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = None  # word -> {tweet id: [positions]}
+        self.lengths = {}  # tweet id -> number of words
+        self.total_length = 0
+        self.documents = {}  # tweet id -> its distinct words, to remove it without scanning the postings
+        self.words = []  # sorted postings keys, for prefix lookups
+
+    @staticmethod
+    def available():
+        return True
+
+    def _load(self):
+        if self.postings is None:
+            self.postings = defaultdict(dict)
+            self.lengths, self.documents, self.total_length = {}, {}, 0
+            for tweet_id, body in Tweet.objects.values_list('id', 'body').iterator(5000):
+                self._add(tweet_id, body, keep_sorted=False)
+            self.words = sorted(self.postings)
+
+    def _add(self, tweet_id, body, keep_sorted=True):
+        words = tokenize(body)
+        self.lengths[tweet_id] = len(words)
+        self.total_length += len(words)
+        self.documents[tweet_id] = set(words)
+        for position, word in enumerate(words):
+            if keep_sorted and word not in self.postings:
+                insort(self.words, word)
+            self.postings[word].setdefault(tweet_id, []).append(position)
+
+    def _remove(self, tweet_id):
+        self.total_length -= self.lengths.pop(tweet_id, 0)
+        for word in self.documents.pop(tweet_id, ()):
+            del self.postings[word][tweet_id]
+            if not self.postings[word]:
+                del self.postings[word]
+                del self.words[bisect_left(self.words, word)]
+
+    def index(self, tweets):
+        with self.lock:
+            if self.postings is None:
+                return  # loaded from the table on first search
+            for tweet in tweets:
+                self._remove(tweet.id)
+                self._add(tweet.id, tweet.body)
+
+    def remove(self, tweet_ids):
+        with self.lock:
+            if self.postings is not None:
+                for tweet_id in tweet_ids:
+                    self._remove(tweet_id)
+
+    def rebuild(self):
+        with self.lock:
+            self.postings = None
+            self._load()
+
+    def _expand(self, kind, words):
+        """ {tweet id: number of matches} of a term """
+        if kind == 'prefix':
+            matches = Counter()
+            i = bisect_left(self.words, words[0])
+            while i < len(self.words) and self.words[i].startswith(words[0]):
+                postings = self.postings[self.words[i]]
+                matches.update({tweet_id: len(positions) for tweet_id, positions in postings.items()})
+                i += 1
+            return matches
+        postings = [self.postings.get(word, {}) for word in words]
+        if kind == 'word':
+            return Counter({tweet_id: len(positions) for tweet_id, positions in postings[0].items()})
+        matches = Counter()
+        for tweet_id in set.intersection(*(set(docs) for docs in postings)):
+            starts = set(postings[0][tweet_id])
+            for offset, docs in enumerate(postings[1:], start=1):
+                starts &= {position - offset for position in docs[tweet_id]}
+            if starts:
+                matches[tweet_id] = len(starts)
+        return matches
+
+    def search(self, terms, cursor, limit):
+        with self.lock:
+            self._load()
+            matches = [self._expand(kind, words) for kind, words in terms]
+            tweet_ids = set.intersection(*(set(found) for found in matches))
+            total = len(self.lengths)
+            average = self.total_length / total if total else 0
+            results = []
+            for tweet_id in tweet_ids:
+                score = 0.0
+                norm = K1 * (1 - B + B * self.lengths[tweet_id] / average)
+                for found in matches:
+                    idf = max(math.log((total - len(found) + 0.5) / (len(found) + 0.5)), 1e-6)
+                    frequency = found[tweet_id]
+                    score -= idf * frequency * (K1 + 1) / (frequency + norm)
+                results.append((score, tweet_id))
+        if cursor:
+            results = [result for result in results if result > cursor]
+        return sorted(results)[:limit + 1]
+
+
+_backends = {}
+
+
+def get_backend():
+    """ fts5 when the table exists, the in-process index otherwise; TWEET_SEARCH_BACKEND forces one """
+    name = getattr(settings, 'TWEET_SEARCH_BACKEND', None)
+    if name is None:
+        name = 'fts5' if Fts5Backend.available() else 'python'
+    if name not in _backends:
+        _backends[name] = {'fts5': Fts5Backend, 'python': PythonBackend}[name]()
+    return _backends[name]
+
+
+def search_tweets(query, cursor=None, limit=PAGE_SIZE):
+    """
+    Tweets matching every word of ``query``, best matches first.
+
+    Words ending with * match as prefixes and "quoted words" as phrases. Returns a page of
+    tweets with their authors and the cursor of the next page, None on the last page.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return [], None
+    try:
+        rows = get_backend().search(terms, split_cursor(cursor) if cursor else None, limit)
+    except ValueError:  # a cursor that wasn't made by us
+        return [], None
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = make_cursor(*rows[-1])
+    tweets = Tweet.objects.select_related('user__profile').in_bulk([tweet_id for score, tweet_id in rows])
+    return [tweets[tweet_id] for score, tweet_id in rows if tweet_id in tweets], next_cursor
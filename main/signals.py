@@ -0,0 +1,81 @@
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import recommendations
+from .models import Profile, Tweet
+from .search import get_backend
+from .timeline import fan_out, follow_changed
+from .typeahead import usernames
+
+
+@receiver(post_save, sender=Tweet)
+def fan_out_tweet(sender, instance, created, raw=False, **kwargs):
+    # deleted tweets leave the timelines through the cascade of TimelineEntry.tweet
+    if created and not raw:
+        fan_out(instance)
+
+
+@receiver(post_save, sender=Tweet)
+def update_search_index_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_backend().index([instance])
+
+
+@receiver(post_delete, sender=Tweet)
+def update_search_index_on_delete(sender, instance, **kwargs):
+    get_backend().remove([instance.id])
+
+
+@receiver(post_save, sender=User)
+def update_username_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        usernames.update(instance.id, instance.username)
+
+
+@receiver(post_delete, sender=User)
+def remove_from_username_index(sender, instance, **kwargs):
+    usernames.remove(instance.id)
+
+
+def update_follow_counts(instance, reverse, profile_ids, added):
+    delta = 1 if added else -1
+    # instance.follows changed: instance follows more or fewer accounts, each of them has one
+    # follower more or less; the other way around for instance.followed_by
+    own, other = ('follower_count', 'following_count') if reverse else ('following_count', 'follower_count')
+    Profile.objects.filter(pk=instance.pk).update(**{own: F(own) + delta * len(profile_ids)})
+    Profile.objects.filter(pk__in=profile_ids).update(**{other: F(other) + delta})
+    instance.refresh_from_db(fields=Profile.COUNTERS)
+
+
+def _follow_pairs(instance, reverse, profile_ids):
+    """ (follower user id, followed user id) pairs of a follows change """
+    user_ids = Profile.objects.filter(pk__in=profile_ids).values_list('user_id', flat=True)
+    if reverse:  # instance.followed_by changed
+        return [(user_id, instance.user_id) for user_id in user_ids]
+    return [(instance.user_id, user_id) for user_id in user_ids]
+
+
+@receiver(m2m_changed, sender=Profile.follows.through)
+def follows_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Keep the follow counters, the following timelines and the recommendations in step with Profile.follows """
+    if action in ('pre_remove', 'pre_clear'):
+        # post_remove gets the requested ids, not the ones that were really followed, and post_clear gets none
+        own, other = ('to_profile', 'from_profile') if reverse else ('from_profile', 'to_profile')
+        follows = sender.objects.filter(**{own: instance})
+        if pk_set is not None:
+            follows = follows.filter(**{f'{other}__in': pk_set})
+        instance._removed_follows = set(follows.values_list(f'{other}_id', flat=True))
+        return
+
+    if action == 'post_add':
+        profile_ids, added = pk_set, True  # only the follows that didn't exist yet
+    elif action in ('post_remove', 'post_clear'):
+        profile_ids, added = instance.__dict__.pop('_removed_follows', set()), False
+    else:
+        return
+    if profile_ids:
+        update_follow_counts(instance, reverse, profile_ids, added)
+        follow_changed(_follow_pairs(instance, reverse, profile_ids), followed=added)
+        recommendations.follows_changed(profile_ids if reverse else [instance.pk])
@@ -1,3 +1,791 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import openai
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.fulltext import reset_tables
+from main import chat, response_cache
+from main.graph import neighbours
+from main.models import CachedResponse, Chat, ChatSession, FollowRecommendation, Profile, StaleRecommendations, TimelineEntry, Tweet
+from main.recommendations import FollowGraph, candidates_of, recommendations, refresh_stale
+from main.search import Fts5Backend, get_backend, parse_query, search_tweets
+from main.timeline import following_page, timeline_page
+from main.typeahead import UsernameIndex, suggest_users, usernames
+
+
+class TweetLikeTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        self.other = User.objects.create_user('bob', password='secret')
+        self.tweet = Tweet.objects.create(user=self.other, body='hello')
+
+    def test_toggle_like_keeps_the_counter(self):
+        self.assertTrue(self.tweet.toggle_like(self.user))
+        self.assertTrue(self.tweet.toggle_like(self.other))
+        self.assertEqual(self.tweet.like_count, 2)
+        self.assertEqual(self.tweet.likes.count(), 2)
+
+        self.assertFalse(self.tweet.toggle_like(self.user))
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.number_of_likes(), 1)
+        self.assertEqual(list(self.tweet.likes.all()), [self.other])
+
+    def test_tweet_like_view(self):
+        self.client.force_login(self.user)
+        url = reverse('main:tweet_like', args=(self.tweet.id,))
+        self.client.get(url, HTTP_REFERER='/')
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 1)
+        self.client.get(url, HTTP_REFERER='/')
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.like_count, 0)
+
+    def test_liked_ids(self):
+        liked = Tweet.objects.create(user=self.other, body='liked')
+        liked.toggle_like(self.user)
+        tweets = list(Tweet.objects.all())
+        with self.assertNumQueries(1):
+            self.assertEqual(Tweet.objects.liked_ids(self.user, tweets), {liked.id})
+
+    def test_home_queries_dont_grow_with_the_feed(self):
+        self.client.force_login(self.user)
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('main:home'))
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        few = count_queries()
+        for i in range(10):
+            tweet = Tweet.objects.create(user=self.other if i % 2 else self.user, body=f'tweet {i}')
+            tweet.toggle_like(self.user)
+        self.assertEqual(count_queries(), few)
+
+
+class TimelineTest(TestCase):
+    """ Keyset pages of the home timeline """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='secret')
+        cls.tweets = [Tweet.objects.create(user=cls.user, body=f'tweet {i}') for i in range(7)]
+        # the four oldest tweets are posted at the same moment, the id decides their order
+        cls.same = cls.tweets[0].created_at
+        Tweet.objects.filter(id__in=[tweet.id for tweet in cls.tweets[:4]]).update(created_at=cls.same)
+
+    def test_pages_cover_the_timeline_once(self):
+        seen, cursor = [], None
+        while True:
+            tweets, cursor = timeline_page(cursor=cursor, limit=3)
+            seen.extend(tweets)
+            if cursor is None:
+                break
+        expected = sorted(self.tweets, key=lambda tweet: (Tweet.objects.get(id=tweet.id).created_at, tweet.id),
+                          reverse=True)
+        self.assertEqual([tweet.id for tweet in seen], [tweet.id for tweet in expected])
+
+    def test_page_loads_authors_with_one_query(self):
+        with self.assertNumQueries(1):
+            tweets, cursor = timeline_page(limit=3)
+            [tweet.user.profile for tweet in tweets]
+
+    def test_bad_cursor(self):
+        with self.assertRaises(ValueError):
+            timeline_page(cursor='yesterday:1')
+        response = self.client.get(reverse('main:home'), {'after': 'nope'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_infinite_scroll(self):
+        tweets, cursor = timeline_page(limit=20)
+        self.assertIsNone(cursor)
+        cursor = f'{self.same.isoformat()}:{self.tweets[3].id}'
+        response = self.client.get(reverse('main:home'), {'after': cursor}, HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(response, 'components/tweet-list-elements.html')
+        self.assertTemplateNotUsed(response, 'main/home.html')
+        self.assertEqual([tweet.id for tweet in response.context['tweets']],
+                         [self.tweets[2].id, self.tweets[1].id, self.tweets[0].id])
+
+    def test_timeline_index(self):
+        queryset = Tweet.objects.filter(created_at__lte=self.same).order_by('-created_at', '-id')[:20]
+        if connection.vendor == 'sqlite':
+            self.assertIn('tweet_timeline_idx', queryset.explain())
+
+
+class FollowingTimelineTest(TestCase):
+    """ Fan-out on write of the following timelines, with fan-out on read for popular accounts """
+
+    def setUp(self):
+        self.reader = User.objects.create_user('reader', password='secret')
+        self.author = User.objects.create_user('author', password='secret')
+        self.stranger = User.objects.create_user('stranger', password='secret')
+
+    def follow(self, user, other):
+        user.profile.follows.add(other.profile)
+
+    def page_ids(self, user, **kwargs):
+        tweets, cursor = following_page(user, **kwargs)
+        return [tweet.id for tweet in tweets], cursor
+
+    def test_fan_out_on_write(self):
+        self.follow(self.reader, self.author)
+        first = Tweet.objects.create(user=self.author, body='first')
+        second = Tweet.objects.create(user=self.author, body='second')
+        Tweet.objects.create(user=self.stranger, body='not followed')
+
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.reader).count(), 2)
+        self.assertEqual(self.page_ids(self.reader), ([second.id, first.id], None))
+        # the author follows themselves
+        self.assertEqual(self.page_ids(self.author)[0], [second.id, first.id])
+
+        second.delete()
+        self.assertEqual(self.page_ids(self.reader)[0], [first.id])
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        old = Tweet.objects.create(user=self.author, body='before the follow')
+        self.follow(self.reader, self.author)
+        self.assertEqual(self.page_ids(self.reader)[0], [old.id])
+
+        self.reader.profile.follows.remove(self.author.profile)
+        self.assertEqual(self.page_ids(self.reader)[0], [])
+
+        self.author.profile.followed_by.add(self.reader.profile)
+        self.assertEqual(self.page_ids(self.reader)[0], [old.id])
+        self.reader.profile.follows.clear()
+        self.assertEqual(self.page_ids(self.reader)[0], [])
+
+    def test_popular_accounts_are_read_on_read(self):
+        own = Tweet.objects.create(user=self.reader, body='own')
+        self.follow(self.reader, self.author)
+        with mock.patch('main.timeline.FANOUT_LIMIT', 1):
+            # author has two followers now: themselves and reader
+            pulled = [Tweet.objects.create(user=self.author, body=f'popular {i}') for i in range(3)]
+            self.assertFalse(TimelineEntry.objects.filter(tweet__in=pulled).exists())
+
+            ids, cursor = self.page_ids(self.reader, limit=2)
+            self.assertEqual(ids, [pulled[2].id, pulled[1].id])
+            ids, cursor = self.page_ids(self.reader, cursor=cursor, limit=2)
+            self.assertEqual(ids, [pulled[0].id, own.id])
+            self.assertIsNone(cursor)
+
+    def test_fan_out_resumes_under_the_limit(self):
+        self.follow(self.reader, self.author)
+        self.follow(self.stranger, self.author)
+        with mock.patch('main.timeline.FANOUT_LIMIT', 2):
+            # author, reader and stranger follow the author: read from the tweet table
+            pulled = Tweet.objects.create(user=self.author, body='while popular')
+            self.assertFalse(TimelineEntry.objects.filter(tweet=pulled).exists())
+            self.stranger.profile.follows.remove(self.author.profile)
+            self.assertEqual(self.page_ids(self.reader)[0], [pulled.id])
+            self.assertTrue(TimelineEntry.objects.filter(owner=self.reader, tweet=pulled).exists())
+
+    def test_backfill_command(self):
+        self.follow(self.reader, self.author)
+        tweets = [Tweet.objects.create(user=self.author, body=f'tweet {i}') for i in range(3)]
+        TimelineEntry.objects.all().delete()
+
+        call_command('backfill_timelines', per_author=2, stdout=StringIO())
+        self.assertEqual(self.page_ids(self.reader)[0], [tweets[2].id, tweets[1].id])
+
+    def test_following_view(self):
+        self.follow(self.reader, self.author)
+        tweet = Tweet.objects.create(user=self.author, body='hello')
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('main:following'))
+        self.assertEqual(list(response.context['tweets']), [tweet])
+        self.assertContains(response, 'hello')
+
+
+class FollowCountsTest(TestCase):
+    """ Follower and following counters kept by the m2m_changed receiver """
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'user{i}', password='secret') for i in range(4)]
+        self.profiles = [user.profile for user in self.users]
+
+    def assertCounts(self, profile, followers, following):
+        profile = Profile.objects.get(pk=profile.pk)
+        self.assertEqual((profile.follower_count, profile.following_count), (followers, following))
+        self.assertEqual((profile.followed_by.count(), profile.follows.count()), (followers, following))
+
+    def test_counts(self):
+        first, second, third, fourth = self.profiles
+        # everybody follows themselves
+        self.assertCounts(first, 1, 1)
+
+        first.follows.add(second, third)
+        second.followed_by.add(third, fourth)
+        self.assertEqual(first.following_count, 3)
+        self.assertCounts(second, 4, 1)
+
+        # removing a follow that doesn't exist changes nothing
+        first.follows.remove(fourth)
+        self.assertCounts(first, 1, 3)
+        second.followed_by.remove(first)
+        self.assertCounts(first, 1, 2)
+        self.assertCounts(second, 3, 1)
+
+        # second was following themselves too
+        second.followed_by.clear()
+        self.assertCounts(second, 0, 0)
+        self.assertCounts(third, 2, 1)
+
+    def test_stale_instance_keeps_the_counts(self):
+        first, second = self.profiles[:2]
+        stale = Profile.objects.get(pk=second.pk)
+        first.follows.add(second)
+        stale.profile_bio = 'Hello'
+        stale.save()
+        self.assertCounts(second, 2, 1)
+        self.assertEqual(Profile.objects.get(pk=second.pk).profile_bio, 'Hello')
+
+    def test_follow_views(self):
+        first, second = self.users[:2]
+        self.client.force_login(first)
+        self.client.get(reverse('main:follow', args=(second.id,)), HTTP_REFERER='/')
+        self.assertCounts(second.profile, 2, 1)
+        self.client.get(reverse('main:unfollow', args=(second.id,)), HTTP_REFERER='/')
+        self.assertCounts(second.profile, 1, 1)
+
+
+class NeighboursTest(TestCase):
+    """ Pages of the follow graph """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'user{i}', password='secret') for i in range(8)]
+        cls.star = cls.users[0].profile
+        for user in cls.users[1:]:
+            user.profile.follows.add(cls.star)
+        cls.star.follows.add(cls.users[1].profile)
+
+    def test_pages(self):
+        seen, cursor = [], None
+        while True:
+            profiles, cursor = neighbours(self.star, 'followers', cursor, limit=3)
+            seen.extend(profiles)
+            if cursor is None:
+                break
+        self.assertEqual([profile.id for profile in seen], sorted(user.profile.id for user in self.users))
+        self.assertEqual(neighbours(self.star, 'follows')[0], [self.star, self.users[1].profile])
+
+    def test_api(self):
+        self.client.force_login(self.users[0])
+        url = reverse('main:profile_neighbours', args=(self.users[0].id, 'followers'))
+        with self.assertNumQueries(5):  # session, user, profile, page, followed ids
+            data = self.client.get(url, {'limit': 5}).json()
+        self.assertEqual(data['count'], 8)
+        self.assertEqual(len(data['results']), 5)
+        self.assertEqual([result['followed'] for result in data['results'][:3]], [True, True, False])
+        data = self.client.get(url, {'limit': 5, 'after': data['next']}).json()
+        self.assertEqual((len(data['results']), data['next']), (3, None))
+        self.assertEqual(self.client.get(url, {'after': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('main:profile_neighbours', args=(1, 'x'))).status_code, 404)
+
+    def test_api_is_private(self):
+        url = reverse('main:profile_neighbours', args=(self.users[0].id, 'followers'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.users[1])
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_followers_page_queries_dont_grow_with_the_graph(self):
+        self.client.force_login(self.users[0])
+        url = reverse('main:followers', args=(self.users[0].id,))
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        few = count_queries()
+        for i in range(5):
+            User.objects.create_user(f'new{i}', password='secret').profile.follows.add(self.star)
+        self.assertEqual(count_queries(), few)
+
+
+class RecommendationTest(TestCase):
+    """ Friends of friends "who to follow" recommendations """
+
+    def setUp(self):
+        self.profiles = {name: User.objects.create_user(name, password='secret').profile for name in 'abcdef'}
+
+    def follow(self, follower, *names):
+        self.profiles[follower].follows.add(*(self.profiles[name] for name in names))
+
+    def names(self, follower):
+        return [profile.user.username for profile in recommendations(self.profiles[follower])]
+
+    def test_friends_of_friends(self):
+        self.follow('b', 'd', 'e')
+        self.follow('c', 'd')
+        self.follow('a', 'b', 'c')
+        # computed later, not in the follow request
+        self.assertEqual(self.names('a'), [])
+        refresh_stale()
+        # d is followed by both of a's follows
+        self.assertEqual(self.names('a'), ['d', 'e'])
+        self.assertEqual(FollowRecommendation.objects.get(profile=self.profiles['a'], rank=0).score, 2)
+
+        # an account a follows now leaves the recommendations before the refresh
+        self.follow('a', 'd')
+        self.assertEqual(self.names('a'), ['e'])
+        self.profiles['a'].follows.remove(self.profiles['d'])
+        self.assertEqual(self.names('a'), ['d', 'e'])
+
+    def test_followers_are_refreshed_later(self):
+        self.follow('a', 'b')
+        refresh_stale()
+        with CaptureQueriesContext(connection) as queries:
+            self.follow('b', 'f')
+        # nothing is recomputed in the follow request, b and its followers are only marked
+        self.assertFalse(any('main_followrecommendation' in query['sql'] for query in queries))
+        self.assertTrue(StaleRecommendations.objects.filter(profile=self.profiles['a']).exists())
+        self.assertEqual(self.names('a'), [])
+
+        self.assertEqual(refresh_stale(), 2)  # a and b
+        self.assertEqual(self.names('a'), ['f'])
+        self.assertFalse(StaleRecommendations.objects.exists())
+
+    def test_serving_is_one_query(self):
+        self.follow('b', 'c', 'd', 'e', 'f')
+        self.follow('a', 'b')
+        with self.assertNumQueries(1):
+            [profile.user.username for profile in recommendations(self.profiles['a'])]
+
+    def test_graph_matches_the_database(self):
+        rng = random.Random(7)
+        profiles = list(self.profiles.values()) + [User.objects.create_user(f'user{i}').profile for i in range(20)]
+        for profile in profiles:
+            profile.follows.add(*rng.sample(profiles, 4))
+
+        graph = FollowGraph()
+        for profile in profiles:
+            self.assertEqual(graph.candidates(graph.position[profile.id], 5), candidates_of(profile.id, 5))
+
+    def test_refresh_command(self):
+        self.follow('a', 'b')
+        self.follow('b', 'c')
+        FollowRecommendation.objects.all().delete()
+        call_command('refresh_recommendations', '--all', stdout=StringIO())
+        self.assertEqual(self.names('a'), ['c'])
+
+
+class TweetSearchTest(TestCase):
+    """ Ranked tweet search, run against the fts5 table and the in-process index """
+    backend = 'fts5'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='secret')
+        cls.tweets = {key: Tweet.objects.create(user=cls.user, body=body) for key, body in (
+            ('coffee', 'Morning coffee before the release'),
+            ('twice', 'Coffee, coffee and more coffee'),
+            ('phrase', 'The release notes are out'),
+            ('reversed', 'Notes of the release'),
+            ('prefix', 'Releasing on Friday, Café open late'),
+        )}
+
+    def setUp(self):
+        if self.backend == 'fts5' and not Fts5Backend.available():
+            self.skipTest('SQLite without FTS5')
+        settings = override_settings(TWEET_SEARCH_BACKEND=self.backend)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        get_backend().rebuild()
+
+    def search(self, query, **kwargs):
+        return [key for tweet in search_tweets(query, **kwargs)[0]
+                for key, stored in self.tweets.items() if stored.id == tweet.id]
+
+    def test_parse_query(self):
+        self.assertEqual(parse_query('Café rel* "release notes" AND-OR'),
+                         [('word', ['cafe']), ('prefix', ['rel']), ('phrase', ['release', 'notes']),
+                          ('word', ['and']), ('word', ['or'])])
+        self.assertEqual(parse_query('"" ; *'), [])
+
+    def test_words_are_ranked(self):
+        # more occurrences in a shorter tweet rank first
+        self.assertEqual(self.search('COFFEE'), ['twice', 'coffee'])
+        self.assertEqual(self.search('coffee release'), ['coffee'])
+        self.assertEqual(self.search('cafe'), ['prefix'])
+        self.assertEqual(self.search('missing'), [])
+
+    def test_prefix_and_phrase(self):
+        self.assertEqual(set(self.search('releas*')), {'coffee', 'phrase', 'reversed', 'prefix'})
+        self.assertEqual(self.search('"release notes"'), ['phrase'])
+        self.assertEqual(set(self.search('release notes')), {'phrase', 'reversed'})
+
+    def test_pages(self):
+        first, cursor = search_tweets('releas*', limit=3)
+        second, last = search_tweets('releas*', cursor=cursor, limit=3)
+        self.assertEqual((len(first), len(second), last), (3, 1, None))
+        self.assertFalse({tweet.id for tweet in first} & {tweet.id for tweet in second})
+        self.assertEqual(search_tweets('release', cursor='nope'), ([], None))
+
+    def test_index_follows_the_tweets(self):
+        tweet = Tweet.objects.create(user=self.user, body='Tea time')
+        self.assertEqual(search_tweets('tea')[0], [tweet])
+        tweet.body = 'Lunch time'
+        tweet.save()
+        self.assertEqual(search_tweets('tea')[0], [])
+        self.assertEqual(search_tweets('lunch')[0], [tweet])
+        tweet.delete()
+        self.assertEqual(search_tweets('lunch')[0], [])
+
+    def test_view(self):
+        response = self.client.post(reverse('main:search'), {'search_field': 'coffee'})
+        self.assertEqual(len(response.context['searched']), 2)
+        self.assertContains(response, 'Tweets founded: 2')
+
+    def test_fts5_table_is_looked_up_again(self):
+        with mock.patch.object(connection.introspection, 'table_names', return_value=[]):
+            reset_tables()
+            self.assertFalse(Fts5Backend.available())
+        reset_tables()
+        self.assertTrue(Fts5Backend.available())
+
+
+class PythonTweetSearchTest(TweetSearchTest):
+    backend = 'python'
+
+
+class UserTypeaheadTest(TestCase):
+
+    def setUp(self):
+        for username in ('Anna', 'annabel', 'ann', 'bob', 'annie', 'anya'):
+            User.objects.create_user(username, password='secret')
+        usernames.rebuild()
+
+    def names(self, prefix, limit=8):
+        return [user.username for user in suggest_users(prefix, limit)]
+
+    def test_prefix_lookup(self):
+        self.assertEqual(self.names('ANN'), ['ann', 'Anna', 'annabel', 'annie'])
+        self.assertEqual(self.names('an', limit=2), ['ann', 'Anna'])
+        self.assertEqual(self.names('anya'), ['anya'])
+        self.assertEqual(self.names('c'), [])
+        self.assertEqual(self.names('  '), [])
+
+    def test_index_follows_the_users(self):
+        user = User.objects.get(username='bob')
+        user.username = 'Annika'
+        user.save()
+        self.assertEqual(self.names('b'), [])
+        self.assertEqual(self.names('anni'), ['annie', 'Annika'])
+        User.objects.create_user('annex', password='secret')
+        user.delete()
+        self.assertEqual(self.names('ann'), ['ann', 'Anna', 'annabel', 'annex', 'annie'])
+
+    def test_same_names_keep_their_order(self):
+        index = UsernameIndex()
+        index.names = []
+        for user_id, username in ((3, 'Eve'), (1, 'eve'), (2, 'EVE'), (4, 'eva')):
+            index.update(user_id, username)
+        self.assertEqual(index.lookup('ev'), [4, 1, 2, 3])
+        index.remove(2)
+        index.update(1, 'zoe')
+        self.assertEqual(index.lookup('e'), [4, 3])
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            images = [user.profile.profile_image for user in suggest_users('ann')]
+        self.assertEqual(len(images), 4)
+
+    def test_view(self):
+        response = self.client.get(reverse('main:search_user_typeahead'), {'search_field': 'anni'})
+        self.assertContains(response, '@annie')
+        self.assertNotContains(response, '@anna')
+        self.assertContains(response, reverse('main:profile', args=[User.objects.get(username='annie').id]))
+
+
+@override_settings(AI_CHAT_BACKEND='echo')
+class AiChatTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        self.client.force_login(self.user)
+
+    async def read_events(self, response):
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = []
+        for raw in body.strip().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in raw.split('\n'))
+            events.append((fields.get('event', 'message'), fields['data']))
+        return events
+
+    async def test_stream(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('main:chat_stream'), {'user_input': 'hi there'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = await self.read_events(response)
+        self.assertEqual(''.join(json.loads(data) for name, data in events if name == 'message'),
+                         'You said: User: hi there')
+        self.assertEqual(events[-1][0], 'done')
+        saved = await Chat.objects.aget(user=self.user)
+        self.assertEqual(saved.ai_response, 'You said: User: hi there')
+
+    async def test_stream_needs_a_login_and_a_message(self):
+        response = await self.async_client.post(reverse('main:chat_stream'), {'user_input': 'hi'})
+        self.assertEqual(response.status_code, 403)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('main:chat_stream'), {'user_input': ' '})
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get(reverse('main:chat_stream'))
+        self.assertEqual(response.status_code, 405)
+
+    async def test_concurrency_is_capped(self):
+        running = []
+        peak = []
+
+        async def slow(prompt):
+            running.append(prompt)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(prompt)
+            yield prompt
+
+        async def answer(i):
+            return [event async for event in chat.stream_reply(self.user, str(i))]
+
+        with mock.patch.object(chat.EchoBackend, 'stream', side_effect=slow), \
+                mock.patch.object(chat, 'CONCURRENCY', 2):
+            chat._loop_slots.clear()
+            replies = await asyncio.gather(*(answer(i) for i in range(6)))
+        self.assertEqual(max(peak), 2)
+        self.assertTrue(all(reply[-1].startswith('event: done') for reply in replies))
+        chat._loop_slots.clear()
+
+    async def test_busy(self):
+        with mock.patch.object(chat, 'QUEUE_TIMEOUT', 0), mock.patch.object(chat, 'CONCURRENCY', 0):
+            chat._loop_slots.clear()
+            events = [event async for event in chat.stream_reply(self.user, 'hi')]
+        chat._loop_slots.clear()
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0].startswith('event: error'))
+        self.assertFalse(await Chat.objects.filter(user=self.user).aexists())
+
+    async def test_failures(self):
+        async def failing(prompt):
+            raise openai.error.APIError('upstream is down')
+            yield
+
+        with mock.patch.object(chat.EchoBackend, 'errors', (openai.error.OpenAIError,)), \
+                mock.patch.object(chat.EchoBackend, 'stream', side_effect=failing), \
+                self.assertLogs('main.chat', 'ERROR') as logs:
+            events = [event async for event in chat.stream_reply(self.user, 'hi')]
+        self.assertEqual(events, [chat.event(chat.FAILED, 'error')])
+        self.assertIn('upstream is down', logs.output[0])
+
+        # a bug isn't dressed up as a failed answer
+        with mock.patch.object(chat.EchoBackend, 'stream', side_effect=KeyError('choices')):
+            with self.assertRaises(KeyError):
+                [event async for event in chat.stream_reply(self.user, 'hi')]
+        self.assertFalse(await Chat.objects.filter(user=self.user).aexists())
+
+    def test_history_is_paged(self):
+        Chat.objects.bulk_create(Chat(user=self.user, user_input=f'q{i}', ai_response=f'a{i}') for i in range(25))
+        response = self.client.get(reverse('main:chat'))
+        history = response.context['chat_history']
+        self.assertEqual([turn.user_input for turn in history], [f'q{i}' for i in range(5, 25)])
+        response = self.client.get(reverse('main:chat'), {'before': response.context['earlier']})
+        self.assertEqual([turn.user_input for turn in response.context['chat_history']],
+                         [f'q{i}' for i in range(5)])
+        self.assertIsNone(response.context['earlier'])
+
+    def test_post_without_javascript(self):
+        self.client.post(reverse('main:chat'), {'user_input': 'hello'})
+        self.assertEqual(Chat.objects.get(user=self.user).ai_response, 'You said: User: hello')
+
+
+@override_settings(AI_CHAT_BACKEND='echo')
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        response_cache._stats.clear()
+        response_cache._puts = 0
+
+    def test_normalize(self):
+        self.assertEqual(response_cache.normalize(' What is\tDJANGO ?? '), 'what is django')
+        self.assertEqual(response_cache.make_key('echo', 'Hello!'), response_cache.make_key('echo', 'hello'))
+        self.assertNotEqual(response_cache.make_key('echo', 'hello'), response_cache.make_key('openai', 'hello'))
+
+    def test_complete_is_cached(self):
+        with mock.patch.object(chat.EchoBackend, 'complete', return_value='Hi!') as backend:
+            self.assertEqual(chat.complete('User: hello'), 'Hi!')
+            self.assertEqual(chat.complete('User:  Hello.'), 'Hi!')
+        self.assertEqual(backend.call_count, 1)
+        self.assertEqual(CachedResponse.objects.get().hits, 1)
+        stats = response_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_expired_and_least_recently_used(self):
+        for prompt in ('one', 'two', 'three'):
+            response_cache.put(response_cache.make_key('echo', prompt), prompt, prompt.upper())
+        CachedResponse.objects.filter(prompt='one').update(created_at=timezone.now() - timedelta(days=2))
+        self.assertIsNone(response_cache.get(response_cache.make_key('echo', 'one')))
+        self.assertEqual(response_cache.get(response_cache.make_key('echo', 'two')), 'TWO')
+        response_cache.put(response_cache.make_key('echo', 'four'), 'four', 'FOUR')
+        self.assertEqual(CachedResponse.objects.count(), 4)  # not on every write
+        with mock.patch.object(response_cache, 'MAX_ENTRIES', 2):
+            response_cache.evict()
+        # "one" expired, "three" is the least recently used
+        self.assertEqual(set(CachedResponse.objects.values_list('prompt', flat=True)), {'two', 'four'})
+        self.assertEqual(response_cache.stats()['evictions'], 2)
+
+    def test_eviction_every_few_writes(self):
+        with mock.patch.object(response_cache, 'MAX_ENTRIES', 1), mock.patch.object(response_cache, 'EVICT_EVERY', 3):
+            for prompt in ('one', 'two'):
+                response_cache.put(response_cache.make_key('echo', prompt), prompt, prompt.upper())
+            self.assertEqual(CachedResponse.objects.count(), 2)
+            response_cache.put(response_cache.make_key('echo', 'three'), 'three', 'THREE')
+        self.assertEqual(list(CachedResponse.objects.values_list('prompt', flat=True)), ['three'])
+
+    def test_single_flight(self):
+        flights = response_cache.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def upstream():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'answer'
+
+        leader = threading.Thread(target=lambda: results.append(flights.do('key', upstream)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flights.do('key', upstream))) for _ in range(4)]
+        for thread in followers:
+            thread.start()
+        while response_cache._stats['coalesced'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual((len(calls), results), (1, ['answer'] * 5))
+        self.assertEqual(flights.calls, {})
+
+    async def test_streams_are_coalesced(self):
+        calls = []
+
+        async def slow(prompt):
+            calls.append(prompt)
+            for word in ('one', ' two'):
+                await asyncio.sleep(0.01)
+                yield word
+
+        async def answer(user):
+            return [event async for event in chat.stream_reply(user, 'same question')]
+
+        # a new conversation for the third one, the first two turns are in the prompt of alice's next question
+        other = await User.objects.acreate(username='bob')
+        with mock.patch.object(chat.EchoBackend, 'stream', side_effect=slow):
+            first, second = await asyncio.gather(answer(self.user), answer(self.user))
+            third = await answer(other)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(first[:2], [chat.event('one'), chat.event(' two')])
+        self.assertEqual(second[0], chat.event('one two'))
+        self.assertEqual(third[0], chat.event('one two'))
+        self.assertEqual(await Chat.objects.filter(ai_response='one two').acount(), 3)
+
+    def test_stats_view(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('main:chat_cache_stats')).status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get(reverse('main:chat_cache_stats')).json()['entries'], 0)
+
+
+@override_settings(AI_CHAT_BACKEND='echo')
+class ChatSessionTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        self.other = User.objects.create_user('bob', password='secret')
+        self.client.force_login(self.user)
+
+    def ask(self, user_input):
+        self.client.post(reverse('main:chat'), {'user_input': user_input})
+        return Chat.objects.filter(user=self.user).latest('id')
+
+    def test_prompt_has_the_latest_turns(self):
+        for i in range(7):
+            self.ask(f'q{i}')
+        session, turns = chat.conversation(self.user)
+        self.assertEqual([turn.user_input for turn in turns], ['q2', 'q3', 'q4', 'q5', 'q6'])
+        self.assertEqual(ChatSession.objects.get(), session)
+        self.assertEqual(session.turns.count(), 7)
+        prompt = chat.make_prompt('next', session, turns)
+        self.assertTrue(prompt.startswith('User: q2\nAI: You said: '))
+        self.assertTrue(prompt.endswith('\nUser: next'))
+        with self.assertNumQueries(1):
+            chat.conversation(self.user)
+
+    def test_idle_conversation_starts_a_new_session(self):
+        first = self.ask('hello')
+        Chat.objects.filter(pk=first.pk).update(timestamp=timezone.now() - chat.SESSION_IDLE)
+        self.assertEqual(chat.conversation(self.user), (None, []))
+        second = self.ask('hello again')
+        self.assertNotEqual(first.session_id, second.session_id)
+        self.assertEqual(second.ai_response, 'You said: User: hello again')
+
+    def test_clear_only_deletes_the_own_chats(self):
+        for i in range(5):
+            self.ask(f'q{i}')
+        chat.save_turn(self.other, None, 'mine', 'yours')
+        with mock.patch.object(chat, 'DELETE_BATCH', 2):
+            self.client.get(reverse('main:clear'))
+        self.assertFalse(Chat.objects.filter(user=self.user).exists())
+        self.assertFalse(ChatSession.objects.filter(user=self.user).exists())
+        self.assertEqual(Chat.objects.filter(user=self.other).count(), 1)
+        self.assertEqual(chat.delete_in_batches(Chat.objects.filter(user=self.other), batch_size=2), 1)
+
+    def test_compaction(self):
+        for i in range(8):
+            self.ask(f'q{i}')
+        session = ChatSession.objects.get()
+        out = StringIO()
+        with mock.patch.object(chat, 'COMPACT_BATCH', 2):
+            call_command('compact_chats', keep=3, stdout=out)
+        self.assertIn('Compacted 5 turns of 1 sessions', out.getvalue())
+        session.refresh_from_db()
+        self.assertEqual(session.summarized_turns, 5)
+        self.assertTrue(session.summary.startswith('You said: Summarize this conversation'))
+        self.assertEqual([turn.user_input for turn in session.turns.order_by('id')], ['q5', 'q6', 'q7'])
+        self.assertFalse(chat.sessions_to_compact(keep=3).exists())
+        # later batches build on the summary of the earlier ones, the prompt carries it
+        self.assertIn('What it was about before', session.summary)
+        self.assertTrue(chat.make_prompt('q8', session).startswith('Summary of the conversation so far: You said'))
+        response = self.client.get(reverse('main:chat'))
+        self.assertContains(response, 'Earlier conversation (5 messages)')
+
+    def test_many_short_sessions_are_bounded_per_user(self):
+        for i in range(6):
+            session = ChatSession.objects.create(user=self.user)
+            for j in range(2):
+                chat.save_turn(self.user, session, f's{i}q{j}', 'answer')
+        chat.save_turn(self.other, None, 'mine', 'yours')
+        self.assertEqual(list(chat.users_to_trim(keep=5)), [self.user.id])
+        out = StringIO()
+        call_command('compact_chats', keep=3, keep_per_user=5, stdout=out)
+        self.assertIn('deleted 7 turns of 1 users', out.getvalue())
+        self.assertEqual([turn.user_input for turn in Chat.objects.filter(user=self.user).order_by('id')],
+                         ['s3q1', 's4q0', 's4q1', 's5q0', 's5q1'])
+        # the sessions left without a turn go too
+        self.assertEqual(ChatSession.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(Chat.objects.filter(user=self.other).count(), 1)
@@ -0,0 +1,133 @@
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+
+from core.cursors import decode_cursor, encode_cursor
+
+from .models import Profile, TimelineEntry, Tweet
+
+PAGE_SIZE = 20
+# newest first, the id breaks ties between tweets posted in the same microsecond
+ORDERING = ('-created_at', '-id')
+# accounts with more followers aren't copied into the following timelines, their tweets are read
+# from the tweet table when a timeline is shown (fan-out on read)
+FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 1000)
+# tweets of an account copied into a timeline when it's followed
+BACKFILL_TWEETS = getattr(settings, 'TIMELINE_BACKFILL_TWEETS', 200)
+
+
+def _after(cursor, id_field='id'):
+    created_at, last_id = decode_cursor(cursor)
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, **{f'{id_field}__lt': last_id})
+
+
+def timeline_page(tweets=None, cursor=None, limit=PAGE_SIZE):
+    """
+    A page of ``tweets`` (every tweet by default), newest first, with the authors and their profiles.
+
+    Pages are read with a keyset on (created_at, id), so every page is a seek on the timeline
+    index however deep it is. Returns the tweets and the cursor of the next page, None on the
+    last page. A cursor that wasn't made here raises ValueError.
+    """
+    if tweets is None:
+        tweets = Tweet.objects.all()
+    if cursor:
+        tweets = tweets.filter(_after(cursor))
+    tweets = list(tweets.select_related('user__profile').order_by(*ORDERING)[:limit + 1])
+
+    next_cursor = None
+    if len(tweets) > limit:
+        tweets = tweets[:limit]
+        next_cursor = encode_cursor(tweets[-1].created_at, tweets[-1].id)
+    return tweets, next_cursor
+
+
+def follower_ids(author_id):
+    return Profile.objects.filter(follows__user_id=author_id).values_list('user_id', flat=True)
+
+
+def pulled_authors(user_ids):
+    """ The accounts among ``user_ids`` with too many followers to be fanned out on write """
+    return set(Profile.objects.filter(user_id__in=user_ids, follower_count__gt=FANOUT_LIMIT)
+               .values_list('user_id', flat=True))
+
+
+def fan_out(tweet):
+    """ Copy a new tweet into the timelines of the author's followers, returns the number of copies """
+    if pulled_authors([tweet.user_id]):
+        return 0
+    followers = list(follower_ids(tweet.user_id))
+    TimelineEntry.objects.bulk_create([TimelineEntry(owner_id=owner_id, tweet_id=tweet.id, author_id=tweet.user_id,
+                                                     created_at=tweet.created_at) for owner_id in followers],
+                                      ignore_conflicts=True)
+    return len(followers)
+
+
+def fill_timeline(owner_ids, author_ids, per_author=BACKFILL_TWEETS):
+    """ Copy the latest tweets of ``author_ids`` into the timelines of ``owner_ids`` """
+    author_ids = set(author_ids) - pulled_authors(author_ids)
+    entries = []
+    for author_id in author_ids:
+        tweets = Tweet.objects.filter(user_id=author_id).order_by(*ORDERING).values_list('id', 'created_at')
+        for tweet_id, created_at in tweets[:per_author]:
+            entries.extend(TimelineEntry(owner_id=owner_id, tweet_id=tweet_id, author_id=author_id,
+                                         created_at=created_at) for owner_id in owner_ids)
+    TimelineEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+    return len(entries)
+
+
+def follow_changed(pairs, followed):
+    """ Update the timelines for (follower user id, followed user id) pairs that were added or removed """
+    by_owner = defaultdict(set)
+    for owner_id, author_id in pairs:
+        by_owner[owner_id].add(author_id)
+    for owner_id, author_ids in by_owner.items():
+        if followed:
+            fill_timeline([owner_id], author_ids)
+        else:
+            TimelineEntry.objects.filter(owner_id=owner_id, author_id__in=author_ids).delete()
+    if not followed:
+        resume_fan_out(Counter(author_id for owner_id, author_id in pairs))
+
+
+def resume_fan_out(lost_followers):
+    """
+    Backfill the timelines of the followers of the authors that just went back down to FANOUT_LIMIT
+    followers, ``lost_followers`` being {author user id: followers lost}. Nothing was copied while
+    they were read from the tweet table, and following_page stops reading them now.
+    """
+    crossed = Profile.objects.filter(user_id__in=lost_followers, follower_count__lte=FANOUT_LIMIT)
+    for author_id, follower_count in crossed.values_list('user_id', 'follower_count'):
+        if follower_count + lost_followers[author_id] > FANOUT_LIMIT:
+            fill_timeline(list(follower_ids(author_id)), [author_id])
+
+
+def following_page(user, cursor=None, limit=PAGE_SIZE):
+    """
+    A page of the tweets of the accounts ``user`` follows, newest first.
+
+    The copies written on post (fan-out on write) are merged with the tweets of the followed
+    accounts that have more than FANOUT_LIMIT followers, read from the tweet table (fan-out on
+    read). Cursors are the same as the ones of timeline_page.
+    """
+    entries = TimelineEntry.objects.filter(owner=user)
+    if cursor:
+        entries = entries.filter(_after(cursor, 'tweet_id'))
+    keys = list(entries.order_by('-created_at', '-tweet_id').values_list('created_at', 'tweet_id')[:limit + 1])
+
+    pulled = set(Profile.objects.filter(followed_by__user=user, follower_count__gt=FANOUT_LIMIT)
+                 .values_list('user_id', flat=True))
+    if pulled:
+        tweets = Tweet.objects.filter(user_id__in=pulled)
+        if cursor:
+            tweets = tweets.filter(_after(cursor))
+        keys = sorted(set(keys) | set(tweets.order_by(*ORDERING).values_list('created_at', 'id')[:limit + 1]),
+                      reverse=True)
+
+    next_cursor = None
+    if len(keys) > limit:
+        keys = keys[:limit]
+        next_cursor = encode_cursor(*keys[-1])
+    tweets = Tweet.objects.select_related('user__profile').in_bulk([tweet_id for created_at, tweet_id in keys])
+    return [tweets[tweet_id] for created_at, tweet_id in keys if tweet_id in tweets], next_cursor
@@ -0,0 +1,90 @@
+import threading
+from array import array
+from bisect import bisect_left
+
+from django.contrib.auth.models import User
+
+MAX_MATCHES = 8
+
+
+class UsernameIndex:
+    """
+    Lowercase usernames in a sorted list with the user ids in a parallel array, so the users
+    starting with a prefix are a bisect away.
+
+    Loaded from auth_user on first use, then kept current by the User post_save/post_delete
+    receivers; like any in-process index it only sees the writes of its own process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = None
+        self.ids = array('q')
+        self.by_id = {}  # user id -> indexed name, to find the entry of a renamed user
+
+    def _load(self):
+        if self.names is None:
+            rows = sorted((username.lower(), user_id) for user_id, username in
+                          User.objects.values_list('id', 'username').iterator(10000))
+            self.names = [name for name, user_id in rows]
+            self.ids = array('q', (user_id for name, user_id in rows))
+            self.by_id = {user_id: name for name, user_id in rows}
+
+    def _position(self, name, user_id):
+        """ Where (name, user_id) is or would be, entries with the same name are kept in id order """
+        i = bisect_left(self.names, name)
+        while i < len(self.names) and self.names[i] == name and self.ids[i] < user_id:
+            i += 1
+        return i
+
+    def _remove(self, user_id):
+        name = self.by_id.pop(user_id, None)
+        if name is not None:
+            i = self._position(name, user_id)
+            del self.names[i]
+            del self.ids[i]
+
+    def update(self, user_id, username):
+        with self.lock:
+            if self.names is None:
+                return  # loaded from the table on first lookup
+            name = username.lower()
+            if self.by_id.get(user_id) == name:
+                return
+            self._remove(user_id)
+            i = self._position(name, user_id)
+            self.names.insert(i, name)
+            self.ids.insert(i, user_id)
+            self.by_id[user_id] = name
+
+    def remove(self, user_id):
+        with self.lock:
+            if self.names is not None:
+                self._remove(user_id)
+
+    def rebuild(self):
+        with self.lock:
+            self.names = None
+            self._load()
+
+    def lookup(self, prefix, limit=MAX_MATCHES):
+        """ Ids of the first ``limit`` users whose username starts with ``prefix``, in username order """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        with self.lock:
+            self._load()
+            i = bisect_left(self.names, prefix)
+            end = min(i + limit, len(self.names))
+            return [self.ids[j] for j in range(i, end) if self.names[j].startswith(prefix)]
+
+
+usernames = UsernameIndex()
+
+
+def suggest_users(prefix, limit=MAX_MATCHES):
+    """ Users whose username starts with ``prefix`` with their profiles, one query """
+    user_ids = usernames.lookup(prefix, limit)
+    users = User.objects.select_related('profile').only(
+        'id', 'username', 'first_name', 'last_name', 'profile__id', 'profile__profile_image').in_bulk(user_ids)
+    return [users[user_id] for user_id in user_ids if user_id in users]
@@ -17,11 +17,13 @@ app_name = 'main'
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('following/', views.following, name='following'),
     path('add-post/', blog.views.AddPostView.as_view(), name='add_post'),
     path('profile-list/', views.profile_list, name='profile_list'),
     path('profile/<int:pk>/', views.profile, name='profile'),
     path('profile/followers/<int:pk>/', views.followers, name='followers'),
     path('profile/follows/<int:pk>/', views.follows, name='follows'),
+    path('api/profile/<int:pk>/<str:direction>/', views.profile_neighbours, name='profile_neighbours'),
     # extra context Attribute from ContentMixin = keyword argument for as_view()
     # path('ex1/', views.TemplateView.as_view(template_name='ex1.html', extra_context={'title': 'Custom Title'})),
     path('ex2/', views.Ex2View.as_view(), name='ex2'),
@@ -52,6 +54,8 @@ urlpatterns = [
     path('password-reset-complete/', PasswordResetCompleteView.as_view(
         template_name='password_reset_complete.html'), name='password_reset_complete'),
     path('chatbot/', views.ai_chat, name='chat'),
+    path('chatbot/stream/', views.ai_chat_stream, name='chat_stream'),
+    path('chatbot/cache-stats/', views.ai_chat_cache_stats, name='chat_cache_stats'),
     path('clear-chat/', views.clear_chat, name='clear'),
     path('update-user/', views.update_user, name='update_user'),
     path('tweet_like/<int:pk>', views.tweet_like, name='tweet_like'),
@@ -62,6 +66,7 @@ urlpatterns = [
     path('follow/<int:pk>', views.follow, name='follow'),
     path('search/', views.search, name='search'),
     path('search_user/', views.search_user, name='search_user'),
+    path('search_user/typeahead/', views.search_user_typeahead, name='search_user_typeahead'),
     path('index/', views.index, name='index'),
     # path('simple_chatbot/', SimpleChatbot.as_view(), name='chatbot'),
 ]
\ No newline at end of file
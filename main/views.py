@@ -8,7 +8,8 @@ from django.contrib.auth.views import LogoutView
 from django.contrib.messages.views import SuccessMessageMixin
 from django.db.models import F
 from django.shortcuts import render, redirect, get_object_or_404, resolve_url
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect, JsonResponse, \
+    StreamingHttpResponse
 from django.urls import reverse_lazy, reverse
 from django.utils import timezone
 from django.views.generic import TemplateView, RedirectView, DetailView, ListView
@@ -18,10 +19,20 @@ from django.contrib.auth.decorators import permission_required, login_required
 
 from blog.models import Post
 from main.forms import AddForm, SignUpForm, TweetForm, ProfileUpdateForm, ChangePasswordForm
-from main.models import Profile, Book, Tweet, Chat
+from main.models import Profile, Book, Tweet, Chat, ChatSession
+from main.chat import clear_history, complete, conversation, history_page, make_prompt, save_turn, stream_reply
 from main.common import UserAccessMixin
+from main import response_cache
+from main.graph import DIRECTIONS, PAGE_SIZE, followed_ids, neighbours
+from main.recommendations import recommendations
+from main.search import search_tweets
+from main.timeline import following_page, timeline_page
+from main.typeahead import suggest_users
 
-import openai
+# followers listed on a profile page, the rest are on the followers page
+FOLLOWERS_PREVIEW = 10
+MAX_NEIGHBOURS = 100
+PROFILES_PER_PAGE = 20
 
 
 def home(request):
@@ -34,12 +45,35 @@ def home(request):
                 tweet.save()
                 messages.success(request, 'Your Tweet Has Been Posted.')
                 return redirect('main:home')
+    else:
+        form = None
 
-        tweets = Tweet.objects.all().order_by('-created_at')
-        return render(request, 'main/home.html', {'tweets': tweets, 'form': form})
+    try:
+        tweets, next_cursor = timeline_page(cursor=request.GET.get('after'))
+    except ValueError:
+        tweets, next_cursor = [], None
+    context = {'tweets': tweets, 'next_cursor': next_cursor, 'form': form, 'timeline_url': reverse('main:home'),
+               'liked_ids': Tweet.objects.liked_ids(request.user, tweets)}
+    if request.htmx:
+        # next page of the infinite scroll
+        return render(request, 'components/tweet-list-elements.html', context)
+    return render(request, 'main/home.html', context)
+
+
+def following(request):
+    if request.user.is_authenticated:
+        try:
+            tweets, next_cursor = following_page(request.user, cursor=request.GET.get('after'))
+        except ValueError:
+            tweets, next_cursor = [], None
+        context = {'tweets': tweets, 'next_cursor': next_cursor, 'timeline_url': reverse('main:following'),
+                   'liked_ids': Tweet.objects.liked_ids(request.user, tweets)}
+        if request.htmx:
+            return render(request, 'components/tweet-list-elements.html', context)
+        return render(request, 'main/following.html', context)
     else:
-        tweets = Tweet.objects.all().order_by('-created_at')
-        return render(request, 'main/home.html', {'tweets': tweets})
+        messages.info(request, 'You Must Be Logged In To View This Page...')
+        return redirect('main:home')
 
 
 class Ex2View(TemplateView):
@@ -300,22 +334,25 @@ def ai_chat(request):
     try:
         if request.user.is_authenticated:
             if request.method == 'POST':
+                # without javascript: the page waits for the whole answer, see ai_chat_stream
                 user_input = request.POST.get('user_input')
-                ai_response = generate_response(user_input)
+                session, turns = conversation(request.user)
+                ai_response = generate_response(user_input, session, turns)
                 # saving user_input and ai_response in the database
-                Chat.objects.create(user=request.user, user_input=user_input, ai_response=ai_response)
+                save_turn(request.user, session, user_input, ai_response)
 
-            # else:
-            #     # if user didn't enter any input nothing should be sent
-            #     user_input = ''
-            #     ai_response = ''
-            #     return redirect('main:chat')
-
-            # displaying the chat history base on user
-            chat_history = Chat.objects.filter(user=request.user)
+            # displaying the latest chats of the user, the earlier ones a page at a time
+            try:
+                chat_history, earlier = history_page(request.user, request.GET.get('before'))
+            except ValueError:
+                chat_history, earlier = [], None
+            # what the compacted turns were about, above the oldest page
+            summaries = [] if earlier else ChatSession.objects.filter(user=request.user).exclude(summary='') \
+                .order_by('id')
 
             return render(request, 'main/chat.html',
-                          {'user_input': user_input, 'chatbot_response': ai_response, 'chat_history': chat_history})
+                          {'user_input': user_input, 'chatbot_response': ai_response, 'chat_history': chat_history,
+                           'earlier': earlier, 'summaries': summaries})
 
         else:
             messages.info(request, 'You Must Be Logged In To View This Page...')
@@ -325,37 +362,58 @@ def ai_chat(request):
         return redirect('main:home')
 
 
-openai.api_key = os.environ.get('OPEN_API')
+async def ai_chat_stream(request):
+    """ Answer a chat message as server-sent events, without holding a worker while the model writes """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'You Must Be Logged In To Chat...'}, status=403)
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    user_input = request.POST.get('user_input', '').strip()
+    if not user_input:
+        return JsonResponse({'error': 'Type a message first.'}, status=400)
+    response = StreamingHttpResponse(stream_reply(user, user_input), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx would hold the events back otherwise
+    return response
+
 
+def ai_chat_cache_stats(request):
+    """ The counters of the chatbot response cache of this process as JSON, for the staff """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    return JsonResponse(response_cache.stats())
 
-# Generating response from OpenAI Library
-def generate_response(user_input):
-    prompt = f'User: {user_input}'
 
-    response = openai.Completion.create(
-        model='text-davinci-002',
-        prompt=prompt,
-        max_tokens=1000,
-        n=1,
-        stop=None,
-        temperature=0.5,
-    )
-    message = response['choices'][0]['text']
-    return message
+# Generating response from the completion backend of main.chat
+def generate_response(user_input, session=None, turns=()):
+    return complete(make_prompt(user_input, session, turns))
 
 
 # Clear chat
 def clear_chat(request):
-    # clear the chat conversation
-    Chat.objects.all().delete()
+    # clear the chat conversation of the user
+    if request.user.is_authenticated:
+        clear_history(request.user)
     return redirect('main:chat')
 
 
 def profile_list(request):
     if request.user.is_authenticated:
-        profiles = Profile.objects.all()
+        profiles = Profile.objects.select_related('user').order_by('id')
         # profiles = Profile.objects.exclude(user=request.user)
-        return render(request, 'main/profile_list.html', {'profiles': profiles})
+        after = request.GET.get('after', '')
+        if after.isdigit():
+            profiles = profiles.filter(id__gt=int(after))
+        profiles = list(profiles[:PROFILES_PER_PAGE + 1])
+        next_cursor = None
+        if len(profiles) > PROFILES_PER_PAGE:
+            profiles = profiles[:PROFILES_PER_PAGE]
+            next_cursor = profiles[-1].id
+        return render(request, 'main/profile_list.html', {
+            'profiles': profiles, 'next_cursor': next_cursor,
+            'who_to_follow': recommendations(request.user.profile),
+        })
     else:
         messages.info(request, 'You Must Be Logged In To View This Page...')
         return redirect('main:home')
@@ -363,8 +421,8 @@ def profile_list(request):
 
 def profile(request, pk):
     if request.user.is_authenticated:
-        profile = Profile.objects.get(user_id=pk)
-        tweets = Tweet.objects.filter(user_id=pk)
+        profile = Profile.objects.select_related('user').get(user_id=pk)
+        tweets = list(Tweet.objects.filter(user_id=pk).select_related('user__profile'))
         p_form = ProfileUpdateForm(instance=request.user.profile)
         # PostForm logic
         if request.method == 'POST':
@@ -382,9 +440,17 @@ def profile(request, pk):
                 current_user_profile.follows.remove(profile)  # profile = pk
             elif action == 'follow':
                 current_user_profile.follows.add(profile)
-            # Save the profile
-            current_user_profile.save()
-        return render(request, 'main/profile.html', {'profile': profile, 'tweets': tweets, 'p_form': p_form})
+            # the follow counters were updated by the m2m_changed receiver
+            profile.refresh_from_db(fields=Profile.COUNTERS)
+        follows_preview, _ = neighbours(profile, 'follows', limit=3)
+        followers_preview, _ = neighbours(profile, 'followers', limit=FOLLOWERS_PREVIEW)
+        return render(request, 'main/profile.html', {
+            'profile': profile, 'tweets': tweets, 'p_form': p_form,
+            'liked_ids': Tweet.objects.liked_ids(request.user, tweets),
+            'follows_preview': follows_preview, 'followers_preview': followers_preview,
+            'followed_back_ids': followed_ids(profile, followers_preview),
+            'is_following': bool(followed_ids(request.user.profile, [profile])),
+        })
     else:
         messages.info(request, 'You Must Be Logged In To View This Page...')
         return redirect('main:home')
@@ -394,7 +460,13 @@ def followers(request, pk):
     if request.user.is_authenticated:
         if request.user.id == pk:
             profiles = Profile.objects.get(user_id=pk)
-            return render(request, 'main/followers.html', {'profiles': profiles})
+            try:
+                page, next_cursor = neighbours(profiles, 'followers', cursor=request.GET.get('after'))
+            except ValueError:
+                page, next_cursor = [], None
+            return render(request, 'main/followers.html', {'profiles': profiles, 'page': page,
+                                                           'next_cursor': next_cursor,
+                                                           'followed_ids': followed_ids(profiles, page)})
         else:
             messages.info(request, 'That\'s Not Your Profile Page.')
             return redirect('main:home')
@@ -408,7 +480,13 @@ def follows(request, pk):
     if request.user.is_authenticated:
         if request.user.id == pk:
             profiles = Profile.objects.get(user_id=pk)
-            return render(request, 'main/follows.html', {'profiles': profiles})
+            try:
+                page, next_cursor = neighbours(profiles, 'follows', cursor=request.GET.get('after'))
+            except ValueError:
+                page, next_cursor = [], None
+            return render(request, 'main/follows.html', {'profiles': profiles, 'page': page,
+                                                         'next_cursor': next_cursor,
+                                                         'followed_ids': followed_ids(profiles, page)})
         else:
             messages.info(request, 'That\'s Not Your Profile Page.')
             return redirect('main:home')
@@ -418,6 +496,32 @@ def follows(request, pk):
         return redirect('main:home')
 
 
+@login_required
+def profile_neighbours(request, pk, direction):
+    """ A page of the followers or the follows of your own profile as JSON, like the followers/follows pages """
+    if direction not in DIRECTIONS:
+        raise Http404
+    if request.user.id != pk:
+        return JsonResponse({'error': 'That\'s not your profile.'}, status=403)
+    profile = get_object_or_404(Profile, user_id=pk)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', PAGE_SIZE)), MAX_NEIGHBOURS))
+        profiles, next_cursor = neighbours(profile, direction, request.GET.get('after'), limit)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    following = followed_ids(profile, profiles)
+    results = [{
+        'id': neighbour.user_id,
+        'username': neighbour.user.username,
+        'url': reverse('main:profile', args=(neighbour.user_id,)),
+        'image': neighbour.profile_image.url if neighbour.profile_image else None,
+        'followed': neighbour.id in following,
+    } for neighbour in profiles]
+    count = profile.follower_count if direction == 'followers' else profile.following_count
+    return JsonResponse({'results': results, 'next': next_cursor, 'count': count})
+
+
 def update_user(request):
     if request.user.is_authenticated:
         current_user = User.objects.get(id=request.user.id)
@@ -442,10 +546,7 @@ def update_user(request):
 def tweet_like(request, pk):
     if request.user.is_authenticated:
         tweet = get_object_or_404(Tweet, id=pk)
-        if tweet.likes.filter(id=request.user.id):
-            tweet.likes.remove(request.user)
-        else:
-            tweet.likes.add(request.user)
+        tweet.toggle_like(request.user)
         return redirect(request.META.get('HTTP_REFERER'))  # http header referer- redirect to referring header
     else:
         messages.info(request, 'You Must Be Logged In To View That Page.')
@@ -455,7 +556,8 @@ def tweet_like(request, pk):
 def tweet_show(request, pk):
     tweet = get_object_or_404(Tweet, id=pk)
     if tweet:
-        return render(request, 'main/show_tweet.html', {'tweet': tweet})
+        return render(request, 'main/show_tweet.html',
+                      {'tweet': tweet, 'liked_ids': Tweet.objects.liked_ids(request.user, [tweet])})
     else:
         messages.error(request, "That Tweet Doesn't Exist.")
         return redirect('main:home')
@@ -490,7 +592,8 @@ def edit_tweet(request, pk):
                     messages.success(request, f'Tweet "{tweet.body[:30]}..." has been successfully updated.')
                     return redirect('main:home')
             else:
-                return render(request, 'main/edit_tweet.html', {'form': form, 'tweet': tweet})
+                liked_ids = Tweet.objects.liked_ids(request.user, [tweet])
+                return render(request, 'main/edit_tweet.html', {'form': form, 'tweet': tweet, 'liked_ids': liked_ids})
         else:
             messages.error(request, "This is not your tweet. You can't edit it!")
             return HttpResponseRedirect(reverse('main:home'))
@@ -505,8 +608,6 @@ def unfollow(request, pk):
         profile = Profile.objects.get(user_id=pk)
         # unfollow the user
         request.user.profile.follows.remove(profile)
-        # save our profile
-        request.user.profile.save()
         messages.info(request, f"You have successfully unfollowed: {profile.user.username}")
         return redirect(request.META.get('HTTP_REFERER', 'redirect_if_referer_not_found'))
     else:
@@ -520,8 +621,6 @@ def follow(request, pk):
         profile = Profile.objects.get(user_id=pk)
         # unfollow the user
         request.user.profile.follows.add(profile)
-        # save our profile
-        request.user.profile.save()
         messages.info(request, f"You have successfully followed: {profile.user.username}")
         return redirect(request.META.get('HTTP_REFERER', 'redirect_if_referer_not_found'))
     else:
@@ -530,12 +629,14 @@ def follow(request, pk):
 
 
 def search(request):
-    if request.method == 'POST':
-        # Grab the form field input
-        search = request.POST['search_field']
-        # Search the database
-        searched = Tweet.objects.filter(body__contains=search)
-        return render(request, 'main/search.html', {'search': search, 'searched': searched})
+    # Grab the form field input, the following pages are links with the query and a cursor
+    search = request.POST.get('search_field') if request.method == 'POST' else request.GET.get('search_field')
+    if search:
+        # Search the full-text index
+        searched, next_cursor = search_tweets(search, cursor=request.GET.get('after'))
+        return render(request, 'main/search.html', {'search': search, 'searched': searched,
+                                                    'next_cursor': next_cursor,
+                                                    'liked_ids': Tweet.objects.liked_ids(request.user, searched)})
     else:
         return render(request, 'main/search.html', {})
 
@@ -543,11 +644,17 @@ def search(request):
 def search_user(request):
     if request.method == 'POST':
         search = request.POST['search_field']
-        searched = User.objects.filter(username__contains=search)
+        searched = User.objects.filter(username__contains=search).select_related('profile')
         return render(request, 'main/search_user.html', {'search': search, 'searched': searched})
     else:
         return render(request, 'main/search_user.html', {})
 
 
+def search_user_typeahead(request):
+    """ Users starting with what has been typed so far, for the HTMX typeahead of search_user """
+    users = suggest_users(request.GET.get('search_field', ''))
+    return render(request, 'components/user-typeahead.html', {'users': users})
+
+
 def index(request):
     return render(request, 'main/index.html', {})
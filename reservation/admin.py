@@ -1,3 +1,34 @@
 from django.contrib import admin
 
-# Register your models here.
+from .cache import get_cache_stats
+from .models import CalendarEvent, Event, Events
+
+
+class CalendarCacheStatsMixin:
+    """ Show the hit/miss counters of the rendered-calendar cache above the change list """
+    calendar_kind = None
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['calendar_cache_stats'] = get_cache_stats(self.calendar_kind)
+        return super().changelist_view(request, extra_context=extra_context)
+
+
+@admin.register(CalendarEvent)
+class CalendarEventAdmin(CalendarCacheStatsMixin, admin.ModelAdmin):
+    calendar_kind = 'calendar'
+    list_display = ['id', 'booker_data', 'start_time', 'duration', 'end_time', 'cancel_event']
+    list_filter = ['cancel_event', 'duration']
+    search_fields = ['booker_data']
+
+
+@admin.register(Events)
+class EventsAdmin(CalendarCacheStatsMixin, admin.ModelAdmin):
+    calendar_kind = 'events'
+    list_display = ['title', 'start', 'end']
+
+
+@admin.register(Event)
+class EventAdmin(CalendarCacheStatsMixin, admin.ModelAdmin):
+    calendar_kind = 'show_events'
+    list_display = ['title', 'day', 'start_time', 'end_time', 'location']
@@ -0,0 +1,118 @@
+import base64
+import binascii
+import json
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import CalendarEvent, Event, Events
+from .utils import url_pattern
+
+MAX_LIMIT = 1000
+
+
+def _event_overlaps(start, end):
+    # Event keeps the date and the times apart, the window is split into its first day, the days in
+    # between and its last day so that every part can use the (day, start_time) index
+    if start.date() == end.date():
+        return Q(day=start.date(), end_time__gt=start.time(), start_time__lt=end.time())
+    return (Q(day=start.date(), end_time__gt=start.time())
+            | Q(day__gt=start.date(), day__lt=end.date())
+            | Q(day=end.date(), start_time__lt=end.time()))
+
+
+# calendar kind -> how to find the events of a window and what to return for each of them
+API_CALENDARS = {
+    'calendar': {
+        'model': CalendarEvent,
+        'overlaps': lambda start, end: Q(start_time__lt=end, end_time__gt=start),
+        'ordering': ('start_time', 'id'),
+        'fields': ('id', 'booker_data', 'start_time', 'end_time', 'cancel_event'),
+        'url_name': 'reservation:event_details',
+        'to_json': lambda row: {'id': row['id'], 'title': row['booker_data'], 'start': row['start_time'],
+                                'end': row['end_time'], 'cancelled': row['cancel_event']},
+    },
+    'events': {
+        'model': Events,
+        'overlaps': lambda start, end: Q(start__lt=end, end__gt=start),
+        'ordering': ('start', 'id'),
+        'fields': ('id', 'title', 'start', 'end'),
+        'url_name': 'reservation:edit_events',
+        'to_json': lambda row: row,
+    },
+    'show_events': {
+        'model': Event,
+        'overlaps': _event_overlaps,
+        'ordering': ('day', 'start_time', 'id'),
+        'fields': ('id', 'title', 'day', 'start_time', 'end_time', 'location'),
+        'url_name': 'reservation:edit_show_events',
+        'to_json': lambda row: {'id': row['id'], 'title': row['title'], 'location': row['location'],
+                                'start': datetime.combine(row['day'], row['start_time']),
+                                'end': datetime.combine(row['day'], row['end_time'])},
+    },
+}
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def keyset_filter(fields, values):
+    """ Rows strictly after ``values`` in the ``fields`` ordering: (a > x) or (a = x and b > y) ... """
+    if len(fields) != len(values):
+        raise ValueError('Invalid cursor')
+    condition = Q()
+    for i, field in enumerate(fields):
+        condition |= Q(**dict(zip(fields[:i], values[:i])), **{f'{field}__gt': values[i]})
+    return condition
+
+
+def parse_bound(value):
+    """ A window bound given as an ISO date or datetime """
+    if value:
+        parsed = parse_datetime(value)
+        if parsed is not None:
+            return parsed.replace(tzinfo=None)
+        parsed = parse_date(value)
+        if parsed is not None:
+            return datetime.combine(parsed, time.min)
+    raise ValueError(f'Invalid date: {value!r}')
+
+
+def window_events(kind, start, end, cursor=None, limit=500):
+    """
+    Events of a calendar kind overlapping [start, end), in start order.
+
+    Only the columns that are returned are selected. Returns a list of dicts and the
+    cursor of the next page, None on the last page.
+    """
+    config = API_CALENDARS[kind]
+    events = config['model'].objects.filter(config['overlaps'](start, end))
+    if cursor:
+        events = events.filter(keyset_filter(config['ordering'], decode_cursor(cursor)))
+    rows = list(events.order_by(*config['ordering']).values(*config['fields'])[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][field] for field in config['ordering']])
+
+    pattern = url_pattern(config['url_name'])
+    results = []
+    for row in rows:
+        result = config['to_json'](dict(row))
+        result['url'] = pattern % row['id']
+        results.append(result)
+    return results, next_cursor
@@ -0,0 +1,49 @@
+from datetime import datetime, time, timedelta
+
+from .models import CalendarEvent, CalendarEventDuration
+
+MAX_WINDOW = timedelta(days=31)
+
+
+def busy_intervals(start, end):
+    """ (start_time, end_time) of the active reservations overlapping [start, end), one query in start order """
+    return CalendarEvent.objects.filter(
+        cancel_event=False,
+        # as in CalendarEvent.get_overlapping_event: the start_time range can't reach back further than this
+        start_time__gt=start - timedelta(minutes=max(CalendarEventDuration.values)),
+        start_time__lt=end,
+        end_time__gt=start,
+    ).order_by('start_time').values_list('start_time', 'end_time')
+
+
+def free_intervals(start, end, busy):
+    """ Sweep the start-sorted busy intervals and yield the gaps between them inside [start, end) """
+    cursor = start
+    for busy_start, busy_end in busy:
+        if busy_start > cursor:
+            yield cursor, min(busy_start, end)
+        cursor = max(cursor, busy_end)
+        if cursor >= end:
+            return
+    if cursor < end:
+        yield cursor, end
+
+
+def free_slots(start, end, duration, step=30):
+    """
+    Every free (start, end) slot of ``duration`` minutes in [start, end).
+
+    Slots start on a ``step`` minutes grid counted from midnight, and never overlap an
+    active reservation. Runs in O(reservations + slots) after one range query.
+    """
+    length = timedelta(minutes=duration)
+    step = timedelta(minutes=step)
+    slots = []
+    for gap_start, gap_end in free_intervals(start, end, busy_intervals(start, end)):
+        # round the beginning of the gap up to the grid
+        midnight = datetime.combine(gap_start.date(), time.min)
+        slot = midnight + -(-(gap_start - midnight) // step) * step
+        while slot + length <= gap_end:
+            slots.append((slot, slot + length))
+            slot += step
+    return slots
@@ -0,0 +1,163 @@
+import csv
+import json
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import timedelta
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+
+from .cache import invalidate_months, months_between
+from .locks import booking_lock
+from .models import CalendarEvent, CalendarEventDuration, CalendarWatermark, ReservationStats
+from .search import index_events
+
+IMPORT_FIELDS = ('booker_data', 'start_time', 'duration', 'notes', 'cancel_event')
+EXPORT_FIELDS = ('id', 'booker_data', 'start_time', 'duration', 'end_time', 'notes', 'cancel_event')
+
+
+def read_rows(stream, file_format):
+    """ Yield (line number, dict) pairs from a csv or jsonl stream, one line at a time """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_num, line in enumerate(stream, start=1):
+            if line.strip():
+                yield line_num, line  # decoded in build_event, so a broken line only skips that row
+    else:
+        raise ValueError(f'Unknown format: {file_format}')
+
+
+def build_event(row):
+    """ Validate a single row and return an unsaved CalendarEvent with its end_time set """
+    if isinstance(row, str):
+        row = json.loads(row)
+    data = {field: row[field] for field in IMPORT_FIELDS if row.get(field) not in (None, '')}
+    if 'start_time' not in data:
+        raise ValidationError({'start_time': ['This field is required.']})
+    event = CalendarEvent(**data)
+    event.clean_fields(exclude=['end_time'])
+    event.end_time = event.start_time + timedelta(minutes=event.duration)
+    return event
+
+
+def find_overlaps(events):
+    """
+    Split a batch into (accepted, rejected) events.
+
+    Stored reservations around the batch are loaded with a single query, then the
+    batch is swept in start_time order: an event is rejected if it overlaps a stored
+    reservation or an event accepted earlier in the same batch.
+    """
+    active = sorted((event for event in events if not event.cancel_event), key=lambda event: event.start_time)
+    accepted = [event for event in events if event.cancel_event]
+    rejected = []
+    if not active:
+        return accepted, rejected
+
+    longest = timedelta(minutes=max(CalendarEventDuration.values))
+    stored = list(CalendarEvent.objects.filter(
+        cancel_event=False,
+        start_time__gt=active[0].start_time - longest,
+        start_time__lt=max(event.end_time for event in active),
+    ).order_by('start_time').values_list('start_time', 'end_time', 'id'))
+    stored_starts = [start for start, end, pk in stored]
+
+    last_end = None  # accepted events don't overlap, so the latest one also ends last
+    for event in active:
+        lo = bisect_right(stored_starts, event.start_time - longest)
+        hi = bisect_left(stored_starts, event.end_time)
+        conflict = next((pk for start, end, pk in stored[lo:hi] if end > event.start_time), None)
+        if conflict is not None:
+            rejected.append((event, f'overlaps reservation {conflict}'))
+        elif last_end is not None and last_end > event.start_time:
+            rejected.append((event, 'overlaps an earlier row of the import'))
+        else:
+            accepted.append(event)
+            last_end = event.end_time
+    return accepted, rejected
+
+
+def import_reservations(rows, batch_size=1000):
+    """
+    Import (line number, dict) rows in chunks of ``batch_size``.
+
+    Each chunk is validated, checked for overlaps and written with one bulk_create under
+    the booking lock. Returns the number of created reservations and a list of
+    (line number, error) pairs for the skipped rows.
+    """
+    created = 0
+    errors = []
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+
+        events = []
+        for line_num, row in chunk:
+            try:
+                event = build_event(row)
+            except (ValidationError, AttributeError, TypeError, ValueError) as error:
+                errors.append((line_num, _error_message(error)))
+            else:
+                event.line_num = line_num
+                events.append(event)
+
+        with booking_lock(CalendarEvent):
+            accepted, rejected = find_overlaps(events)
+            CalendarEvent.objects.bulk_create(accepted)
+            _update_stats(accepted)
+            index_events(event for event in accepted if event.id is not None)
+        created += len(accepted)
+        errors.extend((event.line_num, message) for event, message in rejected)
+
+        # bulk_create doesn't send post_save, so the statistics and the search index are updated
+        # above and the cached months are dropped here
+        months = set()
+        for event in accepted:
+            months |= months_between(event.start_time, event.end_time)
+        invalidate_months('calendar', months)
+        if accepted:
+            CalendarWatermark.objects.touch('calendar')
+
+    errors.sort()
+    return created, errors
+
+
+def _update_stats(events):
+    """ Add the imported reservations to the statistics, one update per counter """
+    counts = Counter((event.start_time.date(), event.end_time.date(), event.duration)
+                     for event in events if not event.cancel_event)
+    for (day, end_day, duration), count in counts.items():
+        ReservationStats.objects.add(day, end_day, duration, count)
+
+
+def _error_message(error):
+    if isinstance(error, ValidationError) and hasattr(error, 'message_dict'):
+        return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items())
+    return str(error)
+
+
+class Echo:
+    """ A file-like object that returns what is written, for csv.writer """
+
+    def write(self, value):
+        return value
+
+
+def export_rows(file_format, chunk_size=2000):
+    """ Yield every reservation as csv or jsonl lines without loading the table into memory """
+    rows = CalendarEvent.objects.order_by('start_time', 'id').values_list(*EXPORT_FIELDS).iterator(chunk_size)
+    if file_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+    elif file_format == 'jsonl':
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row)), default=str) + '\n'
+    else:
+        raise ValueError(f'Unknown format: {file_format}')
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import translation
+
+CALENDAR_CACHE_TIMEOUT = getattr(settings, 'RESERVATION_CALENDAR_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# calendar kinds: 'show_events' (Event), 'events' (Events), 'calendar' (CalendarEvent)
+
+
+def calendar_cache_key(kind, year, month, language=None):
+    language = language or translation.get_language() or settings.LANGUAGE_CODE
+    return f'reservation:calendar:{kind}:{year}:{month}:{language}'
+
+
+def _stats_key(kind, counter):
+    return f'reservation:calendar-stats:{kind}:{counter}'
+
+
+def _count(kind, counter):
+    key = _stats_key(kind, counter)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def get_cached_month(kind, year, month, render):
+    """ Return the rendered month html from the cache, calling render() on a miss """
+    key = calendar_cache_key(kind, year, month)
+    html = cache.get(key)
+    if html is None:
+        _count(kind, 'misses')
+        html = render()
+        cache.set(key, html, CALENDAR_CACHE_TIMEOUT)
+    else:
+        _count(kind, 'hits')
+    return html
+
+
+def months_between(start, end=None):
+    """ Every (year, month) pair from start to end, inclusive """
+    end = end or start
+    if end < start:
+        start, end = end, start
+    months = set()
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.add((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def invalidate_months(kind, months):
+    """ Drop the cached html of the given months, in every language """
+    languages = {code for code, name in settings.LANGUAGES} | {settings.LANGUAGE_CODE}
+    keys = [calendar_cache_key(kind, year, month, language)
+            for year, month in months for language in languages]
+    if keys:
+        cache.delete_many(keys)
+
+
+def get_cache_stats(kind):
+    stats = cache.get_many([_stats_key(kind, 'hits'), _stats_key(kind, 'misses')])
+    return {
+        'hits': stats.get(_stats_key(kind, 'hits'), 0),
+        'misses': stats.get(_stats_key(kind, 'misses'), 0),
+    }
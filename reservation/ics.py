@@ -0,0 +1,85 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.utils import timezone
+
+from .models import CalendarEvent, Event, Events
+
+CRLF = '\r\n'
+
+
+def escape_text(value):
+    """ Escape a TEXT value (RFC 5545, 3.3.11) """
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold(line):
+    """ Fold a content line to 75 octets, continuation lines start with a space (RFC 5545, 3.1) """
+    parts = []
+    current, size, limit = [], 0, 75
+    for char in line:
+        char_size = len(char.encode())
+        if size + char_size > limit:
+            parts.append(''.join(current))
+            current, size, limit = [], 0, 74
+        current.append(char)
+        size += char_size
+    parts.append(''.join(current))
+    return (CRLF + ' ').join(parts) + CRLF
+
+
+def format_datetime(value):
+    # floating local time, USE_TZ is off and the stored datetimes are naive
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def calendar_events():
+    rows = CalendarEvent.objects.order_by('start_time', 'id').values_list(
+        'id', 'booker_data', 'start_time', 'end_time', 'notes', 'cancel_event').iterator(2000)
+    for pk, booker_data, start, end, notes, cancelled in rows:
+        yield pk, start, end, f'Reservation {pk}: {booker_data}', notes, 'CANCELLED' if cancelled else 'CONFIRMED'
+
+
+def events_events():
+    rows = Events.objects.order_by('start', 'id').values_list('id', 'title', 'start', 'end', 'description')
+    for pk, title, start, end, description in rows.iterator(2000):
+        yield pk, start, end, title, description, 'CONFIRMED'
+
+
+def show_events_events():
+    rows = Event.objects.order_by('day', 'start_time', 'id').values_list(
+        'id', 'title', 'day', 'start_time', 'end_time', 'notes')
+    for pk, title, day, start_time, end_time, notes in rows.iterator(2000):
+        yield pk, datetime.combine(day, start_time), datetime.combine(day, end_time), title, notes, 'CONFIRMED'
+
+
+# calendar kind -> (calendar name, events as (id, start, end, summary, description, status))
+FEEDS = {
+    'calendar': ('Reservations', calendar_events),
+    'events': ('Events', events_events),
+    'show_events': ('Scheduling', show_events_events),
+}
+
+
+def feed_lines(kind, domain, updated_at):
+    """ Yield the ICS feed of a calendar kind line by line, rows are read with a server side iterator """
+    name, get_events = FEEDS[kind]
+    stamp = timezone.make_aware(updated_at).astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    yield fold('BEGIN:VCALENDAR')
+    yield fold('VERSION:2.0')
+    yield fold(f'PRODID:-//{domain}//{kind}//EN')
+    yield fold(f'X-WR-CALNAME:{escape_text(name)}')
+    for pk, start, end, summary, description, status in get_events():
+        yield ''.join((
+            fold('BEGIN:VEVENT'),
+            fold(f'UID:{kind}-{pk}@{domain}'),
+            fold(f'DTSTAMP:{stamp}'),
+            fold(f'DTSTART:{format_datetime(start)}'),
+            fold(f'DTEND:{format_datetime(end)}'),
+            fold(f'SUMMARY:{escape_text(summary)}'),
+            fold(f'DESCRIPTION:{escape_text(description)}') if description else '',
+            fold(f'STATUS:{status}'),
+            fold('END:VEVENT'),
+        ))
+    yield fold('END:VCALENDAR')
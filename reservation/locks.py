@@ -0,0 +1,33 @@
+import threading
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import connections, router, transaction
+
+# one lock per model, shared by the threads of this process
+_process_locks = defaultdict(threading.Lock)
+
+
+@contextmanager
+def booking_lock(model, using=None):
+    """
+    Serialize bookings of ``model`` so the overlap check and the write happen as one step.
+
+    Threads of the same process queue on a process-local lock. Across processes the
+    transaction takes the database write lock before the overlap check runs: SQLite gets
+    a no-op UPDATE (its RESERVED lock is otherwise only taken at the INSERT, after every
+    concurrent booking already passed the check) and PostgreSQL a transaction-level
+    advisory lock. Other backends rely on ``select_for_update()`` of the overlap query.
+    """
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+
+    with _process_locks[model._meta.label], transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                table = connection.ops.quote_name(model._meta.db_table)
+                cursor.execute(f'UPDATE {table} SET id = id WHERE 0')
+            elif connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [zlib.crc32(model._meta.label.encode())])
+        yield
@@ -0,0 +1,51 @@
+import random
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from core.bench import median_ms, rolled_back
+from reservation.availability import free_slots
+from reservation.models import CalendarEvent
+
+DURATIONS = [30, 60, 90, 120]
+
+
+class Command(BaseCommand):
+    help = 'Time free_slots() over a one-month window of a table of bookings (the target is under 50 ms at 10k)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        for rows in options['rows']:
+            with rolled_back():
+                # a month starting at midnight in the middle of the bookings
+                window_start = datetime.combine(self.populate(rows).date(), datetime.min.time())
+                for duration in (30, 120):
+                    self.report(rows, window_start, duration, options['repeat'])
+
+    def populate(self, rows):
+        """ ``rows`` bookings from 2030-01-01 on with gaps between them, returns the start of the middle one """
+        self.stdout.write(f'Creating {rows} bookings...')
+        slot = datetime(2030, 1, 1)
+        batch = []
+        for i in range(rows):
+            if i == rows // 2:
+                middle = slot
+            duration = random.choice(DURATIONS)
+            slot += timedelta(minutes=random.choice([0, 0, 30, 60]))
+            batch.append(CalendarEvent(booker_data=f'Booker {i}', duration=duration, cancel_event=i % 10 == 0,
+                                       start_time=slot, end_time=slot + timedelta(minutes=duration)))
+            slot += timedelta(minutes=duration)
+            if len(batch) == 5000:
+                CalendarEvent.objects.bulk_create(batch)
+                batch = []
+        CalendarEvent.objects.bulk_create(batch)
+        return middle
+
+    def report(self, rows, window_start, duration, repeat):
+        window_end = window_start + timedelta(days=31)
+        slots = free_slots(window_start, window_end, duration)
+        elapsed = median_ms(lambda: free_slots(window_start, window_end, duration), repeat)
+        self.stdout.write(f'{rows:>9} bookings  {duration:>3} min slots  {len(slots):>5} free  {elapsed:9.2f} ms')
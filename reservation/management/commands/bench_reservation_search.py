@@ -0,0 +1,55 @@
+import random
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bench import median_ms, rolled_back
+from reservation.models import CalendarEvent
+from reservation.search import fts_available, rebuild_index, search_events
+
+FIRST_NAMES = ['Anna', 'Piotr', 'Marco', 'Giulia', 'Claire', 'Louis', 'John', 'Maria', 'Tomasz', 'Elena']
+LAST_NAMES = ['Kowalski', 'Rossi', 'Dubois', 'Smith', 'Nowak', 'Bianchi', 'Martin', 'Brown', 'Wojcik', 'Moreau']
+
+
+class Command(BaseCommand):
+    help = 'Compare the FTS5 reservation search with the booker_data__contains scan it replaced'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError('The FTS5 index is not available on this database.')
+
+        for rows in options['rows']:
+            with rolled_back():
+                self.populate(rows)
+                # rare term (one reservation) and a common one (a tenth of the table)
+                for term in (f'Unique booker {rows // 2}', 'Kowalski'):
+                    self.report(rows, term, options['repeat'])
+
+    def populate(self, rows):
+        self.stdout.write(f'Creating {rows} reservations...')
+        start = datetime(2030, 1, 1)
+        batch = []
+        for i in range(rows):
+            booker = f'{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}'
+            if i == rows // 2:
+                booker = f'Unique booker {i}'
+            batch.append(CalendarEvent(booker_data=booker, notes=f'Booking number {i}', duration=60,
+                                       start_time=start + timedelta(hours=i), end_time=start + timedelta(hours=i + 1)))
+            if len(batch) == 5000:
+                CalendarEvent.objects.bulk_create(batch)
+                batch = []
+        CalendarEvent.objects.bulk_create(batch)
+        rebuild_index()
+
+    def report(self, rows, term, repeat):
+        timings = {
+            'contains, all rows': lambda: list(CalendarEvent.objects.filter(booker_data__contains=term)),
+            'contains, first 25': lambda: list(CalendarEvent.objects.filter(booker_data__contains=term)[:25]),
+            'fts5, first page': lambda: search_events(term),
+        }
+        for name, run in timings.items():
+            self.stdout.write(f'{rows:>9} rows  {term!r:<24} {name:<20} {median_ms(run, repeat):9.2f} ms')
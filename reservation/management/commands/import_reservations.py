@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reservation.bulk import import_reservations, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Import reservations from a csv or jsonl file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='csv (with a header row) or jsonl file')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='input format, guessed from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError(f'Cannot guess the format of {path}, use --format.')
+        if not path.exists():
+            raise CommandError(f'{path} does not exist.')
+
+        with path.open(newline='', encoding='utf-8') as stream:
+            created, errors = import_reservations(read_rows(stream, file_format), options['batch_size'])
+
+        for line_num, message in errors:
+            self.stderr.write(f'line {line_num}: {message}')
+        self.stdout.write(self.style.SUCCESS(f'Imported {created} reservations, skipped {len(errors)}.'))
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='calendarevent',
+            index=models.Index(fields=['start_time'], name='reservation_start_t_b1d4a1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['day', 'start_time'], name='reservation_day_52102b_idx'),
+        ),
+    ]
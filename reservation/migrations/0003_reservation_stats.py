@@ -0,0 +1,45 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:14
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def count_reservations(apps, schema_editor):
+    CalendarEvent = apps.get_model('reservation', 'CalendarEvent')
+    ReservationStats = apps.get_model('reservation', 'ReservationStats')
+    rows = CalendarEvent.objects.filter(cancel_event=False).values(
+        'duration', day=TruncDate('start_time'), end_day=TruncDate('end_time'),
+    ).annotate(total=Count('id')).order_by()
+    ReservationStats.objects.bulk_create(ReservationStats(day=row['day'], end_day=row['end_day'],
+                                                          duration=row['duration'], count=row['total'])
+                                         for row in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0002_overlap_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('end_day', models.DateField()),
+                ('duration', models.PositiveSmallIntegerField(choices=[(30, '30 minutes'), (60, '1 hour'), (90, '1.5 hours'), (120, '2 hours')])),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Reservation statistics',
+                'verbose_name_plural': 'Reservation statistics',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reservationstats',
+            constraint=models.UniqueConstraint(fields=('day', 'end_day', 'duration'), name='unique_reservation_stats'),
+        ),
+        migrations.RunPython(count_reservations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0003_reservation_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='calendarevent',
+            index=models.Index(condition=models.Q(('cancel_event', False)), fields=['end_time'], name='active_reservation_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='events',
+            index=models.Index(fields=['start'], name='reservation_start_d3903f_idx'),
+        ),
+    ]
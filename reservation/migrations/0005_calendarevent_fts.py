@@ -0,0 +1,32 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE reservation_calendarevent_fts "
+                           "USING fts5(booker_data, notes, tokenize='trigram')")
+        except OperationalError:  # SQLite built without FTS5 (or older than 3.34), search falls back to icontains
+            return
+        cursor.execute("INSERT INTO reservation_calendarevent_fts(rowid, booker_data, notes) "
+                       "SELECT id, booker_data, COALESCE(notes, '') FROM reservation_calendarevent")
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS reservation_calendarevent_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0004_range_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
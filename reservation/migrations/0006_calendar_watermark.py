@@ -0,0 +1,31 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:18
+
+import datetime
+
+from django.db import migrations, models
+
+
+def create_watermarks(apps, schema_editor):
+    CalendarWatermark = apps.get_model('reservation', 'CalendarWatermark')
+    now = datetime.datetime.now()
+    CalendarWatermark.objects.bulk_create(CalendarWatermark(kind=kind, updated_at=now)
+                                          for kind in ('calendar', 'events', 'show_events'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0005_calendarevent_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, unique=True)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(create_watermarks, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,14 @@
-from datetime import datetime, timedelta, time
+from datetime import date, datetime, timedelta, time
 
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
 from django.urls import reverse
 from django.utils import timezone
 
+from .locks import booking_lock
+
 
 class Events(models.Model):
     title = models.CharField(max_length=200)
@@ -24,6 +28,9 @@ class Events(models.Model):
         verbose_name = 'Event'
         verbose_name_plural = 'Events'
         ordering = ('start',)
+        indexes = [
+            models.Index(fields=['start']),
+        ]
 
     def clean(self):
         start_date = self.start
@@ -57,17 +64,9 @@ class Event(models.Model):
         verbose_name = 'Event'
         verbose_name_plural = 'Scheduling'
         ordering = ('-day', 'start_time')
-
-    def check_overlap(self, fixed_start, fixed_end, new_start, new_end):  # overlapping events
-        overlap = False
-        if new_start == fixed_end or new_end == fixed_start:  # edge case
-            overlap = False
-        elif (fixed_start <= new_start <= fixed_end) or (fixed_start <= new_end <= fixed_end):  # inner limits
-            overlap = True
-        elif new_start <= fixed_start and new_end >= fixed_end:  # outer limits
-            overlap = True
-
-        return overlap
+        indexes = [
+            models.Index(fields=['day', 'start_time']),
+        ]
 
     def get_absolute_url(self):
         url = reverse('admin:%s_%s_change' % (self._meta.app_label, self._meta.model_name), args=[self.id])
@@ -84,21 +83,35 @@ class Event(models.Model):
                 "%Y/%m/%d %H:%M:%S"):
             raise ValidationError("You can't choose a date in the past.", code="invalid")
 
-        events = Event.objects.filter(day=self.day).exclude(id=self.id)
-        # events = Event.objects.filter(day=self.day)
-
-        if events.exists():
-            for event in events:
-                # if event.id != self.id:
-                if self.check_overlap(event.start_time, event.end_time, self.start_time, self.end_time):
-                    raise ValidationError(f"""There is an overlap event with this date:\
-                                          {event.day.strftime("%d/%m/%Y")},\
-                                          {event.start_time.strftime("%H:%M")} - {event.end_time.strftime("%H:%M")}.""",
-                                          code='invalid')
+        overlap = self.get_overlapping_event()
+        if overlap is not None:
+            raise self.overlap_error(overlap)
         super(Event, self).clean()
 
+    def get_overlapping_event(self, lock=False):
+        """ First event of the same day overlapping this one, found with one indexed LIMIT 1 query """
+        events = Event.objects.filter(
+            day=self.day,
+            start_time__lt=self.end_time,
+            end_time__gt=self.start_time,
+        ).exclude(id=self.id).order_by('start_time')
+        if lock:
+            events = events.select_for_update()
+        return events.first()
+
+    def overlap_error(self, event):
+        return ValidationError(f"""There is an overlap event with this date:\
+                               {event.day.strftime("%d/%m/%Y")},\
+                               {event.start_time.strftime("%H:%M")} - {event.end_time.strftime("%H:%M")}.""",
+                               code='invalid')
+
     def save(self, *args, **kwargs):
-        super(Event, self).save(*args, **kwargs)
+        # check again under the booking lock, concurrent requests may have passed clean() together
+        with booking_lock(Event, using=kwargs.get('using')):
+            overlap = self.get_overlapping_event(lock=True)
+            if overlap is not None:
+                raise self.overlap_error(overlap)
+            super(Event, self).save(*args, **kwargs)
 
 
 class EventManager(models.Manager):
@@ -109,9 +122,13 @@ class EventManager(models.Manager):
         return events
 
     def get_running_events(self):
+        midnight = datetime.combine(date.today(), time.min)
+        # nothing ending today started more than the longest duration before midnight: a start_time
+        # range the index seeks, already in start_time order, instead of a walk over every reservation
         running_events = CalendarEvent.objects.filter(
             cancel_event=False,
-            end_time__gte =datetime.now().date(),
+            start_time__gt=midnight - timedelta(minutes=max(CalendarEventDuration.values)),
+            end_time__gte=midnight,
         ).order_by('start_time')
         return running_events
 
@@ -144,6 +161,14 @@ class CalendarEvent(models.Model):
 
     objects = EventManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_time']),
+            # Django renders cancel_event=False as "NOT cancel_event", which SQLite can't seek a
+            # (cancel_event, end_time) index with, but it does match this partial index
+            models.Index(fields=['end_time'], condition=Q(cancel_event=False), name='active_reservation_end_idx'),
+        ]
+
     # def validate_dates(self, data):
     #     if data['start_time'] >= data['end_time']:
     #         raise ValidationError("Finish must occur after start.")
@@ -154,10 +179,38 @@ class CalendarEvent(models.Model):
         if self.start_time <= datetime.now():
             raise ValidationError("Start time cannot be in the past.")
 
+        overlap = self.get_overlapping_event()
+        if overlap is not None:
+            raise self.overlap_error(overlap)
+
+    def get_overlapping_event(self, lock=False):
+        """ First active reservation overlapping this one, found with one indexed LIMIT 1 query """
+        if self.cancel_event:
+            return None
+        end_time = self.start_time + timedelta(minutes=self.duration)
+        events = CalendarEvent.objects.filter(
+            cancel_event=False,
+            # no reservation lasts longer than the longest duration, which bounds the start_time index range
+            start_time__gt=self.start_time - timedelta(minutes=max(CalendarEventDuration.values)),
+            start_time__lt=end_time,
+            end_time__gt=self.start_time,
+        ).exclude(id=self.id).order_by('start_time')
+        if lock:
+            events = events.select_for_update()
+        return events.first()
+
+    def overlap_error(self, event):
+        return ValidationError(f"This time overlaps reservation {event.id}: "
+                               f"{event.start_time:%d/%m/%Y %H:%M} - {event.end_time:%H:%M}.", code='invalid')
+
     def save(self, *args, **kwargs):
-        """ On save, update end_time """
+        """ On save, update end_time and make sure no other reservation took the slot meanwhile """
         self.end_time = self.start_time + timedelta(minutes=self.duration)
-        return super(CalendarEvent, self).save(*args, **kwargs)
+        with booking_lock(CalendarEvent, using=kwargs.get('using')):
+            overlap = self.get_overlapping_event(lock=True)
+            if overlap is not None:
+                raise self.overlap_error(overlap)
+            return super(CalendarEvent, self).save(*args, **kwargs)
 
     def __str__(self):
         return f'Reservation {self.id}: {self.booker_data}'
@@ -168,4 +221,95 @@ class CalendarEvent(models.Model):
     @property
     def get_html_url(self):
         url = reverse('reservation:event_details', args=(self.id,))
-        return f'<a href="{url}"> {self.booker_data} </a>'
\ No newline at end of file
+        return f'<a href="{url}"> {self.booker_data} </a>'
+
+class ReservationStatsManager(models.Manager):
+    """ Reservation statistics manager """
+
+    def add(self, day, end_day, duration, delta):
+        """ Atomically add delta to the counter of (day, end_day, duration) """
+        if self.filter(day=day, end_day=end_day, duration=duration).update(count=F('count') + delta):
+            return
+        try:
+            with transaction.atomic():
+                self.create(day=day, end_day=end_day, duration=duration, count=delta)
+        except IntegrityError:  # created concurrently
+            self.filter(day=day, end_day=end_day, duration=duration).update(count=F('count') + delta)
+
+    def add_event(self, event, delta=1):
+        if not event.cancel_event:
+            self.add(event.start_time.date(), event.end_time.date(), event.duration, delta)
+
+    def rebuild(self):
+        """ Recount every active reservation with a single GROUP BY query """
+        rows = CalendarEvent.objects.filter(cancel_event=False).values(
+            'duration', day=TruncDate('start_time'), end_day=TruncDate('end_time'),
+        ).annotate(total=Count('id')).order_by()
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(ReservationStats(day=row['day'], end_day=row['end_day'],
+                                              duration=row['duration'], count=row['total']) for row in rows)
+
+    def summary(self, today=None):
+        """ Totals and per-duration counts, with one conditional aggregation over the counters """
+        today = today or date.today()
+        aggregates = {
+            'total_events': Sum('count'),
+            'running_events': Sum('count', filter=Q(end_day__gte=today)),
+        }
+        for value, label in CalendarEventDuration.choices:
+            aggregates[f'duration_{value}'] = Sum('count', filter=Q(duration=value))
+        stats = {key: value or 0 for key, value in self.aggregate(**aggregates).items()}
+
+        stats['past_events'] = stats['total_events'] - stats['running_events']
+        stats['per_duration'] = [(label, stats.pop(f'duration_{value}'))
+                                 for value, label in CalendarEventDuration.choices]
+        return stats
+
+    def per_day(self, start, end):
+        """ Active reservations per start day in [start, end) """
+        return self.filter(day__gte=start, day__lt=end).values('day').annotate(
+            total=Sum('count')).filter(total__gt=0).order_by('day')
+
+
+class ReservationStats(models.Model):
+    """ Number of active reservations per start day, end day and duration, kept up to date by signals """
+    day = models.DateField()
+    end_day = models.DateField()
+    duration = models.PositiveSmallIntegerField(choices=CalendarEventDuration.choices)
+    count = models.IntegerField(default=0)
+
+    objects = ReservationStatsManager()
+
+    class Meta:
+        verbose_name = 'Reservation statistics'
+        verbose_name_plural = 'Reservation statistics'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'end_day', 'duration'], name='unique_reservation_stats'),
+        ]
+
+    def __str__(self):
+        return f'{self.day}: {self.count} x {self.get_duration_display()}'
+
+
+class CalendarWatermarkManager(models.Manager):
+
+    def touch(self, kind):
+        """ Record that the events of a calendar kind changed just now """
+        now = datetime.now()
+        if not self.filter(kind=kind).update(updated_at=now):
+            self.update_or_create(kind=kind, defaults={'updated_at': now})
+
+    def get_updated_at(self, kind):
+        return self.filter(kind=kind).values_list('updated_at', flat=True).first()
+
+
+class CalendarWatermark(models.Model):
+    """ Last change of a calendar kind ('calendar', 'events' or 'show_events'), used by the ICS feeds """
+    kind = models.CharField(max_length=20, unique=True)
+    updated_at = models.DateTimeField()
+
+    objects = CalendarWatermarkManager()
+
+    def __str__(self):
+        return f'{self.kind}: {self.updated_at}'
@@ -0,0 +1,104 @@
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+
+from core.fulltext import fts5_available
+
+from .models import CalendarEvent
+
+FTS_TABLE = 'reservation_calendarevent_fts'
+PAGE_SIZE = 25
+# the trigram tokenizer can't match anything shorter
+MIN_FTS_QUERY = 3
+
+
+def fts_available():
+    """ The FTS5 shadow table only exists on SQLite builds with FTS5, see migration 0005 """
+    return fts5_available(FTS_TABLE)
+
+
+def index_events(events):
+    """ Add or refresh reservations in the full-text index """
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT OR REPLACE INTO {FTS_TABLE}(rowid, booker_data, notes) VALUES (%s, %s, %s)',
+                           [(event.id, event.booker_data, event.notes or '') for event in events])
+
+
+def unindex_events(event_ids):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(event_id,) for event_id in event_ids])
+
+
+def rebuild_index():
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'INSERT INTO {FTS_TABLE}(rowid, booker_data, notes) '
+                       f'SELECT id, booker_data, COALESCE(notes, \'\') FROM {CalendarEvent._meta.db_table}')
+
+
+def search_events(query, cursor=None, limit=PAGE_SIZE):
+    """
+    Reservations whose booker data or notes contain ``query``, best matches first.
+
+    Returns a page of events and the cursor of the next page (None on the last page).
+    Cursors are opaque strings: "<bm25 score>:<id>" for the FTS5 index, "<start_time>:<id>"
+    for the icontains fallback used on other backends and for queries too short for trigrams.
+    """
+    query = query.strip()
+    if not query:
+        return [], None
+    try:
+        if fts_available() and len(query) >= MIN_FTS_QUERY:
+            return _search_fts(query, cursor, limit)
+        return _search_fallback(query, cursor, limit)
+    except (ValueError, ValidationError):  # a cursor that wasn't made by us
+        return [], None
+
+
+def _search_fts(query, cursor, limit):
+    # a quoted phrase on a trigram index is a case-insensitive substring match, like icontains
+    match = '"%s"' % query.replace('"', '""')
+    sql = f'SELECT rowid, bm25({FTS_TABLE}) AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+    params = [match]
+    if cursor:
+        score, last_id = _split_cursor(cursor)
+        sql += f' AND (bm25({FTS_TABLE}) > %s OR (bm25({FTS_TABLE}) = %s AND rowid > %s))'
+        params += [float(score), float(score), int(last_id)]
+    sql += ' ORDER BY score, rowid LIMIT %s'
+    params.append(limit + 1)
+
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f'{rows[-1][1]!r}:{rows[-1][0]}'
+    events = CalendarEvent.objects.in_bulk([event_id for event_id, score in rows])
+    return [events[event_id] for event_id, score in rows if event_id in events], next_cursor
+
+
+def _search_fallback(query, cursor, limit):
+    events = CalendarEvent.objects.filter(Q(booker_data__icontains=query) | Q(notes__icontains=query))
+    if cursor:
+        start_time, last_id = _split_cursor(cursor)
+        events = events.filter(Q(start_time__lt=start_time) | Q(start_time=start_time, id__lt=int(last_id)))
+    events = list(events.order_by('-start_time', '-id')[:limit + 1])
+
+    next_cursor = None
+    if len(events) > limit:
+        events = events[:limit]
+        next_cursor = f'{events[-1].start_time.isoformat()}:{events[-1].id}'
+    return events, next_cursor
+
+
+def _split_cursor(cursor):
+    value, _, last_id = cursor.rpartition(':')
+    return value, last_id
@@ -0,0 +1,67 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .cache import invalidate_months, months_between
+from .models import CalendarEvent, CalendarWatermark, Event, Events, ReservationStats
+from .search import index_events, unindex_events
+
+# model -> (calendar kind, months covered by an instance)
+CALENDAR_MODELS = {
+    Event: ('show_events', lambda event: months_between(event.day)),
+    Events: ('events', lambda event: months_between(event.start, event.end)),
+    CalendarEvent: ('calendar', lambda event: months_between(event.start_time, event.end_time)),
+}
+
+
+def remember_stored_row(sender, instance, raw=False, **kwargs):
+    """ Keep the row as it is stored before it gets overwritten, for the post_save receivers """
+    instance._stored_row = None
+    if not raw and instance.pk is not None:
+        instance._stored_row = sender.objects.filter(pk=instance.pk).first()
+
+
+def invalidate_calendar(sender, instance, **kwargs):
+    kind, get_months = CALENDAR_MODELS[sender]
+    months = get_months(instance)
+    stored_row = getattr(instance, '_stored_row', None)
+    if stored_row is not None:
+        months |= get_months(stored_row)
+    invalidate_months(kind, months)
+    CalendarWatermark.objects.touch(kind)
+
+
+def _stats_key(event):
+    return event.cancel_event, event.start_time.date(), event.end_time.date(), event.duration
+
+
+def update_stats_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    stored_row = getattr(instance, '_stored_row', None)
+    if stored_row is not None:
+        if _stats_key(stored_row) == _stats_key(instance):
+            return
+        ReservationStats.objects.add_event(stored_row, -1)
+    ReservationStats.objects.add_event(instance, 1)
+
+
+def update_stats_on_delete(sender, instance, **kwargs):
+    ReservationStats.objects.add_event(instance, -1)
+
+
+def update_search_index_on_save(sender, instance, **kwargs):
+    index_events([instance])
+
+
+def update_search_index_on_delete(sender, instance, **kwargs):
+    unindex_events([instance.id])
+
+
+for model in CALENDAR_MODELS:
+    pre_save.connect(remember_stored_row, sender=model)
+    post_save.connect(invalidate_calendar, sender=model)
+    post_delete.connect(invalidate_calendar, sender=model)
+
+post_save.connect(update_stats_on_save, sender=CalendarEvent)
+post_delete.connect(update_stats_on_delete, sender=CalendarEvent)
+post_save.connect(update_search_index_on_save, sender=CalendarEvent)
+post_delete.connect(update_search_index_on_delete, sender=CalendarEvent)
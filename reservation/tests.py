@@ -1,3 +1,474 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+from datetime import date, datetime, time, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+
+from core.fulltext import reset_tables
+
+from .availability import busy_intervals, free_slots
+from .cache import calendar_cache_key, get_cache_stats, get_cached_month
+from .ics import fold
+from .models import CalendarEvent, Event, Events, ReservationStats
+from .search import fts_available, search_events
+from .utils import Calendar, EventCalendar, NewCalendar
+
+
+class MonthCalendarQueriesTest(TestCase):
+    """ Month calendars render with a constant number of queries """
+
+    @classmethod
+    def setUpTestData(cls):
+        for day in range(1, 29):
+            Event.objects.create(title=f'Event {day}', day=date(2030, 3, day),
+                                 start_time=time(10, 0), end_time=time(11, 0))
+            Events.objects.create(title=f'Events {day}', description='-',
+                                  start=datetime(2030, 3, day, 10, 0), end=datetime(2030, 3, day, 12, 0))
+            CalendarEvent.objects.create(booker_data=f'Booker {day}', start_time=datetime(2030, 3, day, 9, 0))
+        # other months must not leak into the rendered one
+        Event.objects.create(title='Next year', day=date(2031, 3, 5), start_time=time(10, 0), end_time=time(11, 0))
+        CalendarEvent.objects.create(booker_data='April', start_time=datetime(2030, 4, 1, 9, 0))
+
+    def test_event_calendar(self):
+        with self.assertNumQueries(1):
+            html = EventCalendar().formatmonth(2030, 3)
+        self.assertEqual(html.count('<a href='), 28)
+        self.assertIn(reverse('reservation:edit_show_events', args=(Event.objects.get(title='Event 7').id,)), html)
+        self.assertNotIn('Next year', html)
+
+    def test_calendar(self):
+        with self.assertNumQueries(1):
+            html = Calendar(2030, 3).formatmonth()
+        self.assertEqual(html.count('<a href='), 28)
+        self.assertIn(reverse('reservation:edit_events', args=(Events.objects.get(title='Events 7').id,)), html)
+
+    def test_new_calendar(self):
+        with self.assertNumQueries(1):
+            html = NewCalendar(2030, 3).formatmonth()
+        self.assertEqual(html.count('<a href='), 28)
+        event = CalendarEvent.objects.get(booker_data='Booker 7')
+        self.assertIn(reverse('reservation:event_details', args=(event.id,)), html)
+        self.assertNotIn('April', html)
+
+
+class CalendarCacheTest(TestCase):
+    """ Rendered months are cached and dropped when one of their events changes """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hits_and_misses(self):
+        get_cached_month('calendar', 2030, 3, lambda: 'march')
+        self.assertEqual(get_cached_month('calendar', 2030, 3, lambda: 'stale'), 'march')
+        self.assertEqual(get_cache_stats('calendar'), {'hits': 1, 'misses': 1})
+
+    def test_view_uses_cache(self):
+        self.client.get(reverse('reservation:calendar'), {'month': '2030/3'})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('reservation:calendar'), {'month': '2030/3'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_save_invalidates_old_and_new_month(self):
+        event = CalendarEvent.objects.create(booker_data='Booker', start_time=datetime(2030, 3, 5, 9, 0))
+        for month in (3, 4, 5):
+            get_cached_month('calendar', 2030, month, lambda: 'html')
+
+        event.start_time = datetime(2030, 4, 5, 9, 0)
+        event.save()
+        self.assertIsNone(cache.get(calendar_cache_key('calendar', 2030, 3)))
+        self.assertIsNone(cache.get(calendar_cache_key('calendar', 2030, 4)))
+        self.assertEqual(cache.get(calendar_cache_key('calendar', 2030, 5)), 'html')
+
+    def test_delete_invalidates_month(self):
+        event = Event.objects.create(title='Event', day=date(2030, 3, 5), start_time=time(10, 0), end_time=time(11, 0))
+        get_cached_month('show_events', 2030, 3, lambda: 'html')
+        event.delete()
+        self.assertIsNone(cache.get(calendar_cache_key('show_events', 2030, 3)))
+
+    def test_multi_month_event_invalidates_every_month(self):
+        for month in (1, 2, 3):
+            get_cached_month('events', 2030, month, lambda: 'html')
+        Events.objects.create(title='Long', description='-',
+                              start=datetime(2030, 1, 30, 10, 0), end=datetime(2030, 3, 2, 10, 0))
+        for month in (1, 2, 3):
+            self.assertIsNone(cache.get(calendar_cache_key('events', 2030, month)))
+
+
+class OverlapTest(TestCase):
+    """ Overlapping bookings are found by the database, touching ones are allowed """
+
+    def test_calendar_event_overlap(self):
+        CalendarEvent.objects.create(booker_data='First', start_time=datetime(2030, 3, 5, 9, 0), duration=120)
+        with self.assertRaises(ValidationError):
+            CalendarEvent.objects.create(booker_data='Second', start_time=datetime(2030, 3, 5, 10, 30))
+        CalendarEvent.objects.create(booker_data='After', start_time=datetime(2030, 3, 5, 11, 0))
+        CalendarEvent.objects.create(booker_data='Cancelled', start_time=datetime(2030, 3, 5, 9, 30), cancel_event=True)
+        self.assertEqual(CalendarEvent.objects.count(), 3)
+
+    def test_calendar_event_clean(self):
+        first = CalendarEvent.objects.create(booker_data='First', start_time=datetime(2030, 3, 5, 9, 0))
+        second = CalendarEvent(booker_data='Second', start_time=datetime(2030, 3, 5, 8, 30))
+        with self.assertNumQueries(1), self.assertRaises(ValidationError):
+            second.clean()
+        first.save()  # an event never overlaps itself
+
+    def test_event_overlap(self):
+        Event.objects.create(title='First', day=date(2030, 3, 5), start_time=time(10, 0), end_time=time(11, 0))
+        for start, end in ((time(10, 30), time(12, 0)), (time(9, 0), time(12, 0)), (time(10, 0), time(11, 0))):
+            with self.assertRaises(ValidationError):
+                Event(title='Second', day=date(2030, 3, 5), start_time=start, end_time=end).clean()
+        Event(title='Touching', day=date(2030, 3, 5), start_time=time(11, 0), end_time=time(12, 0)).clean()
+        Event(title='Other day', day=date(2030, 3, 6), start_time=time(10, 0), end_time=time(11, 0)).clean()
+
+
+class ConcurrentBookingTest(TransactionTestCase):
+    """ Parallel bookings of the same slot end up with a single reservation """
+
+    def book(self, results, booker):
+        try:
+            CalendarEvent.objects.create(booker_data=booker, start_time=datetime(2030, 3, 5, 9, 0))
+            results.append(True)
+        except ValidationError:
+            results.append(False)
+        finally:
+            connection.close()
+
+    def test_parallel_bookings(self):
+        results = []
+        threads = [threading.Thread(target=self.book, args=(results, f'Booker {i}')) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(results.count(False), 7)
+        self.assertEqual(CalendarEvent.objects.count(), 1)
+
+
+class ImportExportTest(TestCase):
+    """ Bulk import through the management command and streaming export """
+
+    def import_file(self, content, suffix):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_reservations', f.name, batch_size=2, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_csv(self):
+        CalendarEvent.objects.create(booker_data='Stored', start_time=datetime(2030, 3, 5, 12, 0))
+        out, err = self.import_file(
+            'booker_data,start_time,duration,notes\n'
+            'Anna,2030-03-05 09:00,90,\n'
+            'Clash,2030-03-05 10:00,60,\n'  # overlaps the row above
+            'Bob,2030-03-05 11:00,60,a note\n'
+            'Late,2030-03-05 12:30,30,\n'  # overlaps the stored reservation
+            'Bad,2030-03-05 14:00,45,\n', '.csv')  # not a valid duration
+
+        self.assertIn('Imported 2 reservations, skipped 3.', out)
+        self.assertIn('line 3: overlaps an earlier row of the import', err)
+        self.assertIn('line 5: overlaps reservation', err)
+        self.assertIn('line 6: duration', err)
+        anna = CalendarEvent.objects.get(booker_data='Anna')
+        self.assertEqual(anna.end_time, datetime(2030, 3, 5, 10, 30))
+
+    def test_import_jsonl(self):
+        out, err = self.import_file(
+            '{"booker_data": "Anna", "start_time": "2030-03-05T09:00:00"}\n'
+            'not json\n'
+            '{"booker_data": "Bob", "start_time": "2030-03-05T10:00:00", "duration": 30}\n', '.jsonl')
+        self.assertIn('Imported 2 reservations, skipped 1.', out)
+        self.assertIn('line 2:', err)
+
+    def test_export(self):
+        CalendarEvent.objects.create(booker_data='Anna', start_time=datetime(2030, 3, 5, 9, 0))
+        url = reverse('reservation:export_events', args=('csv',))
+        self.assertEqual(self.client.get(url).status_code, 302)  # staff only
+
+        self.client.force_login(User.objects.create_user('staff', password='x', is_staff=True))
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,booker_data,start_time,duration,end_time,notes,cancel_event')
+        self.assertIn('Anna', lines[1])
+
+
+class ReservationStatsTest(TestCase):
+    """ Dashboard statistics follow every change of CalendarEvent """
+
+    def assertMatchesTable(self, today):
+        events = CalendarEvent.objects.get_all_events()
+        running = events.filter(end_time__gte=today)
+        summary = ReservationStats.objects.summary(today)
+        self.assertEqual(summary['total_events'], events.count())
+        self.assertEqual(summary['running_events'], running.count())
+        self.assertEqual(summary['past_events'], events.count() - running.count())
+        return summary
+
+    def test_incremental_updates(self):
+        first = CalendarEvent.objects.create(booker_data='First', start_time=datetime(2030, 3, 4, 23, 30))
+        second = CalendarEvent.objects.create(booker_data='Second', start_time=datetime(2030, 3, 6, 9, 0), duration=30)
+        CalendarEvent.objects.create(booker_data='Third', start_time=datetime(2030, 3, 7, 9, 0), cancel_event=True)
+        summary = self.assertMatchesTable(date(2030, 3, 5))
+        self.assertEqual(summary['total_events'], 2)
+        self.assertEqual(summary['running_events'], 2)  # the first one ends on the 5th
+        self.assertEqual(dict(summary['per_duration'])['30 minutes'], 1)
+
+        second.start_time = datetime(2030, 3, 8, 9, 0)
+        second.duration = 120
+        second.save()
+        first.cancel_event = True
+        first.save()
+        summary = self.assertMatchesTable(date(2030, 3, 5))
+        self.assertEqual(dict(summary['per_duration']), {'30 minutes': 0, '1 hour': 0, '1.5 hours': 0, '2 hours': 1})
+
+        second.delete()
+        self.assertMatchesTable(date(2030, 3, 5))
+
+    def test_per_day_and_rebuild(self):
+        for hour in (9, 11, 13):
+            CalendarEvent.objects.create(booker_data='Booker', start_time=datetime(2030, 3, 5, hour, 0))
+        CalendarEvent.objects.create(booker_data='Booker', start_time=datetime(2030, 3, 6, 9, 0))
+        per_day = [(row['day'], row['total']) for row in
+                   ReservationStats.objects.per_day(date(2030, 3, 1), date(2030, 3, 8))]
+        self.assertEqual(per_day, [(date(2030, 3, 5), 3), (date(2030, 3, 6), 1)])
+
+        ReservationStats.objects.all().delete()
+        ReservationStats.objects.rebuild()
+        self.assertEqual(self.assertMatchesTable(date(2030, 3, 1))['total_events'], 4)
+
+    def test_dashboard_queries(self):
+        CalendarEvent.objects.create(booker_data='Booker', start_time=datetime(2030, 3, 5, 9, 0))
+        # summary, per-day breakdown and the latest reservations
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('reservation:calendar_dashboard'))
+        self.assertEqual(response.context['total_events'], 1)
+
+
+@skipUnlessDBFeature('supports_explaining_query_execution')
+class QueryPlanTest(TestCase):
+    """ Time-range lookups are answered from the indexes """
+
+    def assertUsesIndex(self, queryset, model, fields):
+        index = next(index for index in model._meta.indexes if index.fields == fields)
+        plan = queryset.explain()
+        if connection.vendor == 'sqlite':
+            self.assertIn(f'INDEX {index.name}', plan)
+
+    def assertSeeks(self, queryset):
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('SCAN', queryset.explain())
+
+    def test_running_events(self):
+        midnight = datetime.combine(date.today(), time.min)
+        overnight = CalendarEvent.objects.create(booker_data='A', start_time=midnight - timedelta(minutes=90), duration=120)
+        CalendarEvent.objects.create(booker_data='B', start_time=midnight - timedelta(hours=4), duration=120)
+        running = CalendarEvent.objects.get_running_events()
+        self.assertEqual(list(running), [overnight])
+        self.assertUsesIndex(running, CalendarEvent, ['start_time'])
+        self.assertSeeks(running)
+        self.assertSeeks(running.order_by('-start_time'))  # RunningEventListView
+
+    def test_month_ranges(self):
+        for calendar, fields in ((NewCalendar, ['start_time']), (Calendar, ['start']), (EventCalendar, ['day', 'start_time'])):
+            queryset = calendar().get_month_queryset(2030, 3)
+            self.assertUsesIndex(queryset, calendar.model, fields)
+            self.assertSeeks(queryset)
+
+    def test_availability_window(self):
+        # bounded on both sides, the history before the window isn't walked
+        queryset = busy_intervals(datetime(2030, 3, 1), datetime(2030, 4, 1))
+        self.assertUsesIndex(queryset, CalendarEvent, ['start_time'])
+        if connection.vendor == 'sqlite':
+            self.assertIn('start_time>? AND start_time<?', queryset.explain())
+
+    def test_overlap_lookups(self):
+        event = Event(title='Event', day=date(2030, 3, 5), start_time=time(10, 0), end_time=time(11, 0))
+        queryset = Event.objects.filter(day=event.day, start_time__lt=event.end_time, end_time__gt=event.start_time)
+        self.assertUsesIndex(queryset, Event, ['day', 'start_time'])
+
+
+class ReservationSearchTest(TestCase):
+    """ Reservation search with ranked results and keyset pagination """
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(30):
+            CalendarEvent.objects.create(booker_data=f'Anna Kowalska {i}', notes='window seat',
+                                         start_time=datetime(2030, 3, 1, 9, 0) + timedelta(hours=3 * i))
+        cls.smith = CalendarEvent.objects.create(booker_data='John Smith', notes='Smith family, smith@example.com',
+                                                 start_time=datetime(2031, 1, 1, 9, 0))
+        CalendarEvent.objects.create(booker_data='Johnny Blacksmith', start_time=datetime(2031, 1, 2, 9, 0))
+
+    def test_substring_and_rank(self):
+        events, next_cursor = search_events('SMITH')
+        self.assertEqual(events[0], self.smith)
+        self.assertEqual(len(events), 2)
+        self.assertIsNone(next_cursor)
+        self.assertEqual(search_events('seat')[0][0].booker_data[:4], 'Anna')
+
+    def test_keyset_pagination(self):
+        seen = []
+        events, cursor = search_events('kowalska', limit=12)
+        seen += events
+        while cursor:
+            events, cursor = search_events('kowalska', cursor=cursor, limit=12)
+            seen += events
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len(set(seen)), 30)
+
+    def test_short_query_and_bad_cursor(self):
+        self.assertEqual(len(search_events('jo')[0]), 2)
+        self.assertEqual(search_events('smith', cursor='garbage'), ([], None))
+
+    def test_index_follows_changes(self):
+        self.smith.booker_data = 'Jane Doe'
+        self.smith.notes = ''
+        self.smith.save()
+        self.assertEqual([event.booker_data for event in search_events('smith')[0]], ['Johnny Blacksmith'])
+        self.smith.delete()
+        self.assertEqual(search_events('doe'), ([], None))
+
+    def test_index_table_is_looked_up_again(self):
+        self.addCleanup(reset_tables)
+        with mock.patch.object(connection.introspection, 'table_names', return_value=[]):
+            reset_tables()
+            self.assertFalse(fts_available())
+            self.assertEqual(len(search_events('smith')[0]), 2)
+        reset_tables()
+        self.assertEqual(fts_available(), connection.vendor == 'sqlite')
+
+    def test_view(self):
+        response = self.client.post(reverse('reservation:search_event'), {'search': 'kowalska'})
+        self.assertEqual(len(response.context['searched']), 25)
+        response = self.client.get(reverse('reservation:search_event'),
+                                   {'search': 'kowalska', 'after': response.context['next_cursor']})
+        self.assertEqual(len(response.context['searched']), 5)
+
+
+class CalendarFeedTest(TestCase):
+    """ ICS feeds with conditional GET """
+
+    def test_feed_and_not_modified(self):
+        CalendarEvent.objects.create(booker_data='Anna; Kowalska', notes='line one\nline two',
+                                     start_time=datetime(2030, 3, 5, 9, 0))
+        url = reverse('reservation:calendar_feed', args=('calendar',))
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertIn('DTSTART:20300305T090000\r\n', body)
+        self.assertIn('SUMMARY:Reservation', body)
+        self.assertIn('Anna\\; Kowalska', body)
+        self.assertIn('DESCRIPTION:line one\\nline two', body)
+
+        # the watermark is the only row read on an unchanged poll
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_change_updates_etag(self):
+        url = reverse('reservation:calendar_feed', args=('show_events',))
+        etag = self.client.get(url)['ETag']
+        Event.objects.create(title='Event', day=date(2030, 3, 5), start_time=time(10, 0), end_time=time(11, 0))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('DTEND:20300305T110000', b''.join(response.streaming_content).decode())
+
+    def test_unknown_feed(self):
+        self.assertEqual(self.client.get(reverse('reservation:calendar_feed', args=('nope',))).status_code, 404)
+
+    def test_long_lines_are_folded(self):
+        lines = fold('SUMMARY:' + 'ż' * 100).split('\r\n')
+        self.assertTrue(all(len(line.encode()) <= 75 for line in lines))
+        self.assertTrue(all(line.startswith(' ') for line in lines[1:-1]))
+
+
+class CalendarApiTest(TestCase):
+    """ JSON events of a [start, end) window with cursor pagination """
+
+    def get(self, kind, **params):
+        return self.client.get(reverse('reservation:calendar_api', args=(kind,)), params)
+
+    def test_window_and_pagination(self):
+        for day in range(1, 11):
+            CalendarEvent.objects.create(booker_data=f'Booker {day}', start_time=datetime(2030, 3, day, 9, 0))
+        seen = []
+        response = self.get('calendar', start='2030-03-03', end='2030-03-08T09:30', limit=2)
+        while True:
+            data = response.json()
+            seen += [event['title'] for event in data['events']]
+            if not data['next']:
+                break
+            response = self.get('calendar', start='2030-03-03', end='2030-03-08T09:30', limit=2, after=data['next'])
+        self.assertEqual(seen, [f'Booker {day}' for day in range(3, 9)])
+        self.assertIn('max-age=60', response['Cache-Control'])
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_event_window(self):
+        for day in (4, 5, 6):
+            Event.objects.create(title=f'Event {day}', day=date(2030, 3, day), start_time=time(10, 0), end_time=time(11, 0))
+        data = self.get('show_events', start='2030-03-04T10:30', end='2030-03-06T10:00').json()
+        self.assertEqual([event['title'] for event in data['events']], ['Event 4', 'Event 5'])
+        self.assertEqual(data['events'][0]['start'], '2030-03-04T10:00:00')
+        event = Event.objects.get(title='Event 4')
+        self.assertEqual(data['events'][0]['url'], reverse('reservation:edit_show_events', args=(event.id,)))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.get('events', start='2030-03-04').status_code, 400)
+        self.assertEqual(self.get('events', start='2030-03-04', end='2030-03-01').status_code, 400)
+        self.assertEqual(self.get('events', start='2030-03-01', end='2030-03-04', after='junk').status_code, 400)
+        self.assertEqual(self.get('nope', start='2030-03-01', end='2030-03-04').status_code, 404)
+
+
+class AvailabilityTest(TestCase):
+    """ Free slots between the active reservations """
+
+    def test_free_slots(self):
+        CalendarEvent.objects.create(booker_data='A', start_time=datetime(2030, 3, 5, 9, 0), duration=90)
+        CalendarEvent.objects.create(booker_data='B', start_time=datetime(2030, 3, 5, 11, 0), duration=30)
+        CalendarEvent.objects.create(booker_data='C', start_time=datetime(2030, 3, 5, 10, 30), cancel_event=True)
+        with self.assertNumQueries(1):
+            slots = free_slots(datetime(2030, 3, 5, 8, 15), datetime(2030, 3, 5, 13, 0), 60)
+        starts = [slot_start.strftime('%H:%M') for slot_start, slot_end in slots]
+        self.assertEqual(starts, ['11:30', '12:00'])
+        self.assertEqual(len(free_slots(datetime(2030, 3, 5, 8, 15), datetime(2030, 3, 5, 13, 0), 30)), 5)
+
+    def test_booking_started_before_the_window(self):
+        CalendarEvent.objects.create(booker_data='A', start_time=datetime(2030, 3, 5, 7, 0), duration=120)
+        slots = free_slots(datetime(2030, 3, 5, 8, 0), datetime(2030, 3, 5, 11, 0), 60)
+        self.assertEqual(slots[0][0], datetime(2030, 3, 5, 9, 0))
+
+    def test_slots_can_be_booked(self):
+        CalendarEvent.objects.create(booker_data='A', start_time=datetime(2030, 3, 5, 9, 0), duration=120)
+        for slot_start, slot_end in free_slots(datetime(2030, 3, 5, 6, 0), datetime(2030, 3, 5, 14, 0), 90, step=15):
+            CalendarEvent(booker_data='B', start_time=slot_start, duration=90).clean()
+
+    def test_views(self):
+        url = reverse('reservation:availability_api')
+        data = self.client.get(url, {'start': '2030-03-05', 'end': '2030-03-06', 'duration': 120}).json()
+        self.assertEqual(len(data['slots']), 45)
+        self.assertEqual(self.client.get(url, {'duration': 45}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start': '2030-03-05', 'end': '2030-06-05'}).status_code, 400)
+
+        response = self.client.get(reverse('reservation:availability'), {'start': '2030-03-05', 'end': '2030-03-06'},
+                                   HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(response, 'reservation/free-slots.html')
+        self.assertTemplateNotUsed(response, 'reservation/availability.html')
+
+    def test_errors_do_not_echo_html(self):
+        response = self.client.get(reverse('reservation:availability'), {'start': '<script>alert(1)</script>'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('error', response.json())
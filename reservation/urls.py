@@ -15,6 +15,11 @@ urlpatterns = [
     path('running-event-list/', views.RunningEventListView.as_view(), name='running_event'),
     path('calendar-dashboard/', views.DashboardView.as_view(), name='calendar_dashboard'),
     path('search-event/', views.search_event, name='search_event'),
+    path('export/<str:file_format>/', views.export_events, name='export_events'),
+    path('feeds/<str:kind>.ics', views.calendar_feed, name='calendar_feed'),
+    path('api/<str:kind>/events/', views.calendar_api, name='calendar_api'),
+    path('api/availability/', views.availability_api, name='availability_api'),
+    path('availability/', views.availability, name='availability'),
 
     path('events/', views.EventsView.as_view(), name='events'),
     path('events/new/', views.event, name='new_events'),
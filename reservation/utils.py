@@ -1,26 +1,82 @@
 from datetime import datetime as dtime, date, time
 from calendar import HTMLCalendar
+from collections import defaultdict
+
+from django.urls import reverse
 from pytz import timezone
 from .models import Events, Event, CalendarEvent
 
 
-class EventCalendar(HTMLCalendar):
+def month_range(year, month):
+    """ First day of the month and first day of the next one """
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def url_pattern(url_name):
+    """ '%d' pattern of a url taking a single id, e.g. '/reservation/event/%d/details/' """
+    prefix, suffix = reverse(url_name, args=(0,)).rsplit('0', 1)
+    return prefix + '%d' + suffix
+
+
+class MonthEventsMixin:
+    """
+    Fetch a whole month of events with a single query and bucket them by day.
+
+    Subclasses describe what to load through ``model``, ``date_field`` (the field the
+    month is filtered and bucketed on), ``fields`` (the only columns that are selected)
+    and ``url_name`` (the edit/details url of a single event).
+    """
+    model = None
+    date_field = None
+    fields = ()
+    ordering = ()
+    url_name = None
+
+    def get_url_pattern(self):
+        # resolve the url once per month instead of calling reverse() for every event
+        return url_pattern(self.url_name)
+
+    def get_month_queryset(self, year, month):
+        # a half-open [first day, first day of next month) range can use the index on date_field,
+        # __year/__month lookups are function calls on the column
+        start, end = month_range(year, month)
+        lookups = {f'{self.date_field}__gte': start, f'{self.date_field}__lt': end}
+        return self.model.objects.filter(**lookups).order_by(*self.ordering).values(*self.fields)
+
+    def get_month_events(self, year, month):
+        events = defaultdict(list)
+        for row in self.get_month_queryset(year, month):
+            events[row[self.date_field].day].append(row)
+        return events
+
+
+class EventCalendar(MonthEventsMixin, HTMLCalendar):
+    model = Event
+    date_field = 'day'
+    fields = ('id', 'title', 'day', 'start_time', 'end_time')
+    ordering = ('start_time',)
+    url_name = 'reservation:edit_show_events'
+
     def __init__(self, events=None):
         super(EventCalendar, self).__init__()
         self.events = events
+        self.url_pattern = None
 
     def formatday(self, day: int, weekday: int, events):
         """
         Return a day as a table cell.
         """
-        events_from_day = events.filter(day__day=day)
-        events_html = '<div style="height:120px;width:170px;overflow: auto">'
-        for event in events_from_day:
-            events_html += f'&nbsp;&nbsp; {event.get_html_url} &nbsp;&nbsp;({event.start_time:%H:%M} - {event.end_time:%H:%M}) &nbsp; <br/><br/>'
         if day == 0:
             return '<td class="date">&nbsp;</td>'  # day outside month
-        else:
-            return '<td class="%s">%d%s</td></div>' % (self.cssclasses[weekday], day, events_html)
+
+        events_html = ['<div style="height:120px;width:170px;overflow: auto">']
+        for event in events.get(day, ()):
+            url = self.url_pattern % event['id']
+            events_html.append(f'&nbsp;&nbsp; <a href="{url}"> {event["title"]} </a> &nbsp;&nbsp;'
+                               f'({event["start_time"]:%H:%M} - {event["end_time"]:%H:%M}) &nbsp; <br/><br/>')
+        return '<td class="%s">%d%s</td></div>' % (self.cssclasses[weekday], day, ''.join(events_html))
 
     def formatweek(self, theweek: int, events):
         """
@@ -33,7 +89,8 @@ class EventCalendar(HTMLCalendar):
         """
         Return a formatted month as a table.
         """
-        events = Event.objects.filter(day__month=themonth)
+        events = self.get_month_events(theyear, themonth)
+        self.url_pattern = self.get_url_pattern()
 
         v = []
         a = v.append
@@ -51,74 +108,89 @@ class EventCalendar(HTMLCalendar):
         return ''.join(v)
 
 
-class Calendar(HTMLCalendar):
+class Calendar(MonthEventsMixin, HTMLCalendar):
+    model = Events
+    date_field = 'start'
+    fields = ('id', 'title', 'start', 'end')
+    ordering = ('start',)
+    url_name = 'reservation:edit_events'
+
     def __init__(self, year=None, month=None):
         self.year = year
         self.month = month
+        self.url_pattern = None
         super(Calendar, self).__init__()
 
     # formats a day as a td
-    # filter events by day
+    # events are already bucketed by day
     def formatday(self, day: int, events):
-        events_per_day = events.filter(start__day=day)
-        d = '<div style="height:120px;width:150px;overflow: auto">'
-        for event in events_per_day:
-            d += f'{event.get_html_url}&nbsp;({event.start.time().strftime("%H:%M")} - {event.end.strftime("%H:%M %d/%m")})<br/><br/>'
-        if day != 0:
-            return f"<td><span class='date'>{day}</span><ul>{d}</ul></td></div>"
-        return '<td></td>'
+        if day == 0:
+            return '<td></td>'
+
+        d = ['<div style="height:120px;width:150px;overflow: auto">']
+        for event in events.get(day, ()):
+            url = self.url_pattern % event['id']
+            d.append(f'<a href="{url}"> {event["title"]} </a>&nbsp;'
+                     f'({event["start"].time().strftime("%H:%M")} - {event["end"].strftime("%H:%M %d/%m")})<br/><br/>')
+        return f"<td><span class='date'>{day}</span><ul>{''.join(d)}</ul></td></div>"
 
     # formats a week as a tr
     def formatweek(self, theweek: int, events):
-        week = ''
-        for d, weekday in theweek:
-            week += self.formatday(d, events)
+        week = ''.join(self.formatday(d, events) for d, weekday in theweek)
         return f'<tr>{week}</tr><div/>'
 
     # formats a month as a table
-    # filter events by year and month
+    # events of the month are fetched once and grouped by day
     def formatmonth(self, withyear: bool = True):
-        events = Events.objects.filter(start__year=self.year, start__month=self.month)
-        cal = f'<table border="2" cellpadding="10" cellspacing="30" class="month">\n'
-        cal += f'{self.formatmonthname(self.year, self.month, withyear=withyear)}\n'
-        cal += f'{self.formatweekheader()}\n'
+        events = self.get_month_events(self.year, self.month)
+        self.url_pattern = self.get_url_pattern()
+
+        cal = [f'<table border="2" cellpadding="10" cellspacing="30" class="month">\n',
+               f'{self.formatmonthname(self.year, self.month, withyear=withyear)}\n',
+               f'{self.formatweekheader()}\n']
         for week in self.monthdays2calendar(self.year, self.month):
-            cal += f'{self.formatweek(week, events)}\n'
-        cal += f'<table/>\n'
+            cal.append(f'{self.formatweek(week, events)}\n')
+        cal.append(f'<table/>\n')
+
+        return ''.join(cal)
 
-        return cal
 
+class NewCalendar(MonthEventsMixin, HTMLCalendar):
+    model = CalendarEvent
+    date_field = 'start_time'
+    fields = ('id', 'booker_data', 'start_time')
+    ordering = ('start_time', 'id')
+    url_name = 'reservation:event_details'
 
-class NewCalendar(HTMLCalendar):
     def __init__(self, year=None, month=None):
         self.year = year
         self.month = month
+        self.url_pattern = None
         super(NewCalendar, self).__init__()
 
     def formatday(self, day, events):
-        events_per_day = events.filter(start_time__day=day)
-        d = "<div style='height:120px;width:150px;overflow: auto;'>"
-        for event in events_per_day:
-            d += f"<li>Res.{event.id}:&nbsp;&nbsp; {event.get_html_url} </li>"
-        if day != 0:
-            return f"<td><span class='date'>&nbsp;&nbsp;&nbsp;{day}</span><ul> {d} </ul></td>"
-        return "<td></td>"
+        if day == 0:
+            return "<td></td>"
+
+        d = ["<div style='height:120px;width:150px;overflow: auto;'>"]
+        for event in events.get(day, ()):
+            url = self.url_pattern % event['id']
+            d.append(f"<li>Res.{event['id']}:&nbsp;&nbsp; <a href=\"{url}\"> {event['booker_data']} </a> </li>")
+        return f"<td><span class='date'>&nbsp;&nbsp;&nbsp;{day}</span><ul> {''.join(d)} </ul></td>"
 
     def formatweek(self, theweek, events):
-        week = ""
-        for d, weekday in theweek:
-            week += self.formatday(d, events)
+        week = "".join(self.formatday(d, events) for d, weekday in theweek)
         return f"<tr> {week} </tr><div/>"
 
     def formatmonth(self, withyear=True):
-        events = CalendarEvent.objects.filter(
-            start_time__year=self.year, start_time__month=self.month
-        )
-        cal = '<table border="0" cellpadding="0" cellspacing="0" class="calendar" style="font-size:13px">\n'
-        cal += f'{self.formatmonthname(self.year, self.month, withyear=withyear)}\n'
-        cal += f'{self.formatweekheader()}\n'
+        events = self.get_month_events(self.year, self.month)
+        self.url_pattern = self.get_url_pattern()
+
+        cal = ['<table border="0" cellpadding="0" cellspacing="0" class="calendar" style="font-size:13px">\n',
+               f'{self.formatmonthname(self.year, self.month, withyear=withyear)}\n',
+               f'{self.formatweekheader()}\n']
         for week in self.monthdays2calendar(self.year, self.month):
-            cal += f'{self.formatweek(week, events)}\n'
-        cal += f'<table/>\n'
+            cal.append(f'{self.formatweek(week, events)}\n')
+        cal.append(f'<table/>\n')
 
-        return cal
\ No newline at end of file
+        return ''.join(cal)
@@ -6,14 +6,23 @@ from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.core.exceptions import ValidationError
 from django.db.models import Q
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, StreamingHttpResponse, Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition
 from django.views.generic import ListView, UpdateView, View
 
+from .api import API_CALENDARS, MAX_LIMIT, parse_bound, window_events
+from .availability import MAX_WINDOW, free_slots
+from .bulk import export_rows
+from .cache import get_cached_month
 from .forms import CalendarEventForm, EventsForm, EventForm
-from .models import Event, Events, CalendarEvent
+from .ics import FEEDS, feed_lines
+from .models import Event, Events, CalendarEvent, CalendarEventDuration, CalendarWatermark, ReservationStats
+from .search import search_events
 from .utils import Calendar, EventCalendar, NewCalendar
 
 
@@ -47,7 +56,8 @@ class ShowEventsView(ListView):
         context['next_month'] = 'day__gte=' + str(next_month)
 
         cal = EventCalendar()
-        html_cal = cal.formatmonth(d.year, d.month, withyear=True)
+        html_cal = get_cached_month('show_events', d.year, d.month,
+                                    lambda: cal.formatmonth(d.year, d.month, withyear=True))
         html_cal = html_cal.replace('<td ', '<td  width="150" height="150"')
         context['calendar'] = mark_safe(html_cal)
 
@@ -62,7 +72,7 @@ class EventsView(ListView):
         context = super().get_context_data(**kwargs)
         d = get_date(self.request.GET.get('month', None))
         cal = Calendar(d.year, d.month)
-        html_cal = cal.formatmonth(withyear=True)
+        html_cal = get_cached_month('events', d.year, d.month, lambda: cal.formatmonth(withyear=True))
         context['calendar'] = mark_safe(html_cal)
         context['prev_month'] = prev_month(d)
         context['next_month'] = next_month(d)
@@ -99,7 +109,7 @@ class CalendarView(ListView):
         context = super().get_context_data(**kwargs)
         d = get_date(self.request.GET.get("month", None))
         cal = NewCalendar(d.year, d.month)
-        html_cal = cal.formatmonth(withyear=True)
+        html_cal = get_cached_month('calendar', d.year, d.month, lambda: cal.formatmonth(withyear=True))
         context["calendar"] = mark_safe(html_cal)
         context["prev_month"] = prev_month(d)
         context["next_month"] = next_month(d)
@@ -132,15 +142,10 @@ class DashboardView(View):
     template_name = "reservation/reservation-dashboard.html"
 
     def get(self, request, *args, **kwargs):
-        events = CalendarEvent.objects.get_all_events()
-        running_events = CalendarEvent.objects.get_running_events()
-        latest_events = CalendarEvent.objects.order_by("-id")[:10]
-        context = {
-            "total_events": events.count(),
-            "running_events": running_events,
-            "latest_events": latest_events,
-            "past_events": events.count() - running_events.count()
-        }
+        today = date.today()
+        context = ReservationStats.objects.summary(today)
+        context["upcoming_days"] = ReservationStats.objects.per_day(today, today + timedelta(days=7))
+        context["latest_events"] = CalendarEvent.objects.order_by("-id")[:10]
         return render(request, self.template_name, context)
 
 # def create_event(request):
@@ -167,10 +172,14 @@ class DashboardView(View):
 def add_event(request):
     form = CalendarEventForm(request.POST or None)
     if request.method == "POST" and form.is_valid():
-        form.save()
-        messages.info(request, 'New Event has been created.')
-        # return redirect('main:home')
-        return redirect('reservation:calendar')
+        try:
+            form.save()
+        except ValidationError as error:  # the slot was booked after the form was validated
+            form.add_error(None, error)
+        else:
+            messages.info(request, 'New Event has been created.')
+            # return redirect('main:home')
+            return redirect('reservation:calendar')
     return render(request, 'reservation/event.html', {'form': form})
 
 
@@ -189,6 +198,13 @@ class EventEdit(UpdateView):
     # fields = ["booker_data", "duration", "start_time", "notes"]
     template_name = 'reservation/event.html'
 
+    def form_valid(self, form):
+        try:
+            return super(EventEdit, self).form_valid(form)
+        except ValidationError as error:  # the slot was booked after the form was validated
+            form.add_error(None, error)
+            return self.form_invalid(form)
+
     # def form_valid(self, form):
     #     if form.cleaned_data['start_time'] <= datetime.now():
     #         form.add_error("start_time", "You can't edit past events.")
@@ -257,9 +273,14 @@ def show_events(request, event_id=None):
 
     if request.POST:
         if form.is_valid():
-            form.save()
-            messages.info(request, f'Your Event "{instance.title[:20]}..." Has Been Added.')
-            return HttpResponseRedirect(reverse('reservation:show_events'))
+            try:
+                form.save()
+            except ValidationError as error:  # the slot was booked after the form was validated
+                form.add_error(None, error)
+                messages.error(request, 'Please correct the error below.')
+            else:
+                messages.info(request, f'Your Event "{instance.title[:20]}..." Has Been Added.')
+                return HttpResponseRedirect(reverse('reservation:show_events'))
         else:
             messages.error(request, 'Please correct the error below.')
             # for error in list(form.errors.values()):
@@ -268,13 +289,112 @@ def show_events(request, event_id=None):
 
 
 def search_event(request):
-    if request.method == 'POST':
-        search_reservation = request.POST['search']
-        searched = CalendarEvent.objects.filter(booker_data__contains=search_reservation)
-        return render(request, 'reservation/search-event.html', {'search_reservation': search_reservation, 'searched': searched})
-    else:
-        reservation = CalendarEvent.objects.all().order_by("-start_time")
-        return render(request, 'reservation/search-event.html', {'reservation': reservation})
+    search_reservation = request.POST.get('search') or request.GET.get('search', '')
+    if search_reservation:
+        searched, next_cursor = search_events(search_reservation, cursor=request.GET.get('after'))
+        return render(request, 'reservation/search-event.html', {'search_reservation': search_reservation,
+                                                                 'searched': searched, 'next_cursor': next_cursor})
+    return render(request, 'reservation/search-event.html', {})
+
+
+@staff_member_required
+def export_events(request, file_format='csv'):
+    if file_format not in ('csv', 'jsonl'):
+        raise Http404
+    content_type = 'text/csv' if file_format == 'csv' else 'application/jsonl'
+    response = StreamingHttpResponse(export_rows(file_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="reservations.{file_format}"'
+    return response
+
+
+def calendar_updated_at(request, kind):
+    """ Last change of the calendar, read once per request for both the ETag and Last-Modified """
+    if not hasattr(request, '_calendar_updated_at'):
+        updated_at = CalendarWatermark.objects.get_updated_at(kind) if kind in FEEDS else None
+        request._calendar_updated_at = updated_at
+    return request._calendar_updated_at
+
+
+def calendar_etag(request, kind):
+    updated_at = calendar_updated_at(request, kind)
+    return f'"{kind}-{updated_at.timestamp()}"' if updated_at else None
+
+
+def calendar_last_modified(request, kind):
+    updated_at = calendar_updated_at(request, kind)
+    return timezone.make_aware(updated_at) if updated_at else None
+
+
+@condition(etag_func=calendar_etag, last_modified_func=calendar_last_modified)
+def calendar_feed(request, kind):
+    """ ICS feed of a calendar, a poll with a matching ETag/Last-Modified gets a 304 without reading the events """
+    if kind not in FEEDS:
+        raise Http404
+    updated_at = calendar_updated_at(request, kind) or datetime.now()
+    response = StreamingHttpResponse(feed_lines(kind, request.get_host(), updated_at),
+                                     content_type='text/calendar; charset=utf-8')
+    response['Content-Disposition'] = f'inline; filename="{kind}.ics"'
+    return response
+
+
+@condition(etag_func=calendar_etag, last_modified_func=calendar_last_modified)
+def calendar_api(request, kind):
+    """ Events overlapping the [start, end) window as JSON, for rendering calendars in the browser """
+    if kind not in API_CALENDARS:
+        raise Http404
+    try:
+        start = parse_bound(request.GET.get('start'))
+        end = parse_bound(request.GET.get('end'))
+        limit = max(1, min(int(request.GET.get('limit', 500)), MAX_LIMIT))
+        if end <= start:
+            raise ValueError('end must be after start')
+        events, next_cursor = window_events(kind, start, end, request.GET.get('after'), limit)
+    except (ValueError, ValidationError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    response = JsonResponse({'events': events, 'next': next_cursor})
+    # browsers may reuse the answer for a minute, then revalidate it with the ETag
+    patch_cache_control(response, private=True, max_age=60)
+    return response
+
+
+def availability_params(request):
+    """ Window, duration and grid step of an availability request, the next 7 days by default """
+    now = datetime.now().replace(second=0, microsecond=0)
+    start = parse_bound(request.GET['start']) if request.GET.get('start') else now
+    end = parse_bound(request.GET['end']) if request.GET.get('end') else start + timedelta(days=7)
+    duration = int(request.GET.get('duration', CalendarEventDuration.ONE_HOUR))
+    step = int(request.GET.get('step', 30))
+    if duration not in CalendarEventDuration.values:
+        raise ValueError(f'Invalid duration: {duration}')
+    if not 5 <= step <= 24 * 60:
+        raise ValueError(f'Invalid step: {step}')
+    if end <= start or end - start > MAX_WINDOW:
+        raise ValueError(f'The window must be between 1 minute and {MAX_WINDOW.days} days long')
+    return max(start, now), end, duration, step
+
+
+def availability_api(request):
+    try:
+        start, end, duration, step = availability_params(request)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    slots = free_slots(start, end, duration, step)
+    return JsonResponse({'duration': duration, 'slots': [{'start': slot_start, 'end': slot_end}
+                                                         for slot_start, slot_end in slots]})
+
+
+def availability(request):
+    """ Free slots as an HTMX fragment, or as a page of its own """
+    try:
+        start, end, duration, step = availability_params(request)
+    except ValueError as error:
+        # the message quotes the query string, it must not go back as html
+        return JsonResponse({'error': str(error)}, status=400)
+    context = {'slots': free_slots(start, end, duration, step), 'duration': duration, 'start': start, 'end': end}
+    if request.htmx:
+        return render(request, 'reservation/free-slots.html', context)
+    return render(request, 'reservation/availability.html', context)
 
 
 def some_func():